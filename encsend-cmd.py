@@ -2,34 +2,55 @@
 # -*- coding: utf-8 -*-
 
 import argparse
+import json
+import sys
+from datetime import datetime
+from time import mktime
 
-import pyodbc
-
-from encsend.client import send_message
-from encsend.server import start_encsend_server
-from encsend.sql import CREATE, DELETE, INSERT, SELECT
-from encsend.utils import create_signing_key, get_verify_key_hex
+# Only light modules are imported here, subcommands import what they
+# need, so short commands and hand-offs to the agent start fast
+from encsend.migrations import LATEST_VERSION, get_version, migrate
+from encsend.sql import DELETE, INSERT, SELECT, messages_filter
 try:
-    from encsend.conf import DSN
+    from encsend.conf import (AGENT_SOCKET, CRYPTO_BACKEND, CRYPTO_WORKERS,
+                              DSN, DISCOVERY_ADDR, DISCOVERY_ANNOUNCE_HOST,
+                              DISCOVERY_HOST, DISCOVERY_PORT, METRICS_HOST,
+                              METRICS_PORT, PORT, STREAM)
 except ImportError:
-    from encsend.conf_default import DSN
+    from encsend.conf_default import (AGENT_SOCKET, CRYPTO_BACKEND,
+                                      CRYPTO_WORKERS, DSN, DISCOVERY_ADDR,
+                                      DISCOVERY_ANNOUNCE_HOST, DISCOVERY_HOST,
+                                      DISCOVERY_PORT, METRICS_HOST,
+                                      METRICS_PORT, PORT, STREAM)
 
+# Number of rows fetched from db at once by listing commands
+FETCH_SIZE = 1000
 
-def create_tables(dsn):
-    with pyodbc.connect(DSN) as conn:
-        cur = conn.cursor()
-        cur.execute(CREATE['messages'])
-        cur.execute(CREATE['hosts'])
+
+def migrate_db(dsn, target=LATEST_VERSION):
+    from encsend.storage import connect
+    with connect(dsn) as conn:
+        for version in migrate(conn, target):
+            print('applied migration %d' % version)
+
+
+def print_db_version(dsn):
+    from encsend.storage import connect
+    with connect(dsn) as conn:
+        version = get_version(conn)
+    print('schema version: %d, latest: %d' % (version, LATEST_VERSION))
 
 
 def insert_host(key, dsn, host, port):
-    with pyodbc.connect(DSN) as conn:
+    from encsend.storage import connect
+    with connect(dsn) as conn:
         cur = conn.cursor()
         cur.execute(INSERT['hosts'], (key, host, port))
 
 
 def select_hosts(dsn):
-    with pyodbc.connect(DSN) as conn:
+    from encsend.storage import connect
+    with connect(dsn) as conn:
         cur = conn.cursor()
         cur.execute(SELECT['hosts-ls'])
         print('\t'.join(['id', 'key', 'host', 'port']))
@@ -37,27 +58,257 @@ def select_hosts(dsn):
             print('\t'.join(map(str, row)))
 
 
-def select_messages(dsn):
-    with pyodbc.connect(DSN) as conn:
+def parse_time(value):
+    """ Parse unix timestamp or ISO 8601 date and time, time without
+    timezone is local
+
+    :param value: timestamp, `2020-01-31` or `2020-01-31T12:00:00`
+    :type value: str
+    :return: timestamp in format of `datetime` column of `messages_t`
+    :rtype: int
+    """
+    try:
+        return int(value)
+    except ValueError:
+        pass
+    try:
+        dt = datetime.fromisoformat(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError('invalid time: %s' % value)
+    if dt.tzinfo is None:
+        dt = dt.astimezone()
+    # Server saves `mktime` of UTC time tuple
+    return int(mktime(dt.utctimetuple()))
+
+
+def fetch_rows(cur, size=FETCH_SIZE):
+    """ Iterate over query's rows without loading all of them to memory """
+    while True:
+        rows = cur.fetchmany(size)
+        if not rows:
+            break
+        yield from rows
+
+
+def select_messages(dsn, since=None, until=None, host_id=None, limit=None,
+                    after_id=None, ndjson=False):
+    """ Print messages ordered by id
+
+    :param dsn: Data Source Name
+    :type dsn: str
+    :param since: min message's timestamp, inclusive
+    :type since: int or None
+    :param until: max message's timestamp, exclusive
+    :type until: int or None
+    :param host_id: sender's id
+    :type host_id: int or None
+    :param limit: max number of messages
+    :type limit: int or None
+    :param after_id: print messages with bigger id, pass the last
+        printed id to get the next page
+    :type after_id: int or None
+    :param ndjson: print a json object per line instead of a table
+    :type ndjson: bool
+    """
+    from encsend.storage import connect
+    where, params = messages_filter(since, until, host_id, after_id)
+    query = SELECT['messages-filter'].format(where=where)
+    if limit is not None:
+        query += 'LIMIT ?'
+        params += (limit,)
+
+    with connect(dsn) as conn:
         cur = conn.cursor()
-        cur.execute(SELECT['messages'])
-        print('\t'.join(['id', 'message', 'host_id', 'datetime']))
-        for row in cur.fetchall():
+        cur.execute(query, params)
+        if not ndjson:
+            print('\t'.join(['id', 'message', 'host_id', 'datetime']))
+        count = 0
+        last_id = None
+        for row in fetch_rows(cur):
+            if ndjson:
+                print(json.dumps(dict(zip(
+                    ('id', 'message', 'host_id', 'datetime'), row
+                ))))
+            else:
+                print('\t'.join(map(str, row)))
+            count += 1
+            last_id = row[0]
+
+    if limit is not None and count == limit:
+        print('next page: --after-id %d' % last_id, file=sys.stderr)
+
+
+def subscribe_messages(socket_path, consumer=None, after_id=None):
+    """ Print messages pushed by server's stream socket as json lines
+    until the server closes the connection, every message is acked after
+    it's printed
+
+    :param socket_path: path to server's stream socket
+    :type socket_path: str
+    :param consumer: consumer's name, it's cursor is saved by the server
+    :type consumer: str or None
+    :param after_id: print messages after this id
+    :type after_id: int or None
+    """
+    from encsend.stream_client import StreamClient
+    try:
+        client = StreamClient(socket_path, consumer, after_id)
+    except (FileNotFoundError, ConnectionRefusedError):
+        sys.exit('error: server doesn\'t stream to %s' % socket_path)
+    with client:
+        try:
+            for message in client:
+                print(json.dumps(message), flush=True)
+                client.ack(message['id'])
+        except (KeyboardInterrupt, BrokenPipeError):
+            pass
+
+
+def select_consumers(dsn):
+    from encsend.storage import connect
+    with connect(dsn) as conn:
+        cur = conn.cursor()
+        cur.execute(SELECT['consumers-ls'])
+        print('\t'.join(['consumer', 'message_id', 'datetime']))
+        for row in fetch_rows(cur):
+            print('\t'.join(map(str, row)))
+
+
+def delete_consumer(dsn, consumer):
+    from encsend.storage import connect
+    with connect(dsn) as conn:
+        cur = conn.cursor()
+        cur.execute(DELETE['consumers'], (consumer,))
+
+
+def select_files(dsn):
+    from encsend.storage import connect
+    with connect(dsn) as conn:
+        cur = conn.cursor()
+        cur.execute(SELECT['files'])
+        print('\t'.join(['id', 'name', 'path', 'size', 'host_id',
+                         'datetime']))
+        for row in fetch_rows(cur):
             print('\t'.join(map(str, row)))
 
 
 def delete_message(dsn, message_id):
-    with pyodbc.connect(DSN) as conn:
+    from encsend.storage import connect
+    with connect(dsn) as conn:
         cur = conn.cursor()
         cur.execute(DELETE['messages-id'], (message_id,))
 
 
 def delete_all_messages(dsn):
-    with pyodbc.connect(DSN) as conn:
+    from encsend.storage import connect
+    with connect(dsn) as conn:
         cur = conn.cursor()
         cur.execute(DELETE['messages-all'])
 
 
+def delete_messages(dsn, since=None, until=None, host_id=None):
+    """ Delete messages matching all entered filters
+
+    :return: number of deleted messages
+    :rtype: int
+    """
+    from encsend.storage import connect
+    where, params = messages_filter(since, until, host_id)
+    with connect(dsn) as conn:
+        cur = conn.cursor()
+        cur.execute(DELETE['messages-filter'].format(where=where), params)
+        return cur.rowcount
+
+
+def read_batch(batch_file, key=None, host_id=None):
+    """ Read messages for batch sending from JSON Lines file
+
+    Every line is a json object with `message` and optional `key` or
+    `id` of the receiver, either of them may be a list of receivers of
+    the same message, `key` and `host_id` are used for lines without
+    receiver
+
+    :param batch_file: opened file
+    :param key: default receiver's hex encoded verify key
+    :type key: str or None
+    :param host_id: default receiver's id
+    :type host_id: int or None
+    :return: list of tuples with message, host key and host id
+    :rtype: list of (str, str or list or None, int or list or None)
+    """
+    items = []
+    for line in batch_file:
+        if not line.strip():
+            continue
+        dct = json.loads(line)
+        if 'key' in dct or 'id' in dct:
+            items.append((dct['message'], dct.get('key'), dct.get('id')))
+        else:
+            items.append((dct['message'], key, host_id))
+    return items
+
+
+def select_outbox(dsn):
+    from encsend.storage import connect
+    with connect(dsn) as conn:
+        cur = conn.cursor()
+        cur.execute(SELECT['outbox-count'])
+        print('\t'.join(['host_id', 'messages']))
+        for row in fetch_rows(cur):
+            print('\t'.join(map(str, row)))
+
+
+def print_stats(host, port, raw=False):
+    """ Print server's metrics
+
+    :param host: metrics server host
+    :type host: str
+    :param port: metrics server port
+    :type port: int
+    :param raw: print HELP and TYPE comments too
+    :type raw: bool
+    """
+    from urllib.request import urlopen
+    with urlopen('http://%s:%d/metrics' % (host, port), timeout=10) as resp:
+        for line in resp.read().decode().splitlines():
+            if raw or not line.startswith('#'):
+                print(line)
+
+
+def send_via_agent(items, ack, socket_path, dsn, path):
+    """ Hand messages off to the agent
+
+    :return: False if the agent isn't running or it uses another db or
+        signing key, nothing was sent then
+    :rtype: bool
+    """
+    from encsend.agent_client import AgentError, AgentMismatch, agent_send
+    try:
+        statuses = agent_send(items, ack, socket_path, dsn=dsn, path=path)
+    except (FileNotFoundError, ConnectionRefusedError, AgentMismatch):
+        return False
+    except AgentError as e:
+        sys.exit('error: %s' % e)
+    if ack:
+        print_statuses(statuses)
+    return True
+
+
+def print_statuses(statuses):
+    from encsend.protocol import ACK_STATUSES
+    for status in statuses:
+        print(ACK_STATUSES.get(status, status))
+
+
+def add_filter_arguments(parser):
+    parser.add_argument('--since', type=parse_time, default=None,
+                        help='unix timestamp or ISO 8601 time, inclusive')
+    parser.add_argument('--until', type=parse_time, default=None,
+                        help='unix timestamp or ISO 8601 time, exclusive')
+    parser.add_argument('--host', type=int, default=None,
+                        help='sender\'s id')
+
+
 def main():
     parser = argparse.ArgumentParser(prog='encsend')
 
@@ -69,6 +320,18 @@ def main():
     init_parser.add_argument('-p', '--path', type=str, default=None,
                              help='path to signing key file')
 
+    migrate_parser = subparsers.add_parser(
+        'migrate',
+        help='upgrade db schema to the latest version'
+    )
+    migrate_parser.set_defaults(used='migrate')
+    migrate_parser.add_argument('--dsn', type=str, default=DSN)
+    migrate_parser.add_argument('--target', type=int, default=LATEST_VERSION,
+                                help='upgrade up to this version')
+    migrate_parser.add_argument('--status', action='store_true',
+                                default=False,
+                                help='print current schema version')
+
     server_parser = subparsers.add_parser('server')
     server_parser.set_defaults(used='server')
     server_parser.add_argument('--dsn', type=str, default=DSN)
@@ -76,6 +339,54 @@ def main():
                                help='path to signing key file')
     server_parser.add_argument('--host', type=str, default='127.0.0.1')
     server_parser.add_argument('--port', type=int, default=8888)
+    server_parser.add_argument(
+        '--crypto-workers', type=int, default=CRYPTO_WORKERS,
+        help='number of workers decrypting and verifying messages, '
+             '0 - use event loop\'s thread'
+    )
+    server_parser.add_argument('--crypto-backend', type=str,
+                               choices=['thread', 'process'],
+                               default=CRYPTO_BACKEND)
+    server_parser.add_argument(
+        '--workers', type=int, default=1,
+        help='number of server processes sharing the port with SO_REUSEPORT'
+    )
+    server_parser.add_argument(
+        '--metrics-port', type=int, default=METRICS_PORT,
+        help='port of http server with metrics, workers use port + number '
+             'of the worker'
+    )
+    server_parser.add_argument(
+        '--stream', type=str, default=STREAM,
+        help='push received messages as json lines, "-" - to stdout, '
+             'path - to Unix socket for message-subscribe'
+    )
+    server_parser.add_argument(
+        '--consumer', type=str, default=None,
+        help='consumer\'s name for stdout stream, it resumes after the last '
+             'written message'
+    )
+
+    discovery_parser = subparsers.add_parser(
+        'discovery',
+        help='announce this host on the LAN and add announced peers to db'
+    )
+    discovery_parser.set_defaults(used='discovery')
+    discovery_parser.add_argument('--dsn', type=str, default=DSN)
+    discovery_parser.add_argument('-p', '--path', type=str, default=None,
+                                  help='path to signing key file')
+    discovery_parser.add_argument('--host', type=str, default=DISCOVERY_HOST)
+    discovery_parser.add_argument('--port', type=int, default=DISCOVERY_PORT)
+    discovery_parser.add_argument('--addr', type=str, default=DISCOVERY_ADDR,
+                                  help='broadcast address')
+    discovery_parser.add_argument(
+        '--announce-host', type=str, default=DISCOVERY_ANNOUNCE_HOST,
+        help='host of the server announced to peers, by default peers use '
+             'source address of announcements'
+    )
+    discovery_parser.add_argument('--announce-port', type=int, default=PORT,
+                                  help='port of the server announced to '
+                                       'peers')
 
     host_add_parser = subparsers.add_parser('host-add')
     host_add_parser.set_defaults(used='host-add')
@@ -92,6 +403,14 @@ def main():
     message_ls_parser = subparsers.add_parser('message-ls')
     message_ls_parser.set_defaults(used='message-ls')
     message_ls_parser.add_argument('--dsn', type=str, default=DSN)
+    add_filter_arguments(message_ls_parser)
+    message_ls_parser.add_argument('--limit', type=int, default=None)
+    message_ls_parser.add_argument('--after-id', type=int, default=None,
+                                   help='list messages after this id, '
+                                        'for pagination')
+    message_ls_parser.add_argument('--json', action='store_true',
+                                   default=False,
+                                   help='print a json object per line')
 
     message_rm_parser = subparsers.add_parser('message-rm')
     message_rm_parser.set_defaults(used='message-rm')
@@ -99,6 +418,41 @@ def main():
     message_rm_parser.add_argument('--id', type=int, default=None)
     message_rm_parser.add_argument('-a', '--all', action='store_true',
                                    default=False)
+    add_filter_arguments(message_rm_parser)
+
+    message_subscribe_parser = subparsers.add_parser(
+        'message-subscribe',
+        help='print messages pushed by the server as they are received'
+    )
+    message_subscribe_parser.set_defaults(used='message-subscribe')
+    message_subscribe_parser.add_argument(
+        '--socket', type=str, default=STREAM, required=STREAM in (None, '-'),
+        help='path to server\'s stream socket'
+    )
+    message_subscribe_parser.add_argument(
+        '--consumer', type=str, default=None,
+        help='consumer\'s name, it resumes after the last printed message'
+    )
+    message_subscribe_parser.add_argument(
+        '--after-id', type=int, default=None,
+        help='print messages after this id, by default after the consumer\'s '
+             'cursor or new messages only'
+    )
+
+    consumer_ls_parser = subparsers.add_parser(
+        'consumer-ls',
+        help='list consumers\' cursors'
+    )
+    consumer_ls_parser.set_defaults(used='consumer-ls')
+    consumer_ls_parser.add_argument('--dsn', type=str, default=DSN)
+
+    consumer_rm_parser = subparsers.add_parser(
+        'consumer-rm',
+        help='remove consumer\'s cursor, it gets new messages only'
+    )
+    consumer_rm_parser.set_defaults(used='consumer-rm')
+    consumer_rm_parser.add_argument('--dsn', type=str, default=DSN)
+    consumer_rm_parser.add_argument('consumer', type=str)
 
     message_send_parser = subparsers.add_parser('message-send')
     message_send_parser.set_defaults(used='message-send')
@@ -109,8 +463,102 @@ def main():
                                      help='host\'s hex encoded verify key')
     message_send_parser.add_argument('--id', type=int, default=None,
                                      help='host\'s id')
-    message_send_parser.add_argument('-m', '--message', type=str,
-                                     required=True)
+    message_send_group = message_send_parser.add_mutually_exclusive_group(
+        required=True
+    )
+    message_send_group.add_argument('-m', '--message', type=str)
+    message_send_group.add_argument(
+        '--batch', type=argparse.FileType('r'), default=None,
+        help='JSON Lines file, every line is {"message": ..., "key": ...} '
+             'or {"message": ..., "id": ...}, "-" for stdin'
+    )
+    message_send_parser.add_argument(
+        '-q', '--queue', action='store_true', default=False,
+        help='add messages to the outbox, outbox-run sends them'
+    )
+    message_send_parser.add_argument(
+        '--ack', action='store_true', default=False,
+        help='wait for receiver\'s acks and print their statuses'
+    )
+    message_send_parser.add_argument(
+        '--socket', type=str, default=AGENT_SOCKET,
+        help='path to agent\'s socket, messages are sent by the agent if '
+             'it\'s running'
+    )
+    message_send_parser.add_argument('--no-agent', action='store_true',
+                                     default=False,
+                                     help='send messages without the agent')
+
+    agent_parser = subparsers.add_parser(
+        'agent',
+        help='keep keys and connections open and send messages for '
+             'message-send'
+    )
+    agent_parser.set_defaults(used='agent')
+    agent_parser.add_argument('--dsn', type=str, default=DSN)
+    agent_parser.add_argument('-p', '--path', type=str, default=None,
+                              help='path to signing key file')
+    agent_parser.add_argument('--socket', type=str, default=AGENT_SOCKET,
+                              help='path to agent\'s socket')
+
+    outbox_run_parser = subparsers.add_parser(
+        'outbox-run',
+        help='send queued messages, retry unreachable hosts'
+    )
+    outbox_run_parser.set_defaults(used='outbox-run')
+    outbox_run_parser.add_argument('--dsn', type=str, default=DSN)
+    outbox_run_parser.add_argument('-p', '--path', type=str, default=None,
+                                   help='path to signing key file')
+
+    outbox_ls_parser = subparsers.add_parser(
+        'outbox-ls',
+        help='print number of queued messages per host'
+    )
+    outbox_ls_parser.set_defaults(used='outbox-ls')
+    outbox_ls_parser.add_argument('--dsn', type=str, default=DSN)
+
+    file_send_parser = subparsers.add_parser('file-send')
+    file_send_parser.set_defaults(used='file-send')
+    file_send_parser.add_argument('--dsn', type=str, default=DSN)
+    file_send_parser.add_argument('-p', '--path', type=str, default=None,
+                                  help='path to signing key file')
+    file_send_parser.add_argument('-k', '--key', type=str, default=None,
+                                  help='host\'s hex encoded verify key')
+    file_send_parser.add_argument('--id', type=int, default=None,
+                                  help='host\'s id')
+    file_send_parser.add_argument('-f', '--file', type=str, required=True)
+
+    file_ls_parser = subparsers.add_parser('file-ls')
+    file_ls_parser.set_defaults(used='file-ls')
+    file_ls_parser.add_argument('--dsn', type=str, default=DSN)
+
+    stats_parser = subparsers.add_parser(
+        'stats',
+        help='print running server\'s metrics'
+    )
+    stats_parser.set_defaults(used='stats')
+    stats_parser.add_argument('--host', type=str, default=METRICS_HOST)
+    stats_parser.add_argument('--port', type=int, default=METRICS_PORT,
+                              help='metrics port of the server or worker')
+    stats_parser.add_argument('--raw', action='store_true', default=False,
+                              help='print HELP and TYPE comments too')
+
+    bench_parser = subparsers.add_parser(
+        'bench',
+        help='run end-to-end benchmark with temporary key and db'
+    )
+    bench_parser.set_defaults(used='bench')
+    bench_parser.add_argument('--senders', type=int, default=10,
+                              help='concurrent senders')
+    bench_parser.add_argument('--messages', type=int, default=1000,
+                              help='messages sent by every sender')
+    bench_parser.add_argument('--size', type=int, default=1024,
+                              help='message size')
+    bench_parser.add_argument('--dsn-template', type=str, default=None,
+                              help='DSN of temporary db, {path} is replaced '
+                                   'with path to db file')
+    bench_parser.add_argument('--json', action='store_true', default=False,
+                              help='print results as json')
 
     verify_key_parser = subparsers.add_parser(
         'verify-key',
@@ -125,24 +573,104 @@ def main():
         return
 
     if args.used == 'init':
-        create_tables(args.dsn)
+        from encsend.utils import create_signing_key
+        migrate_db(args.dsn)
         create_signing_key(args.path)
+    elif args.used == 'migrate':
+        if args.status:
+            print_db_version(args.dsn)
+        else:
+            migrate_db(args.dsn, args.target)
     elif args.used == 'server':
-        start_encsend_server(args.host, args.port, args.dsn)
+        from encsend.server import start_encsend_server
+        start_encsend_server(args.host, args.port, args.dsn, args.path,
+                             args.crypto_workers, args.crypto_backend,
+                             args.workers, args.metrics_port, args.stream,
+                             args.consumer)
+    elif args.used == 'discovery':
+        from encsend.server.discovery import start_discovery_server
+        start_discovery_server(args.host, args.port, args.addr, args.dsn,
+                               args.path, args.announce_host,
+                               args.announce_port)
     elif args.used == 'host-add':
         insert_host(args.key, args.dsn, args.host, args.port)
     elif args.used == 'host-ls':
         select_hosts(args.dsn)
     elif args.used == 'message-ls':
-        select_messages(args.dsn)
+        select_messages(args.dsn, args.since, args.until, args.host,
+                        args.limit, args.after_id, args.json)
+    elif args.used == 'message-subscribe':
+        subscribe_messages(args.socket, args.consumer, args.after_id)
+    elif args.used == 'consumer-ls':
+        select_consumers(args.dsn)
+    elif args.used == 'consumer-rm':
+        delete_consumer(args.dsn, args.consumer)
     elif args.used == 'message-rm':
+        filters = (args.since, args.until, args.host)
         if args.all:
             delete_all_messages(args.dsn)
-        else:
+        elif args.id is not None:
             delete_message(args.dsn, args.id)
+        elif any(value is not None for value in filters):
+            print('deleted: %d' % delete_messages(args.dsn, *filters))
+        else:
+            message_rm_parser.error('--id, --all or a filter is required')
     elif args.used == 'message-send':
-        send_message(args.message, args.dsn, args.path, args.key, args.id)
+        if args.batch is not None:
+            items = read_batch(args.batch, args.key, args.id)
+        else:
+            items = [(args.message, args.key, args.id)]
+        if args.ack and args.batch is not None:
+            message_send_parser.error('--ack works with -m only')
+        if args.queue:
+            from encsend.outbox import queue_batch
+            queue_batch(items, args.dsn, args.path)
+            return
+        # Without running agent messages are sent from this process
+        if not args.no_agent and send_via_agent(items, args.ack,
+                                                args.socket, args.dsn,
+                                                args.path):
+            return
+        if args.ack:
+            from encsend.client import send_acked
+            print_statuses(send_acked([args.message], args.dsn, args.path,
+                                      args.key, args.id))
+        elif args.batch is not None:
+            from encsend.client import send_batch
+            send_batch(items, args.dsn, args.path)
+        else:
+            from encsend.client import send_message
+            send_message(args.message, args.dsn, args.path, args.key,
+                         args.id)
+    elif args.used == 'agent':
+        from encsend.agent import start_agent
+        start_agent(args.dsn, args.path, args.socket)
+    elif args.used == 'outbox-run':
+        from encsend.outbox import run_outbox
+        run_outbox(args.dsn, args.path)
+    elif args.used == 'outbox-ls':
+        select_outbox(args.dsn)
+    elif args.used == 'file-send':
+        from encsend.client import DeliveryError, send_file
+        try:
+            send_file(args.file, args.dsn, args.path, args.key, args.id)
+        except DeliveryError as e:
+            sys.exit('error: file wasn\'t delivered: %s' % e)
+    elif args.used == 'file-ls':
+        select_files(args.dsn)
+    elif args.used == 'stats':
+        print_stats(args.host, args.port, args.raw)
+    elif args.used == 'bench':
+        from encsend.bench import (DSN_TEMPLATE, format_results,
+                                   run_benchmarks)
+        results = run_benchmarks(args.senders, args.messages, args.size,
+                                 args.dsn_template or DSN_TEMPLATE)
+        if args.json:
+            print(json.dumps(results, indent=2))
+        else:
+            print(format_results(results))
     elif args.used == 'verify-key':
+        from encsend.utils import get_verify_key_hex
         key = get_verify_key_hex(args.path)
         print(key.decode())
 
@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import json
+import logging
+import os
+import signal
+
+from .agent_client import get_agent_socket_path
+from .async_client import AsyncEncSendClient
+from .storage import normalize_dsn
+from .utils import remove_stale_socket
+
+try:
+    from . import conf
+except ImportError:
+    from . import conf_default as conf
+finally:
+    DSN, AGENT_SOCKET = conf.DSN, conf.AGENT_SOCKET
+
+logger = logging.getLogger(__name__)
+
+# Max length of a single request's line, batches may be large
+MAX_REQUEST_SIZE = 64 * 1024 ** 2
+
+
+class Agent:
+    """ Local daemon sending messages on behalf of CLI
+
+    Agent loads signing key once and keeps db pool, sealed boxes and
+    connections to hosts open, so `message-send` only writes a request
+    to agent's Unix socket instead of starting all of that for every
+    message. The socket is accessible by it's owner only.
+
+    Requests carry caller's db and signing key, agent refuses to send
+    messages on behalf of callers using other ones, so messages aren't
+    signed with another host's key.
+    """
+    def __init__(self, loop, dsn, signature_path=None, socket_path=None):
+        """
+        :param loop: asyncio event loop
+        :param dsn: Data Source Name, information about database driver,
+            server, database, etc
+        :type dsn: str
+        :param signature_path: custom path to signature key file
+        :type signature_path: str or None
+        :param socket_path: path to agent's socket, if None - default
+            path is used
+        :type socket_path: str or None
+        """
+        self.loop = loop
+        if socket_path is None:
+            socket_path = get_agent_socket_path(make_dir=True)
+        self.socket_path = socket_path
+        # Callers compare DSNs from their working directories
+        self.dsn = normalize_dsn(dsn)
+        if signature_path is not None:
+            signature_path = os.path.abspath(signature_path)
+        self.signature_path = signature_path
+        self.client = AsyncEncSendClient(loop, dsn, signature_path)
+        self.server = None
+
+    async def start(self):
+        remove_stale_socket(self.socket_path)
+        await self.client.init_db()
+        # Socket file is created with permissions allowed by umask
+        umask = os.umask(0o177)
+        try:
+            self.server = await asyncio.start_unix_server(
+                self.handle_connection, self.socket_path,
+                limit=MAX_REQUEST_SIZE
+            )
+        finally:
+            os.umask(umask)
+
+    async def handle_connection(self, reader, writer):
+        """ Handle requests one by one, every request and response is
+        a json object on a single line
+        """
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    request = json.loads(line)
+                except ValueError:
+                    response = {'error': 'invalid request'}
+                else:
+                    response = await self.handle_request(request)
+                writer.write(json.dumps(response).encode() + b'\n')
+                await writer.drain()
+        except (ConnectionError, ValueError):
+            # ValueError - request is longer than the limit
+            pass
+        finally:
+            writer.close()
+
+    async def handle_request(self, request):
+        """ Send messages
+
+        :param request: `items` - list of [message, host's hex encoded
+            verify key or None, host's id or None], `ack` - wait for acks,
+            `dsn` and `path` - caller's normalized DSN and absolute path
+            to signing key file, None - default path
+        :type request: dict
+        :return: `statuses` - ack statuses, if acks were requested,
+            `sent` - number of sent messages, otherwise; `error` - error
+            message if sending failed, `mismatch` - True if caller uses
+            another db or signing key
+        :rtype: dict
+        """
+        if request.get('dsn') != self.dsn or \
+                request.get('path') != self.signature_path:
+            return {'error': 'agent uses another db or signing key',
+                    'mismatch': True}
+        try:
+            items = [(message, host_key, host_id)
+                     for message, host_key, host_id in request['items']]
+            if request.get('ack'):
+                statuses = await self.client.send_batch(items, ack=True)
+                return {'statuses': statuses}
+            await self.client.send_batch(items)
+            return {'sent': len(items)}
+        except Exception as e:
+            logger.warning('request failed: %r', e)
+            return {'error': str(e) or type(e).__name__}
+
+    def stop(self):
+        self.server.close()
+
+    async def wait(self):
+        await self.server.wait_closed()
+        await self.client.close()
+        try:
+            os.unlink(self.socket_path)
+        except FileNotFoundError:
+            pass
+
+
+def start_agent(dsn=DSN, path=None, socket_path=AGENT_SOCKET):
+    """ Run agent in current process until SIGTERM or SIGINT, signing
+    key file is read again on SIGHUP
+
+    :param dsn: Data Source Name, information about database driver,
+        server, database, etc
+    :type dsn: str
+    :param path: path to signature key file, if path is `None`
+        default path is used
+    :type path: str or None
+    :param socket_path: path to agent's socket, if None - default path
+        is used
+    :type socket_path: str or None
+    """
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    agent = Agent(loop, dsn, path, socket_path)
+    loop.run_until_complete(agent.start())
+    loop.add_signal_handler(signal.SIGTERM, loop.stop)
+    loop.add_signal_handler(signal.SIGHUP, agent.client.reload_keys)
+
+    try:
+        loop.run_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        agent.stop()
+        loop.run_until_complete(agent.wait())
+        loop.close()
@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+
+import json
+import os
+import socket
+import tempfile
+
+# Only light modules are imported, storage backends aren't, so commands
+# handing messages off to the agent start fast
+from .storage import normalize_dsn
+try:
+    from . import conf
+except ImportError:
+    from . import conf_default as conf
+finally:
+    AGENT_SOCKET, AGENT_TIMEOUT = conf.AGENT_SOCKET, conf.AGENT_TIMEOUT
+
+
+class AgentError(Exception):
+    """ Agent failed to send messages, the first argument is agent's
+    error message
+    """
+
+
+class AgentMismatch(AgentError):
+    """ Agent uses another db or signing key, nothing was sent """
+
+
+def get_agent_socket_path(make_dir=False):
+    """ Get default path to agent's socket.
+    If `$XDG_RUNTIME_DIR` is set, use `${XDG_RUNTIME_DIR}/encsend`,
+    otherwise - `encsend-${UID}` in the temporary directory.
+
+    :param make_dir: make the socket's directory if it doesn't exist,
+        the directory is accessible by the owner only
+    :type make_dir: bool
+    :return: path to agent's socket
+    :rtype: str
+    """
+    _evar = 'XDG_RUNTIME_DIR'
+    if _evar in os.environ and os.environ[_evar]:
+        path = os.path.join(os.environ[_evar], 'encsend')
+    else:
+        path = os.path.join(tempfile.gettempdir(),
+                            'encsend-%d' % os.getuid())
+
+    if make_dir:
+        os.makedirs(path, mode=0o700, exist_ok=True)
+
+    return os.path.join(path, 'agent.sock')
+
+
+def agent_request(request, socket_path=AGENT_SOCKET, timeout=AGENT_TIMEOUT):
+    """ Send a request to the agent and wait for response, request and
+    response are json objects on a single line
+
+    :param request: request, see `encsend.agent.Agent.handle_request`
+    :type request: dict
+    :param socket_path: path to agent's socket, if None - default path
+        is used
+    :type socket_path: str or None
+    :param timeout: max seconds to wait for response
+    :type timeout: float
+    :return: response
+    :rtype: dict
+    :raises FileNotFoundError, ConnectionRefusedError: agent isn't
+        running, nothing was sent
+    :raises OSError: connection failed, messages may be sent
+    :raises AgentMismatch: agent uses another db or signing key
+    :raises AgentError: agent returned an error
+    """
+    if socket_path is None:
+        socket_path = get_agent_socket_path()
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(timeout)
+        sock.connect(socket_path)
+        sock.sendall(json.dumps(request).encode() + b'\n')
+        with sock.makefile('rb') as f:
+            line = f.readline()
+    if not line:
+        raise ConnectionError('agent closed the connection')
+    response = json.loads(line)
+    if response.get('mismatch'):
+        raise AgentMismatch(response['error'])
+    if 'error' in response:
+        raise AgentError(response['error'])
+    return response
+
+
+def agent_send(items, ack=False, socket_path=AGENT_SOCKET,
+               timeout=AGENT_TIMEOUT, dsn=None, path=None):
+    """ Send messages through the agent, the agent refuses to send them
+    if it uses another db or signing key than the caller
+
+    :param items: tuples with unencrypted message, host's hex encoded
+        verify key and host's internal id
+    :type items: iterable of (str, str or list or None,
+        int or list or None)
+    :param ack: wait for receivers' acks
+    :type ack: bool
+    :param socket_path: path to agent's socket, if None - default path
+        is used
+    :type socket_path: str or None
+    :param timeout: max seconds to wait for agent's response
+    :type timeout: float
+    :param dsn: caller's Data Source Name
+    :type dsn: str
+    :param path: caller's path to signing key file, if path is `None`
+        default path is used
+    :type path: str or None
+    :return: ack statuses if `ack` is True, see `encsend.protocol`
+    :rtype: list of int or None
+    :raises FileNotFoundError, ConnectionRefusedError: agent isn't
+        running, nothing was sent
+    :raises OSError: connection failed, messages may be sent
+    :raises AgentMismatch: agent uses another db or signing key
+    :raises AgentError: agent failed to send messages
+    """
+    if dsn is not None:
+        dsn = normalize_dsn(dsn)
+    if path is not None:
+        path = os.path.abspath(path)
+    request = {'items': [list(item) for item in items], 'ack': ack,
+               'dsn': dsn, 'path': path}
+    return agent_request(request, socket_path, timeout).get('statuses')
@@ -0,0 +1,466 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+from collections import deque
+
+from nacl.encoding import HexEncoder
+from nacl.signing import VerifyKey
+
+from .client import ClientBase, check_ack, get_receivers
+from .protocol import (ACK, FRAME_ACK, ProtocolError, message_digest,
+                       read_frame, unpack_ack)
+from .sql import SELECT
+from .storage import create_pool
+
+try:
+    from . import conf
+except ImportError:
+    from . import conf_default as conf
+finally:
+    DSN = conf.DSN
+    POOL_SIZE, CONCURRENCY = conf.CLIENT_POOL_SIZE, conf.CLIENT_CONCURRENCY
+    TIMEOUT, PROTOCOL_VERSION = conf.CLIENT_TIMEOUT, conf.PROTOCOL_VERSION
+    ACK_WINDOW, COMPRESSION = conf.ACK_WINDOW, conf.COMPRESSION
+    SEND_NONCE = conf.SEND_NONCE
+
+
+class ConnectionPool:
+    """ Bounded pool of open connections to a single host """
+    def __init__(self, host, port, size, timeout):
+        """
+        :param host: host's address
+        :type host: str
+        :param port: host's port
+        :type port: int
+        :param size: max number of open connections
+        :type size: int
+        :param timeout: connect timeout in seconds
+        :type timeout: float
+        """
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.semaphore = asyncio.Semaphore(size)
+        # Idle connections, tuples with reader and writer
+        self.idle = deque()
+
+    async def acquire(self):
+        """ Get idle connection or open a new one, wait if all
+        connections are busy
+
+        :return: tuple with reader and writer
+        :rtype: (asyncio.StreamReader, asyncio.StreamWriter)
+        """
+        await self.semaphore.acquire()
+        try:
+            while self.idle:
+                reader, writer = self.idle.pop()
+                # Connection was closed by the other side while it was idle
+                if reader.at_eof() or writer.transport.is_closing():
+                    writer.close()
+                    continue
+                return reader, writer
+            return await asyncio.wait_for(
+                asyncio.open_connection(self.host, self.port), self.timeout
+            )
+        except BaseException:
+            self.semaphore.release()
+            raise
+
+    def release(self, connection, discard=False):
+        """ Return connection to the pool
+
+        :param connection: tuple with reader and writer
+        :type connection: (asyncio.StreamReader, asyncio.StreamWriter)
+        :param discard: close the connection instead of keeping it open,
+            used after errors
+        :type discard: bool
+        """
+        if discard:
+            connection[1].close()
+        else:
+            self.idle.append(connection)
+        self.semaphore.release()
+
+    def close(self):
+        while self.idle:
+            reader, writer = self.idle.pop()
+            writer.close()
+
+
+class AckedConnection:
+    """ Connection to a single host for messages with ack requests
+
+    Many messages wait for acks at once, acks are read by a background
+    task and matched by sequence numbers. If the connection fails, all
+    waiting messages get the error
+    """
+    def __init__(self, host, port, host_key, make_frame, window, timeout):
+        """
+        :param host: host's address
+        :type host: str
+        :param port: host's port
+        :type port: int
+        :param host_key: hex encoded host's verify key for checking acks
+        :type host_key: str
+        :param make_frame: function making frame from sequence number
+            and encrypted message
+        :param window: max number of messages waiting for acks
+        :type window: int
+        :param timeout: connect, send and ack timeout in seconds
+        :type timeout: float
+        """
+        self.host = host
+        self.port = port
+        self.verify_key = VerifyKey(host_key.encode(), encoder=HexEncoder)
+        self.make_frame = make_frame
+        self.timeout = timeout
+        self.semaphore = asyncio.Semaphore(window)
+        self.lock = asyncio.Lock()
+        self.reader = self.writer = None
+        self.task = None
+        self.seq = 0
+        # seq -> (future, message's digest)
+        self.pending = {}
+        self.closed = False
+
+    async def connect(self):
+        async with self.lock:
+            if self.closed:
+                raise ConnectionError('connection is closed')
+            if self.writer is None:
+                self.reader, self.writer = await asyncio.wait_for(
+                    asyncio.open_connection(self.host, self.port),
+                    self.timeout
+                )
+                self.task = asyncio.ensure_future(self.read_acks())
+
+    async def send(self, encrypted):
+        """ Send encrypted message and wait for ack
+
+        :param encrypted: result of `encrypt_message`
+        :type encrypted: bytes
+        :return: ack status
+        :rtype: int
+        """
+        async with self.semaphore:
+            await self.connect()
+            seq = self.seq
+            self.seq += 1
+            future = asyncio.get_event_loop().create_future()
+            self.pending[seq] = (future, message_digest(encrypted))
+            try:
+                self.writer.write(self.make_frame(seq, encrypted))
+                await asyncio.wait_for(self.writer.drain(), self.timeout)
+                return await asyncio.wait_for(asyncio.shield(future),
+                                              self.timeout)
+            except asyncio.TimeoutError as e:
+                self.fail(e)
+                raise
+            finally:
+                self.pending.pop(seq, None)
+
+    async def read_acks(self):
+        try:
+            while True:
+                frame = await read_frame(self.reader, ACK.size)
+                if frame is None:
+                    raise ConnectionError('connection closed by host')
+                _, frame_type, payload = frame
+                if frame_type != FRAME_ACK:
+                    raise ProtocolError('unexpected frame type %d'
+                                        % frame_type)
+                ack = unpack_ack(payload)
+                # Sender gave up waiting
+                if ack.seq not in self.pending:
+                    continue
+                future, digest = self.pending.pop(ack.seq)
+                check_ack(self.verify_key, ack, digest)
+                if not future.done():
+                    future.set_result(ack.status)
+        except (OSError, ProtocolError) as e:
+            self.fail(e)
+
+    def fail(self, error):
+        """ Close the connection, waiting messages get the error """
+        self.closed = True
+        if self.writer is not None:
+            self.writer.close()
+        for future, _ in self.pending.values():
+            if not future.done():
+                future.set_exception(error)
+        self.pending.clear()
+
+    def close(self):
+        if self.task is not None:
+            self.task.cancel()
+        self.fail(ConnectionError('connection is closed'))
+
+
+class AsyncEncSendClient(ClientBase):
+    """ EncSend asyncio client implementation
+
+    Client keeps a pool of open connections per (host, port), so
+    concurrent `send_message` coroutines can be run with `asyncio.gather`
+    """
+    def __init__(self, loop, dsn, signature_path=None, pool_size=POOL_SIZE,
+                 concurrency=CONCURRENCY, timeout=TIMEOUT,
+                 protocol_version=PROTOCOL_VERSION, ack_window=ACK_WINDOW,
+                 compression=COMPRESSION, send_nonce=SEND_NONCE):
+        """
+        :param loop: asyncio event loop
+        :param dsn: Data Source Name, information about database driver,
+            server, database, etc
+        :type dsn: str
+        :param signature_path: custom path to signature key file
+        :type signature_path: str or None
+        :param pool_size: max number of open connections per host
+        :type pool_size: int
+        :param concurrency: max number of messages being sent at once
+        :type concurrency: int
+        :param timeout: connect, send and ack timeout in seconds
+        :type timeout: float
+        :param protocol_version: 2 - binary envelopes, 3 - binary
+            envelopes encrypted with content key sealed to every receiver,
+            1 - hex encoded json for receivers which don't support binary
+            envelopes
+        :type protocol_version: int
+        :param ack_window: max number of messages waiting for acks per
+            host
+        :type ack_window: int
+        :param compression: `zlib`, `zstd`, `lz4` or None, compression of
+            messages
+        :type compression: str or None
+        :param send_nonce: prepend send time and message id to messages
+        :type send_nonce: bool
+        """
+        self.loop = loop
+        self.dsn = dsn
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.ack_window = ack_window
+        self.semaphore = asyncio.Semaphore(concurrency)
+        # (host, port) -> ConnectionPool
+        self.pools = {}
+        # (host, port) -> AckedConnection
+        self.acked_connections = {}
+        super().__init__(signature_path, protocol_version=protocol_version,
+                         compression=compression, send_nonce=send_nonce)
+
+    async def __aenter__(self):
+        await self.init_db()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    async def init_db(self):
+        self.db_pool = await create_pool(self.dsn)
+
+    async def send_message(self, message, host_key=None, host_id=None):
+        """ Send encrypted message to another host
+
+        If both args `host_key` and `host_id` are entered, `host_key`
+        is used and `host_id` is ignored
+
+        :param message: unencrypted message
+        :type message: str or bytes
+        :param host_key: hex encoded host's verify key
+        :type host_key: str or None
+        :param host_id: internal host's id
+        :type host_id: int or None
+        """
+        if not isinstance(message, bytes):
+            message = message.encode()
+
+        async with self.semaphore:
+            if host_key is not None:
+                host, port = await self.get_host_by_key(host_key)
+            elif host_id is not None:
+                host_key, host, port = await self.get_host_by_id(host_id)
+
+            encrypted = self.encrypt_message(message, host_key.encode())
+            await self.send_frame(host, port, self.make_frame(encrypted))
+
+    async def send_acked(self, message, host_key=None, host_id=None):
+        """ Send encrypted message to another host and wait for ack
+
+        Concurrent calls share one connection per host, so messages
+        don't wait for acks of each other
+
+        If both args `host_key` and `host_id` are entered, `host_key`
+        is used and `host_id` is ignored
+
+        :param message: unencrypted message
+        :type message: str or bytes
+        :param host_key: hex encoded host's verify key
+        :type host_key: str or None
+        :param host_id: internal host's id
+        :type host_id: int or None
+        :return: ack status, see `encsend.protocol`
+        :rtype: int
+        :raises OSError: connection failed before ack was received
+        :raises asyncio.TimeoutError: ack wasn't received in time
+        :raises encsend.protocol.ProtocolError: invalid ack
+        """
+        if not isinstance(message, bytes):
+            message = message.encode()
+
+        async with self.semaphore:
+            if host_key is not None:
+                host, port = await self.get_host_by_key(host_key)
+            elif host_id is not None:
+                host_key, host, port = await self.get_host_by_id(host_id)
+
+            encrypted = self.encrypt_message(message, host_key.encode())
+            connection = self.get_acked_connection(host, port, host_key)
+            return await connection.send(encrypted)
+
+    async def send_batch(self, items, ack=False):
+        """ Send many messages to many hosts concurrently
+
+        Messages are encrypted by `encrypt_batch`, so a message to many
+        hosts is signed once
+
+        :param items: tuples with unencrypted message, host's hex encoded
+            verify key and host's internal id, see
+            `encsend.client.get_receivers`
+        :type items: iterable of (str or bytes, str or list or None,
+            int or list or None)
+        :param ack: wait for acks
+        :type ack: bool
+        :return: ack status of every receiver of every item, in order of
+            items, if `ack` is True
+        :rtype: list of int or None
+        :raises LookupError: some of hosts weren't found in db, nothing
+            is sent in this case
+        """
+        items = [(message, get_receivers(host_key, host_id))
+                 for message, host_key, host_id in items]
+        host_keys = list({host_key for _, receivers in items
+                          for host_key, _ in receivers
+                          if host_key is not None})
+        host_ids = list({host_id for _, receivers in items
+                         for host_key, host_id in receivers
+                         if host_key is None})
+        by_key = dict(zip(host_keys, await asyncio.gather(*[
+            self.get_host_by_key(host_key) for host_key in host_keys
+        ])))
+        by_id = dict(zip(host_ids, await asyncio.gather(*[
+            self.get_host_by_id(host_id) for host_id in host_ids
+        ])))
+
+        resolved = []
+        for message, receivers in items:
+            details = [(host_key,) + by_key[host_key]
+                       if host_key is not None else by_id[host_id]
+                       for host_key, host_id in receivers]
+            if not isinstance(message, bytes):
+                message = message.encode()
+            resolved.append((message, details))
+
+        encrypted = self.encrypt_batch([
+            (message, [host_key.encode() for host_key, _, _ in details])
+            for message, details in resolved
+        ])
+        results = await asyncio.gather(*[
+            self.send_encrypted(host, port, host_key, sealed, ack)
+            for (_, details), copies in zip(resolved, encrypted)
+            for (host_key, host, port), sealed in zip(details, copies)
+        ])
+        if ack:
+            return list(results)
+
+    async def send_encrypted(self, host, port, host_key, encrypted,
+                             ack=False):
+        """ Send encrypted message to the host
+
+        :param encrypted: result of `encrypt_message`
+        :type encrypted: bytes
+        :param ack: wait for ack
+        :type ack: bool
+        :return: ack status if `ack` is True
+        :rtype: int or None
+        """
+        async with self.semaphore:
+            if not ack:
+                await self.send_frame(host, port, self.make_frame(encrypted))
+                return
+            connection = self.get_acked_connection(host, port, host_key)
+            return await connection.send(encrypted)
+
+    def get_acked_connection(self, host, port, host_key):
+        """ Get open connection to the host for messages with ack
+        requests, connect if there isn't one
+        """
+        connection = self.acked_connections.get((host, port))
+        if connection is None or connection.closed:
+            connection = AckedConnection(host, port, host_key,
+                                         self.make_ack_frame,
+                                         self.ack_window, self.timeout)
+            self.acked_connections[(host, port)] = connection
+        return connection
+
+    async def send_frame(self, host, port, frame):
+        """ Send a frame over one of pooled connections to the host
+
+        :param host: host's address
+        :type host: str
+        :param port: host's port
+        :type port: int
+        :param frame: frame with header
+        :type frame: bytes
+        """
+        pool = self.pools.get((host, port))
+        if pool is None:
+            pool = ConnectionPool(host, port, self.pool_size, self.timeout)
+            self.pools[(host, port)] = pool
+
+        connection = await pool.acquire()
+        try:
+            writer = connection[1]
+            writer.write(frame)
+            await asyncio.wait_for(writer.drain(), self.timeout)
+        except BaseException:
+            pool.release(connection, discard=True)
+            raise
+        pool.release(connection)
+
+    async def get_host_by_key(self, host_key):
+        """ Get host details by it's verify key
+
+        :param host_key: hex encoded the host's verify key
+        :type host_key: str
+        :return: tuple with host and port
+        :rtype: (str, int)
+        """
+        return await self.fetch_host(SELECT['hosts-key'], host_key)
+
+    async def get_host_by_id(self, host_id):
+        """ Get host details by host's interal id
+
+        :param host_id: host's internal id
+        :type host_id: int
+        :return: tuple with host's verify key, host and port
+        :rtype: (str, str, int)
+        """
+        return await self.fetch_host(SELECT['hosts-id'], host_id)
+
+    async def fetch_host(self, query, value):
+        async with self.db_pool.acquire() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(query, (value,))
+                rows = await cur.fetchall()
+        if not rows:
+            raise LookupError('host %s not found' % value)
+        return tuple(rows[0])
+
+    async def close(self):
+        for pool in self.pools.values():
+            pool.close()
+        self.pools.clear()
+        for connection in self.acked_connections.values():
+            connection.close()
+        self.acked_connections.clear()
+        self.db_pool.close()
+        await self.db_pool.wait_closed()
@@ -0,0 +1,221 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import os
+import socket
+import tempfile
+import threading
+import time
+
+from .async_client import AsyncEncSendClient
+from .client import ClientBase
+from .storage import connect
+from .migrations import migrate
+from .server.main import EncSendServer
+from .server.writer import MessageWriter
+from .sql import INSERT
+from .utils import create_signing_key
+
+# DSN of temporary db for end-to-end benchmark, `{path}` is replaced
+# with path to db file
+DSN_TEMPLATE = 'sqlite:{path}'
+
+
+def percentile(values, percent):
+    """ Get percentile of sorted values with nearest-rank method
+
+    :param values: sorted values
+    :type values: list
+    :param percent: percentile, 0-100
+    :type percent: float
+    :rtype: float
+    """
+    if not values:
+        return 0.0
+    index = max(int(round(percent / 100 * len(values))) - 1, 0)
+    return values[min(index, len(values) - 1)]
+
+
+def summarize(durations, total_time=None):
+    """ Summarize durations of operations
+
+    :param durations: durations of single operations in seconds
+    :type durations: list
+    :param total_time: wall time of the whole run, if None - sum of
+        durations is used
+    :type total_time: float or None
+    :return: dictionary with number of operations, operations per second,
+        mean, p50 and p99 latency in microseconds
+    :rtype: dict
+    """
+    durations = sorted(durations)
+    if total_time is None:
+        total_time = sum(durations)
+    count = len(durations)
+    return {
+        'count': count,
+        'ops': count / total_time if total_time else 0.0,
+        'mean_us': sum(durations) / count * 1e6 if count else 0.0,
+        'p50_us': percentile(durations, 50) * 1e6,
+        'p99_us': percentile(durations, 99) * 1e6
+    }
+
+
+def create_bench_key(dir_path):
+    path = os.path.join(dir_path, 'host_signature')
+    create_signing_key(path)
+    return path
+
+
+class LatencyWriter(MessageWriter):
+    """ Message writer recording time from sending to commit, messages
+    start with sender's `time.perf_counter()` value
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.latencies = []
+        self.written = threading.Event()
+        self.expected = None
+
+    async def write(self, batch):
+        await super().write(batch)
+        now = time.perf_counter()
+        for message, _, _ in batch:
+            self.latencies.append(now - float(message.split(' ', 1)[0]))
+        if self.expected is not None and \
+                len(self.latencies) >= self.expected:
+            self.written.set()
+
+
+class BenchServer(EncSendServer):
+    writer_class = LatencyWriter
+
+
+def get_free_port(host):
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind((host, 0))
+        return s.getsockname()[1]
+
+
+def bench_end_to_end(key_path, dir_path, senders, messages, size,
+                     dsn_template=DSN_TEMPLATE, timeout=300):
+    """ Start server on localhost with temporary db, send messages from
+    concurrent senders, measure time from sending to commit
+
+    :param key_path: path to signing key of both sender and receiver
+    :type key_path: str
+    :param dir_path: directory for temporary db and files
+    :type dir_path: str
+    :param senders: number of concurrent senders
+    :type senders: int
+    :param messages: number of messages sent by every sender
+    :type messages: int
+    :param size: approximate message size
+    :type size: int
+    :param dsn_template: DSN of temporary db, `{path}` is replaced with
+        path to db file
+    :type dsn_template: str
+    :param timeout: max seconds to wait for all messages to be written
+    :type timeout: float
+    :return: summary with messages per second and latency
+    :rtype: dict
+    """
+    host = '127.0.0.1'
+    port = get_free_port(host)
+    dsn = dsn_template.format(path=os.path.join(dir_path, 'bench.db'))
+    client = ClientBase(key_path)
+    with connect(dsn) as conn:
+        migrate(conn)
+        cur = conn.cursor()
+        cur.execute(INSERT['hosts'], (client.verify_key_hex.decode(), host,
+                                      port))
+
+    loop = asyncio.new_event_loop()
+    server = BenchServer(loop, host, port, dsn, key_path, metrics_port=None,
+                         files_dir=dir_path)
+    server.start()
+    server.writer.expected = senders * messages
+    thread = threading.Thread(target=loop.run_forever)
+    thread.start()
+
+    padding = 'x' * max(size - 20, 0)
+
+    async def send(client, count):
+        for _ in range(count):
+            message = '%.9f %s' % (time.perf_counter(), padding)
+            await client.send_message(message, host_id=1)
+
+    async def run():
+        async with AsyncEncSendClient(asyncio.get_event_loop(), dsn,
+                                      key_path, pool_size=senders) as client:
+            await asyncio.gather(*[send(client, messages)
+                                   for _ in range(senders)])
+
+    try:
+        start = time.perf_counter()
+        asyncio.run(run())
+        if not server.writer.written.wait(timeout):
+            raise RuntimeError('messages weren\'t written in %d seconds'
+                               % timeout)
+        total_time = time.perf_counter() - start
+    finally:
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join()
+        server.stop()
+        loop.run_until_complete(server.wait())
+        loop.close()
+
+    result = summarize(server.writer.latencies, total_time)
+    result.update({'senders': senders, 'size': size})
+    return result
+
+
+def run_benchmarks(senders=10, messages=1000, size=1024,
+                   dsn_template=DSN_TEMPLATE):
+    """ Run end-to-end benchmark with temporary key and db, micro
+    benchmarks are in `tests/test_bench.py`
+
+    :param senders: number of concurrent senders
+    :type senders: int
+    :param messages: number of messages sent by every sender
+    :type messages: int
+    :param size: message size
+    :type size: int
+    :param dsn_template: DSN of temporary db, `{path}` is replaced with
+        path to db file
+    :type dsn_template: str
+    :return: results, ready to be serialized to json
+    :rtype: dict
+    """
+    with tempfile.TemporaryDirectory() as dir_path:
+        key_path = create_bench_key(dir_path)
+        return {'end_to_end': bench_end_to_end(
+            key_path, dir_path, senders, messages, size, dsn_template
+        )}
+
+
+def format_results(results):
+    """ Format benchmark results as a table
+
+    :param results: benchmark's name -> summary with `size` or
+        dictionary size -> summary
+    :type results: dict
+    :rtype: str
+    """
+    lines = ['\t'.join(['benchmark', 'size', 'count', 'ops', 'mean_us',
+                        'p50_us', 'p99_us'])]
+    rows = []
+    for name, result in results.items():
+        if 'size' in result:
+            rows.append((name, result['size'], result))
+        else:
+            rows.extend((name, size, summary)
+                        for size, summary in result.items())
+
+    for name, size, summary in rows:
+        lines.append('\t'.join([
+            name, str(size), str(summary['count']),
+            '%.1f' % summary['ops'], '%.1f' % summary['mean_us'],
+            '%.1f' % summary['p50_us'], '%.1f' % summary['p99_us']
+        ]))
+    return '\n'.join(lines)
@@ -1,41 +1,453 @@
 # -*- coding: utf-8 -*-
 
 import json
+import os
 import socket
+from collections import OrderedDict
 
-import pyodbc
+from nacl.bindings import (
+    crypto_secretstream_xchacha20poly1305_TAG_FINAL as TAG_FINAL,
+    crypto_secretstream_xchacha20poly1305_init_push as init_push,
+    crypto_secretstream_xchacha20poly1305_keygen as keygen,
+    crypto_secretstream_xchacha20poly1305_push as push,
+    crypto_secretstream_xchacha20poly1305_state as State
+)
 from nacl.encoding import HexEncoder
+from nacl.exceptions import CryptoError
 from nacl.public import SealedBox
+from nacl.secret import SecretBox
 from nacl.signing import VerifyKey
+from nacl.utils import random
 
-from .sql import SELECT
-from .utils import get_signing_key
+from .compression import UnsupportedCompression, compress, is_available
+from .storage import connect
+from .protocol import (ACK, ACK_ACCEPTED, ACK_STATUSES, CONTENT_KEY_SIZE,
+                       FRAME_ACK, FRAME_MESSAGE_ACK, FRAME_STREAM_CHUNK,
+                       FRAME_STREAM_START, FRAME_STREAM_START_ACK, FLAG_NONCE,
+                       HEADER, KEYED_VERSION, LEGACY_VERSION, VERSION,
+                       ProtocolError, ack_signed_data, message_digest,
+                       pack_envelope, pack_frame, pack_keyed, pack_message_ack,
+                       pack_nonce, pack_stream_start, read_frame_file,
+                       unpack_ack, unpack_message_ack)
+from .sql import SELECT, in_params
+from .keystore import get_keys, reload_keys
 try:
     from . import conf
 except ImportError:
     from . import conf_default as conf
 finally:
     DSN = conf.DSN
+    SEALED_BOXES_CACHE_SIZE = conf.SEALED_BOXES_CACHE_SIZE
+    PROTOCOL_VERSION = conf.PROTOCOL_VERSION
+    FILE_CHUNK_SIZE = conf.FILE_CHUNK_SIZE
+    ACK_WINDOW, ACK_TIMEOUT = conf.ACK_WINDOW, conf.CLIENT_TIMEOUT
+    COMPRESSION, COMPRESSION_MIN_SIZE = conf.COMPRESSION, \
+        conf.COMPRESSION_MIN_SIZE
+    SEND_NONCE = conf.SEND_NONCE
 
+# Max number of values bound to a single query, SQLite's default limit
+# is 999
+MAX_QUERY_PARAMS = 500
 
-class EncSendClient:
+
+class DeliveryError(OSError):
+    """ Connection failed before all acks were received or a file was
+    rejected, `statuses` has statuses of acked messages and None for the
+    others
+    """
+    def __init__(self, message, statuses):
+        super().__init__(message)
+        self.statuses = statuses
+
+
+def check_ack(verify_key, ack, digest):
+    """ Check ack's signature and that it refers to the sent message
+
+    :param verify_key: receiver's verify key
+    :type verify_key: nacl.signing.VerifyKey
+    :param ack: parsed ack
+    :type ack: encsend.protocol.Ack
+    :param digest: `message_digest` of the sent message
+    :type digest: bytes
+    :raises ProtocolError: ack is forged or refers to another message
+    """
+    if ack.digest != digest:
+        raise ProtocolError('ack refers to another message')
+    try:
+        verify_key.verify(ack_signed_data(ack), ack.signature)
+    except CryptoError:
+        raise ProtocolError('invalid ack signature')
+
+
+def read_ack(reader):
+    """ Read ack frame, signature isn't checked
+
+    :param reader: connection's file object
+    :type reader: io.BufferedReader
+    :rtype: encsend.protocol.Ack
+    :raises ConnectionError: connection was closed by the host
+    :raises ProtocolError: frame isn't a valid ack
+    """
+    frame = read_frame_file(reader, ACK.size)
+    if frame is None:
+        raise ConnectionError('connection closed by host')
+    _, frame_type, payload = frame
+    if frame_type != FRAME_ACK:
+        raise ProtocolError('unexpected frame type %d' % frame_type)
+    return unpack_ack(payload)
+
+
+def get_receivers(host_key, host_id):
+    """ Get receivers of a batch item, `host_key` is used if it isn't
+    None, otherwise - `host_id`, either of them may be a list of
+    receivers of the same message
+
+    :param host_key: hex encoded host's verify key or list of them
+    :type host_key: str or list of str or None
+    :param host_id: host's internal id or list of them
+    :type host_id: int or list of int or None
+    :return: list of tuples with host's key and id, only one of them
+        isn't None
+    :rtype: list of (str or None, int or None)
+    """
+    if host_key is not None:
+        if isinstance(host_key, str):
+            return [(host_key, None)]
+        return [(key, None) for key in host_key]
+    if isinstance(host_id, (list, tuple)):
+        return [(None, receiver_id) for receiver_id in host_id]
+    return [(None, host_id)]
+
+
+def is_closed(sock):
+    """ Check if the other side has closed the connection, e.g. server
+    closed an idle one, sending to such socket succeeds, but the data is
+    lost
+
+    :param sock: connected socket
+    :type sock: socket.socket
+    :rtype: bool
+    """
+    try:
+        return sock.recv(1, socket.MSG_PEEK | socket.MSG_DONTWAIT) == b''
+    except BlockingIOError:
+        return False
+    except OSError:
+        return True
+
+
+class ClientBase:
+    """ Base client class, signing and encrypting of messages """
+    def __init__(self, signature_path=None,
+                 sealed_boxes_size=SEALED_BOXES_CACHE_SIZE,
+                 protocol_version=PROTOCOL_VERSION, compression=COMPRESSION,
+                 send_nonce=SEND_NONCE):
+        """
+        :param signature_path: custom path to signature key file
+        :type signature_path: str or None
+        :param sealed_boxes_size: max number of hosts' sealed boxes kept
+            in memory
+        :type sealed_boxes_size: int
+        :param protocol_version: 2 - binary envelopes, 3 - binary
+            envelopes encrypted with content key sealed to every receiver,
+            1 - hex encoded json for receivers which don't support binary
+            envelopes
+        :type protocol_version: int
+        :param compression: `zlib`, `zstd`, `lz4` or None, compression of
+            messages, legacy json messages aren't compressed
+        :type compression: str or None
+        :param send_nonce: prepend send time and message id to messages,
+            receivers drop replayed messages, legacy json messages don't
+            carry them
+        :type send_nonce: bool
+        :raises UnsupportedCompression: compression isn't available
+        """
+        if compression is not None and not is_available(compression):
+            raise UnsupportedCompression('compression %s is unavailable'
+                                         % compression)
+        self.signature_path = signature_path
+        self.protocol_version = protocol_version
+        self.compression = compression
+        self.send_nonce = send_nonce
+        self.sealed_boxes_size = sealed_boxes_size
+        # LRU cache, hex encoded host's verify key -> SealedBox
+        self.sealed_boxes = OrderedDict()
+        self.init_keys()
+
+    def init_keys(self):
+        """ Take keys from the process' key store, call it again after
+        `encsend.keystore.reload_keys` to use rotated keys
+        """
+        keys = get_keys(self.signature_path)
+        self.signing_key = keys.signing_key
+        self.verify_key = keys.verify_key
+        self.verify_key_bytes = keys.verify_key_bytes
+        self.verify_key_hex = keys.verify_key_hex
+
+    def reload_keys(self):
+        """ Read signing key file again, e.g. on SIGHUP, current keys
+        are kept if the file can't be read
+        """
+        if reload_keys(self.signature_path) is not None:
+            self.init_keys()
+
+    def encrypt_message(self, message, host_key, message_id=None):
+        """ Encrypt and sign a message with host's key.
+
+        With binary envelopes message is signed, placed to an envelope with
+        this host's raw verify key and the envelope is encrypted.
+
+        With legacy format method creates a dictionary with two keys:
+        message - signed message, host - current host's hex encoded verify
+        key, serializes it to json, encrypts and encodes the result
+
+        :param message: message for the host
+        :type message: bytes
+        :param host_key: hex encoded the host's verify key
+        :type host_key: bytes
+        :param message_id: id for receiver's replay protection, the same
+            id is used when the message is sent again, if None - random id
+        :type message_id: bytes or None
+        :return: signed and encrypted message
+        :rtype: bytes
+        """
+        return self.seal_message(self.sign_message(message, message_id),
+                                 host_key)
+
+    def encrypt_multi(self, message, host_keys, message_id=None):
+        """ Encrypt and sign a message for many hosts, the message is
+        signed once, see `seal_multi`
+
+        :param message: message for the hosts
+        :type message: bytes
+        :param host_keys: hex encoded hosts' verify keys
+        :type host_keys: list of bytes
+        :param message_id: message id, see `encrypt_message`
+        :type message_id: bytes or None
+        :return: signed and encrypted message for every host
+        :rtype: list of bytes
+        """
+        return self.seal_multi(self.sign_message(message, message_id),
+                               host_keys)
+
+    def encrypt_batch(self, items):
+        """ Encrypt and sign many messages for many hosts, every item
+        is signed with it's own message id and, with protocol version 3,
+        encrypted once for all of it's receivers
+
+        Items with equal messages are encrypted separately, so receivers
+        don't drop them as replays
+
+        :param items: tuples with message and hex encoded verify keys of
+            it's receivers
+        :type items: list of (bytes, list of bytes)
+        :return: signed and encrypted message for every receiver of every
+            item
+        :rtype: list of list of bytes
+        """
+        return [self.encrypt_multi(message, host_keys)
+                for message, host_keys in items]
+
+    def make_frame(self, encrypted):
+        """ Prepend frame header to encrypted message
+
+        :param encrypted: result of `encrypt_message`
+        :type encrypted: bytes
+        :rtype: bytes
+        """
+        return pack_frame(encrypted, version=self.protocol_version)
+
+    def make_ack_frame(self, seq, encrypted):
+        """ Prepend frame header and sequence number to encrypted
+        message, the receiver answers with ack
+
+        :param seq: sequence number, unique within the connection
+        :type seq: int
+        :param encrypted: result of `encrypt_message`
+        :type encrypted: bytes
+        :rtype: bytes
+        """
+        return pack_frame(pack_message_ack(seq, encrypted), FRAME_MESSAGE_ACK,
+                          self.protocol_version)
+
+    def sign_message(self, message, message_id=None):
+        """ Sign a message and pack it with this host's key, envelope's
+        body is compressed and prepended with send time and id before
+        signing
+
+        :param message: message for the host
+        :type message: bytes
+        :param message_id: message id, see `encrypt_message`
+        :type message_id: bytes or None
+        :return: binary envelope or serialized json
+        :rtype: bytes
+        """
+        if self.protocol_version != LEGACY_VERSION:
+            flags, body = compress(message, self.compression,
+                                   COMPRESSION_MIN_SIZE)
+            if self.send_nonce:
+                flags |= FLAG_NONCE
+                body = pack_nonce(message_id) + body
+            return pack_envelope(self.signing_key, self.verify_key_bytes,
+                                 body, flags)
+
+        signed = self.signing_key.sign(message, encoder=HexEncoder)
+        dct = {
+            'host': self.verify_key_hex.decode(),
+            'message': signed.decode()
+        }
+        return json.dumps(dct).encode()
+
+    def seal_message(self, signed, host_key):
+        """ Encrypt signed message with host's key, legacy messages are
+        hex encoded
+
+        :param signed: result of `sign_message`
+        :type signed: bytes
+        :param host_key: hex encoded the host's verify key
+        :type host_key: bytes
+        :return: encrypted message
+        :rtype: bytes
+        """
+        if self.protocol_version == KEYED_VERSION:
+            return self.seal_multi(signed, [host_key])[0]
+        sealed_box = self.get_sealed_box(host_key)
+        if self.protocol_version == LEGACY_VERSION:
+            return sealed_box.encrypt(signed, encoder=HexEncoder)
+        return sealed_box.encrypt(signed)
+
+    def seal_multi(self, signed, host_keys):
+        """ Encrypt signed message for many hosts
+
+        With protocol version 3 the message is encrypted once with
+        a random content key and only the key is sealed to every host,
+        otherwise the whole message is sealed to every host
+
+        :param signed: result of `sign_message`
+        :type signed: bytes
+        :param host_keys: hex encoded hosts' verify keys
+        :type host_keys: list of bytes
+        :return: encrypted message for every host
+        :rtype: list of bytes
+        """
+        if self.protocol_version != KEYED_VERSION:
+            return [self.seal_message(signed, host_key)
+                    for host_key in host_keys]
+        key = random(CONTENT_KEY_SIZE)
+        encrypted = SecretBox(key).encrypt(signed)
+        return [pack_keyed(self.get_sealed_box(host_key).encrypt(key),
+                           encrypted)
+                for host_key in host_keys]
+
+    def file_frames(self, path, host_key, chunk_size=FILE_CHUNK_SIZE,
+                    name=None, seq=None):
+        """ Read a file and encrypt it chunk by chunk
+
+        The first frame carries a random secretstream key sealed to the
+        host and signed together with file size, name and, with
+        `send_nonce`, send time and id for replay protection, next frames
+        carry chunks encrypted with the key, the last chunk is tagged as
+        final. File isn't loaded to memory at once.
+
+        :param path: path to the file
+        :type path: str
+        :param host_key: hex encoded the host's verify key
+        :type host_key: bytes
+        :param chunk_size: size of plain text chunk
+        :type chunk_size: int
+        :param name: file name for the receiver, if None - the file's
+            base name is used
+        :type name: str or None
+        :param seq: sequence number of stream start with ack request, if
+            None - ack isn't requested
+        :type seq: int or None
+        :return: generator of frames
+        """
+        if name is None:
+            name = os.path.basename(path)
+        with open(path, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            key = keygen()
+            state = State()
+            header = init_push(state, key)
+
+            body = pack_stream_start(key, header, size, name)
+            flags = 0
+            if self.send_nonce:
+                flags = FLAG_NONCE
+                body = pack_nonce() + body
+            envelope = pack_envelope(self.signing_key, self.verify_key_bytes,
+                                     body, flags)
+            sealed = self.get_sealed_box(host_key).encrypt(envelope)
+            if seq is None:
+                yield pack_frame(sealed, FRAME_STREAM_START, VERSION)
+            else:
+                yield pack_frame(pack_message_ack(seq, sealed),
+                                 FRAME_STREAM_START_ACK, VERSION)
+
+            chunk = f.read(chunk_size)
+            while True:
+                next_chunk = f.read(chunk_size)
+                tag = 0 if next_chunk else TAG_FINAL
+                yield pack_frame(push(state, chunk, tag=tag),
+                                 FRAME_STREAM_CHUNK, VERSION)
+                if not next_chunk:
+                    break
+                chunk = next_chunk
+
+    def get_sealed_box(self, host_key):
+        """ Get SealedBox for host's public key, boxes are cached, so
+        key conversion is done once per host
+
+        :param host_key: hex encoded the host's verify key
+        :type host_key: bytes
+        :return: sealed box for encrypting messages to the host
+        :rtype: nacl.public.SealedBox
+        """
+        sealed_box = self.sealed_boxes.get(host_key)
+        if sealed_box is not None:
+            self.sealed_boxes.move_to_end(host_key)
+            return sealed_box
+
+        verify_key = VerifyKey(host_key, encoder=HexEncoder)
+        public_key = verify_key.to_curve25519_public_key()
+        sealed_box = SealedBox(public_key)
+        self.sealed_boxes[host_key] = sealed_box
+        if len(self.sealed_boxes) > self.sealed_boxes_size:
+            self.sealed_boxes.popitem(last=False)
+        return sealed_box
+
+
+class EncSendClient(ClientBase):
     """ EncSend client side implementation """
-    def __init__(self, dsn, signature_path=None):
+    def __init__(self, dsn, signature_path=None,
+                 protocol_version=PROTOCOL_VERSION, compression=COMPRESSION,
+                 send_nonce=SEND_NONCE):
         """
         :param dsn: Data Source Name, information about database driver,
             server, database, etc
         :type dsn: str
         :param signature_path: custom path to signature key file
         :type signature_path: str or None
+        :param protocol_version: 2 - binary envelopes, 3 - binary
+            envelopes encrypted with content key sealed to every receiver,
+            1 - hex encoded json for receivers which don't support binary
+            envelopes
+        :type protocol_version: int
+        :param compression: `zlib`, `zstd`, `lz4` or None, compression of
+            messages
+        :type compression: str or None
+        :param send_nonce: prepend send time and message id to messages
+        :type send_nonce: bool
         """
-        self.db_connection = pyodbc.connect(dsn)
+        self.db_connection = connect(dsn)
         self.db_cursor = self.db_connection.cursor()
-        self.signature_path = signature_path
-        self.init_keys()
-
-    def init_keys(self):
-        self.signing_key = get_signing_key(self.signature_path)
-        self.verify_key = self.signing_key.verify_key
+        # Open connections to hosts, (host, port) -> socket
+        self.connections = {}
+        # Sequence number of the next message with ack request
+        self.seq = 0
+        super().__init__(signature_path, protocol_version=protocol_version,
+                         compression=compression, send_nonce=send_nonce)
 
     def send_message(self, message, host_key=None, host_id=None):
         """ Send encrypted message to another host
@@ -59,39 +471,297 @@ class EncSendClient:
         if host_key is not None:
             host, port = self.get_host_by_key(host_key)
         elif host_id is not None:
-            host_key, host, port = self.get_host_by_id(host_key)
+            host_key, host, port = self.get_host_by_id(host_id)
 
         encrypted = self.encrypt_message(message, host_key.encode())
-        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-            s.connect((host, port))
-            s.sendall(encrypted)
+        self.send_frame(host, port, self.make_frame(encrypted))
+
+    def send_many(self, messages, host_keys=None, host_ids=None):
+        """ Send every message to every host
 
-    def encrypt_message(self, message, host_key):
-        """ Encrypt, sign and encode a message with host's key.
+        :param messages: unencrypted messages
+        :type messages: list
+        :param host_keys: hex encoded hosts' verify keys
+        :type host_keys: list or None
+        :param host_ids: internal hosts' ids
+        :type host_ids: list or None
+        """
+        items = []
+        for message in messages:
+            if host_keys:
+                items.append((message, list(host_keys), None))
+            if host_ids:
+                items.append((message, None, list(host_ids)))
+        self.send_batch(items)
 
-        Method creates a dictionary with two keys: message - signed
-        message, host - current host's hex encoded verify key, serializes
-        it to json, encrypts and encodes the result
+    def send_batch(self, items):
+        """ Send many messages to many hosts
 
-        :param message: message for the host
-        :type message: bytes
-        :param host_key: hex encoded the host's verify key
-        :type host_key: bytes
-        :return: signed, encrypted and hex encoded message
-        :rtype: bytes
+        All hosts are selected from db at once, messages are encrypted
+        by `encrypt_batch`, messages to the same host are sent together
+        over a single connection
+
+        :param items: tuples with unencrypted message, host's hex encoded
+            verify key and host's internal id, see `get_receivers`
+        :type items: iterable of (str or bytes, str or list or None,
+            int or list or None)
+        :raises LookupError: some of hosts weren't found in db, nothing
+            is sent in this case
         """
-        verify_key = VerifyKey(host_key, encoder=HexEncoder)
-        public_key = verify_key.to_curve25519_public_key()
-        sealed_box = SealedBox(public_key)
+        items = [(message, get_receivers(host_key, host_id))
+                 for message, host_key, host_id in items]
+        host_keys = {host_key for _, receivers in items
+                     for host_key, _ in receivers if host_key is not None}
+        host_ids = {host_id for _, receivers in items
+                    for host_key, host_id in receivers if host_key is None}
+        by_key, by_id = {}, {}
+        for host_id, host_key, host, port in self.get_hosts(host_keys,
+                                                            host_ids):
+            by_key[host_key] = by_id[host_id] = (host_key, host, port)
 
-        signed = self.signing_key.sign(message, encoder=HexEncoder)
-        dct = {
-            'host': self.verify_key.encode(encoder=HexEncoder).decode(),
-            'message': signed.decode()
-        }
-        json_data = json.dumps(dct)
-        encrypted = sealed_box.encrypt(json_data.encode(), encoder=HexEncoder)
-        return encrypted
+        resolved = []
+        for message, receivers in items:
+            details = []
+            for host_key, host_id in receivers:
+                if host_key is not None:
+                    found = by_key.get(host_key)
+                else:
+                    found = by_id.get(host_id)
+                if found is None:
+                    raise LookupError('host %s not found'
+                                      % (host_key or host_id))
+                details.append(found)
+
+            if not isinstance(message, bytes):
+                message = message.encode()
+            resolved.append((message, details))
+
+        encrypted = self.encrypt_batch([
+            (message, [host_key.encode() for host_key, _, _ in details])
+            for message, details in resolved
+        ])
+        frames = {}
+        for (_, details), copies in zip(resolved, encrypted):
+            for (_, host, port), sealed in zip(details, copies):
+                frames.setdefault((host, port), []).append(
+                    self.make_frame(sealed)
+                )
+
+        for (host, port), host_frames in frames.items():
+            self.send_frame(host, port, b''.join(host_frames))
+
+    def send_acked(self, messages, host_key=None, host_id=None):
+        """ Send messages to another host and wait for acks, messages
+        are pipelined, the client doesn't wait for an ack before sending
+        the next message
+
+        If both args `host_key` and `host_id` are entered, `host_key`
+        is used and `host_id` is ignored
+
+        :param messages: unencrypted messages
+        :type messages: list
+        :param host_key: hex encoded host's verify key
+        :type host_key: str or None
+        :param host_id: internal host's id
+        :type host_id: int or None
+        :return: ack status of every message, see `encsend.protocol`
+        :rtype: list of int
+        :raises DeliveryError: connection failed before all acks were
+            received
+        """
+        if host_key is not None:
+            host, port = self.get_host_by_key(host_key)
+        elif host_id is not None:
+            host_key, host, port = self.get_host_by_id(host_id)
+
+        encrypted = []
+        for message in messages:
+            if not isinstance(message, bytes):
+                message = message.encode()
+            encrypted.append(self.encrypt_message(message, host_key.encode()))
+        return self.send_sealed(host, port, host_key, encrypted)
+
+    def send_sealed(self, host, port, host_key, encrypted,
+                    window=ACK_WINDOW, timeout=ACK_TIMEOUT):
+        """ Send encrypted messages over persistent connection, up to
+        `window` messages wait for acks at once
+
+        :param host: host's address
+        :type host: str
+        :param port: host's port
+        :type port: int
+        :param host_key: hex encoded host's verify key for checking acks
+        :type host_key: str
+        :param encrypted: results of `encrypt_message`
+        :type encrypted: list of bytes
+        :param window: max number of messages waiting for acks
+        :type window: int
+        :param timeout: max seconds of waiting for an ack
+        :type timeout: float
+        :return: ack status of every message
+        :rtype: list of int
+        :raises DeliveryError: connection failed before all acks were
+            received
+        """
+        verify_key = VerifyKey(host_key.encode(), encoder=HexEncoder)
+        reused = (host, port) in self.connections
+        statuses = [None] * len(encrypted)
+        # seq -> (message's index, digest)
+        pending = {}
+        sent = 0
+        try:
+            sock = self.get_connection(host, port)
+            sock.settimeout(timeout)
+            reader = sock.makefile('rb')
+            try:
+                while sent < len(encrypted) or pending:
+                    frames = []
+                    while sent < len(encrypted) and len(pending) < window:
+                        pending[self.seq] = (sent,
+                                             message_digest(encrypted[sent]))
+                        frames.append(self.make_ack_frame(self.seq,
+                                                          encrypted[sent]))
+                        self.seq += 1
+                        sent += 1
+                    if frames:
+                        sock.sendall(b''.join(frames))
+
+                    ack = read_ack(reader)
+                    if ack.seq not in pending:
+                        raise ProtocolError('unexpected ack')
+                    index, digest = pending.pop(ack.seq)
+                    check_ack(verify_key, ack, digest)
+                    statuses[index] = ack.status
+            finally:
+                reader.close()
+                sock.settimeout(None)
+        except (OSError, ProtocolError) as e:
+            self.close_connection(host, port)
+            # Connection may have been closed by the other side while it
+            # was idle, it is reopened if nothing was acked
+            if reused and isinstance(e, OSError) and \
+                    all(status is None for status in statuses):
+                return self.send_sealed(host, port, host_key, encrypted,
+                                        window, timeout)
+            raise DeliveryError(str(e), statuses)
+        return statuses
+
+    def send_file(self, path, host_key=None, host_id=None,
+                  chunk_size=FILE_CHUNK_SIZE, name=None, ack=True,
+                  timeout=ACK_TIMEOUT):
+        """ Send encrypted file to another host chunk by chunk
+
+        If both args `host_key` and `host_id` are entered, `host_key`
+        is used and `host_id` is ignored. All chunks are sent over the
+        connection the stream started on, with `ack` the host's ack is
+        awaited after the final chunk
+
+        :param path: path to the file
+        :type path: str
+        :param host_key: hex encoded host's verify key
+        :type host_key: str or None
+        :param host_id: internal host's id
+        :type host_id: int or None
+        :param chunk_size: size of plain text chunk
+        :type chunk_size: int
+        :param name: file name for the receiver, if None - the file's
+            base name is used
+        :type name: str or None
+        :param ack: wait until the host saves the file
+        :type ack: bool
+        :param timeout: max seconds of waiting for the ack
+        :type timeout: float
+        :raises DeliveryError: connection failed before the file was
+            acked or the host rejected the file
+        """
+        if host_key is not None:
+            host, port = self.get_host_by_key(host_key)
+        elif host_id is not None:
+            host_key, host, port = self.get_host_by_id(host_id)
+
+        seq = None
+        if ack:
+            seq = self.seq
+            self.seq += 1
+        frames = self.file_frames(path, host_key.encode(), chunk_size, name,
+                                  seq)
+        start = next(frames)
+        # Stale connection may be reopened only before the stream started,
+        # chunks sent over another connection would be dropped
+        self.send_frame(host, port, start)
+        sock = self.connections[(host, port)]
+        try:
+            try:
+                for frame in frames:
+                    sock.sendall(frame)
+            except OSError:
+                # The host may have rejected the file and closed the
+                # connection, it's ack explains why
+                if not ack:
+                    raise
+            if not ack:
+                return
+            _, sealed = unpack_message_ack(start[HEADER.size:])
+            sock.settimeout(timeout)
+            with sock.makefile('rb') as reader:
+                received = read_ack(reader)
+            sock.settimeout(None)
+            if received.seq != seq:
+                raise ProtocolError('unexpected ack')
+            check_ack(VerifyKey(host_key.encode(), encoder=HexEncoder),
+                      received, message_digest(sealed))
+        except (OSError, ProtocolError) as e:
+            self.close_connection(host, port)
+            raise DeliveryError(str(e), [None])
+        if received.status != ACK_ACCEPTED:
+            raise DeliveryError('file was rejected: %s' % ACK_STATUSES.get(
+                received.status, received.status
+            ), [received.status])
+
+    def get_connection(self, host, port):
+        """ Get open connection to the host, connect if there isn't one
+        or it was closed by the host
+
+        :param host: host's address
+        :type host: str
+        :param port: host's port
+        :type port: int
+        :return: connected socket
+        :rtype: socket.socket
+        """
+        sock = self.connections.get((host, port))
+        if sock is not None and is_closed(sock):
+            self.close_connection(host, port)
+            sock = None
+        if sock is None:
+            sock = socket.create_connection((host, port))
+            self.connections[(host, port)] = sock
+        return sock
+
+    def close_connection(self, host, port):
+        sock = self.connections.pop((host, port), None)
+        if sock is not None:
+            sock.close()
+
+    def send_frame(self, host, port, frame):
+        """ Send a frame over persistent connection to the host
+
+        Connection closed by the other side while it was idle is
+        reopened before sending, if sending fails, the connection is
+        reopened and the frame is sent once again
+
+        :param host: host's address
+        :type host: str
+        :param port: host's port
+        :type port: int
+        :param frame: frame with header
+        :type frame: bytes
+        """
+        try:
+            self.get_connection(host, port).sendall(frame)
+        except OSError:
+            self.close_connection(host, port)
+            self.get_connection(host, port).sendall(frame)
 
     def get_host_by_key(self, host_key):
         """ Get host details by it's verify key
@@ -115,7 +785,31 @@ class EncSendClient:
         self.db_cursor.execute(SELECT['hosts-id'], (host_id,))
         return self.db_cursor.fetchall()[0]
 
+    def get_hosts(self, host_keys=(), host_ids=()):
+        """ Get details of many hosts by their verify keys and internal ids
+
+        :param host_keys: hex encoded hosts' verify keys
+        :type host_keys: iterable of str
+        :param host_ids: hosts' internal ids
+        :type host_ids: iterable of int
+        :return: list of tuples with host's id, verify key, host and port
+        :rtype: list of (int, str, str, int)
+        """
+        host_keys, host_ids = list(host_keys), list(host_ids)
+        rows = []
+        while host_keys or host_ids:
+            keys = host_keys[:MAX_QUERY_PARAMS]
+            ids = host_ids[:MAX_QUERY_PARAMS - len(keys)]
+            del host_keys[:len(keys)], host_ids[:len(ids)]
+            query = SELECT['hosts-many'].format(keys=in_params(len(keys)),
+                                                ids=in_params(len(ids)))
+            self.db_cursor.execute(query, keys + ids)
+            rows.extend(self.db_cursor.fetchall())
+        return rows
+
     def close(self):
+        for host, port in list(self.connections):
+            self.close_connection(host, port)
         self.db_connection.close()
 
 
@@ -141,3 +835,73 @@ def send_message(message, dsn=DSN, path=None, host_key=None, host_id=None):
     client = EncSendClient(dsn, path)
     client.send_message(message, host_key, host_id)
     client.close()
+
+
+def send_acked(messages, dsn=DSN, path=None, host_key=None, host_id=None):
+    """ Send messages to another host and wait for acks
+
+    :param messages: unencrypted messages
+    :type messages: list
+    :param dsn: Data Source Name, information about database driver,
+        server, database, etc
+    :type dsn: str
+    :param path: path to signature key file, if path is `None`
+        default path is used
+    :type path: str or None
+    :param host_key: hex encoded host's verify key
+    :type host_key: str or None
+    :param host_id: internal host's id
+    :type host_id: int or None
+    :return: ack status of every message
+    :rtype: list of int
+    """
+    client = EncSendClient(dsn, path)
+    try:
+        return client.send_acked(messages, host_key, host_id)
+    finally:
+        client.close()
+
+
+def send_batch(items, dsn=DSN, path=None):
+    """ Send many messages to many hosts using a single client
+
+    :param items: tuples with unencrypted message, host's hex encoded
+        verify key and host's internal id, see `EncSendClient.send_batch`
+    :type items: iterable of (str or bytes, str or None, int or None)
+    :param dsn: Data Source Name, information about database driver,
+        server, database, etc
+    :type dsn: str
+    :param path: path to signature key file, if path is `None`
+        default path is used
+    :type path: str or None
+    """
+    client = EncSendClient(dsn, path)
+    try:
+        client.send_batch(items)
+    finally:
+        client.close()
+
+
+def send_file(path, dsn=DSN, signature_path=None, host_key=None,
+              host_id=None):
+    """ Send encrypted file to another host
+
+    :param path: path to the file
+    :type path: str
+    :param dsn: Data Source Name, information about database driver,
+        server, database, etc
+    :type dsn: str
+    :param signature_path: path to signature key file, if path is `None`
+        default path is used
+    :type signature_path: str or None
+    :param host_key: hex encoded host's verify key
+    :type host_key: str or None
+    :param host_id: internal host's id
+    :type host_id: int or None
+    :raises DeliveryError: the file wasn't saved by the host
+    """
+    client = EncSendClient(dsn, signature_path)
+    try:
+        client.send_file(path, host_key, host_id)
+    finally:
+        client.close()
@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+
+import io
+import zlib
+
+# zstd and lz4 are optional, they are used only if installed
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
+
+# Lower bits of envelope flags are compression algorithm of the body
+COMPRESSION_MASK = 0x03
+COMPRESSION_NONE = 0
+COMPRESSION_ZLIB = 1
+COMPRESSION_ZSTD = 2
+COMPRESSION_LZ4 = 3
+COMPRESSIONS = {
+    'zlib': COMPRESSION_ZLIB,
+    'zstd': COMPRESSION_ZSTD,
+    'lz4': COMPRESSION_LZ4
+}
+# zlib.error, lz4's RuntimeError, zstandard.ZstdError
+DECOMPRESSION_ERRORS = (zlib.error, RuntimeError, ValueError)
+if zstandard is not None:
+    DECOMPRESSION_ERRORS += (zstandard.ZstdError,)
+
+
+class CompressionError(Exception):
+    """ Body can't be decompressed """
+
+
+class UnsupportedCompression(CompressionError):
+    """ Compression algorithm isn't known or it's library isn't
+    installed
+    """
+
+
+class DecompressedTooLarge(CompressionError):
+    """ Decompressed body is larger than allowed """
+
+
+def is_available(name):
+    """ Check if compression algorithm can be used
+
+    :param name: `zlib`, `zstd` or `lz4`
+    :type name: str
+    :rtype: bool
+    """
+    if name == 'zstd':
+        return zstandard is not None
+    if name == 'lz4':
+        return lz4 is not None
+    return name in COMPRESSIONS
+
+
+def compress(data, name, min_size=0):
+    """ Compress envelope's body
+
+    :param data: body
+    :type data: bytes
+    :param name: `zlib`, `zstd`, `lz4` or None - don't compress
+    :type name: str or None
+    :param min_size: smaller bodies aren't compressed
+    :type min_size: int
+    :return: tuple with envelope flags and body, body is left as is if
+        compression doesn't make it smaller
+    :rtype: (int, bytes)
+    :raises UnsupportedCompression: algorithm isn't available
+    """
+    if name is None or len(data) < min_size:
+        return COMPRESSION_NONE, data
+    if not is_available(name):
+        raise UnsupportedCompression('compression %s is unavailable' % name)
+
+    if name == 'zlib':
+        compressed = zlib.compress(data)
+    elif name == 'zstd':
+        compressed = zstandard.ZstdCompressor().compress(data)
+    else:
+        compressed = lz4.frame.compress(data)
+    if len(compressed) >= len(data):
+        return COMPRESSION_NONE, data
+    return COMPRESSIONS[name], compressed
+
+
+def decompress(flags, data, max_size):
+    """ Decompress envelope's body, decompression stops as soon as
+    `max_size` is exceeded, so small bodies can't expand to huge ones
+
+    :param flags: envelope flags
+    :type flags: int
+    :param data: body
+    :type data: bytes
+    :param max_size: max allowed size of decompressed body
+    :type max_size: int
+    :rtype: bytes
+    :raises UnsupportedCompression: algorithm isn't available
+    :raises DecompressedTooLarge: decompressed body is too large
+    :raises CompressionError: body is corrupted
+    """
+    compression = flags & COMPRESSION_MASK
+    if compression == COMPRESSION_NONE:
+        return data
+
+    try:
+        if compression == COMPRESSION_ZLIB:
+            decompressor = zlib.decompressobj()
+            result = decompressor.decompress(data, max_size + 1)
+            if not decompressor.eof and len(result) <= max_size:
+                raise CompressionError('truncated zlib stream')
+        elif compression == COMPRESSION_ZSTD and zstandard is not None:
+            reader = zstandard.ZstdDecompressor().stream_reader(
+                io.BytesIO(data)
+            )
+            result = reader.read(max_size + 1)
+        elif compression == COMPRESSION_LZ4 and lz4 is not None:
+            decompressor = lz4.frame.LZ4FrameDecompressor()
+            result = decompressor.decompress(data, max_length=max_size + 1)
+        else:
+            raise UnsupportedCompression('unsupported compression %d'
+                                         % compression)
+    except DECOMPRESSION_ERRORS as e:
+        raise CompressionError(str(e))
+
+    if len(result) > max_size:
+        raise DecompressedTooLarge('decompressed body is larger than %d '
+                                   'bytes' % max_size)
+    return result
@@ -3,5 +3,132 @@
 # TCP Server
 HOST = '127.0.0.1'
 PORT = 8888
-# Data Source Name, database driver, server, db name, etc
-DSN = 'Driver=SQLite3;Database=sqlite.db'
+# Data Source Name: `sqlite:path/to/db` - sqlite3 from the standard
+# library, `memory:name` - in-memory db for tests, otherwise - ODBC
+# connection string with database driver, server, db name, etc, for
+# example 'Driver=SQLite3;Database=sqlite.db'
+DSN = 'sqlite:sqlite.db'
+# Pragmas applied to every new SQLite connection, native or ODBC: WAL
+# lets the server insert while CLI reads, NORMAL synchronous is durable
+# in WAL mode except for power loss, memory mapped io up to 256 MiB and
+# 64 MiB page cache, wait for locks up to 5 seconds
+SQLITE_PRAGMAS = (
+    ('journal_mode', 'WAL'),
+    ('synchronous', 'NORMAL'),
+    ('mmap_size', 256 * 1024 ** 2),
+    ('cache_size', -64 * 1024),
+    ('busy_timeout', 5000)
+)
+# Lock secret keys in memory, so they aren't written to swap, may need
+# raised RLIMIT_MEMLOCK
+KEY_MLOCK = False
+# Max length of a single frame's payload in bytes
+MAX_MESSAGE_SIZE = 1024 * 1024
+# Compression of message bodies before signing and sealing: 'zlib',
+# 'zstd', 'lz4' (zstd and lz4 need `zstandard` and `lz4` packages) or
+# None - disabled, receivers older than compression reject compressed
+# messages; smaller bodies aren't compressed; max size of decompressed
+# body accepted by server
+COMPRESSION = None
+COMPRESSION_MIN_SIZE = 512
+MAX_DECOMPRESSED_SIZE = 8 * 1024 * 1024
+# Asyncio client, max open connections per host, max messages being
+# sent at once and connect/send timeout in seconds
+CLIENT_POOL_SIZE = 4
+CLIENT_CONCURRENCY = 100
+CLIENT_TIMEOUT = 10
+# Max number of sent messages waiting for acks on a connection
+ACK_WINDOW = 64
+# Clients prepend send time and random id to messages, so receivers drop
+# replayed and duplicate messages, receivers older than replay protection
+# reject such messages. Server rejects messages sent more than
+# REPLAY_WINDOW seconds away from it's time and remembers ids of accepted
+# messages for the window, up to REPLAY_CACHE_SIZE ids and up to
+# REPLAY_CACHE_HOST_SIZE ids of one sender, messages which don't fit are
+# rejected with a temporary error; REQUIRE_NONCE - reject messages
+# without send time and id, e.g. from legacy clients
+SEND_NONCE = True
+REPLAY_WINDOW = 300
+REPLAY_CACHE_SIZE = 100000
+REPLAY_CACHE_HOST_SIZE = 20000
+REQUIRE_NONCE = False
+# Number of workers decrypting and verifying incoming messages, 0 - do it
+# in the event loop's thread; kind of workers, 'thread' or 'process'
+CRYPTO_WORKERS = 0
+CRYPTO_BACKEND = 'thread'
+# Max number of known hosts kept in server's memory and seconds after
+# which cached host is selected from db again
+HOSTS_CACHE_SIZE = 10000
+HOSTS_CACHE_TTL = 300
+# Max number of receivers' sealed boxes (derived public keys) kept
+# in client's memory
+SEALED_BOXES_CACHE_SIZE = 1024
+# Wire protocol version used by clients, 2 - binary envelopes,
+# 3 - binary envelopes encrypted once with content key sealed to every
+# receiver, 1 - hex encoded json for receivers which don't support binary
+# envelopes
+PROTOCOL_VERSION = 2
+# Server inserts received messages in batches: max messages per
+# transaction, max delay in seconds before a message is written and max
+# number of messages waiting to be written
+WRITE_BATCH_SIZE = 500
+WRITE_FLUSH_INTERVAL = 0.01
+WRITE_QUEUE_SIZE = 10000
+# Directory for received files, None - `${XDG_DATA_HOME}/encsend/files`;
+# max size of received file and size of chunks files are sent in
+FILES_DIR = None
+MAX_FILE_SIZE = 4 * 1024 ** 3
+FILE_CHUNK_SIZE = 64 * 1024
+# Server limits: max seconds for reading a frame, including waiting for
+# it (None - no limit), max number of open connections, total and from
+# a single ip address
+READ_TIMEOUT = 60
+MAX_CONNECTIONS = 1000
+MAX_CONNECTIONS_PER_IP = 100
+# Server's metrics in Prometheus text format are available over http,
+# worker processes use METRICS_PORT + worker's number, None - disabled
+METRICS_HOST = '127.0.0.1'
+METRICS_PORT = 8889
+# Outbox: max number of messages sent to a host at once, seconds
+# between checks of empty outbox, delays before retrying unreachable
+# host grow from min to max seconds
+OUTBOX_BATCH_SIZE = 500
+OUTBOX_POLL_INTERVAL = 1
+OUTBOX_BACKOFF_MIN = 1
+OUTBOX_BACKOFF_MAX = 300
+# Discovery: udp host and port, the port is the same on all peers,
+# broadcast address; host announced to peers, None - peers use source
+# address of announcements, it isn't signed, so peers don't update
+# address of this host once they know it, announced port is PORT
+DISCOVERY_HOST = '0.0.0.0'
+DISCOVERY_PORT = 8890
+DISCOVERY_ADDR = '255.255.255.255'
+DISCOVERY_ANNOUNCE_HOST = None
+# Announcement interval in seconds grows from min to max with number of
+# peers, so all peers together send about DISCOVERY_RATE announcements
+# per second; peers are forgotten after missing 3 announcements
+DISCOVERY_INTERVAL_MIN = 5
+DISCOVERY_INTERVAL_MAX = 300
+DISCOVERY_RATE = 10
+# Seconds between writes of new and moved peers to hosts_t; True - new
+# peers are added to hosts_t, so any host able to broadcast to the LAN
+# can send messages, False - only addresses of known hosts are updated;
+# max number of peers kept in memory, new peers are ignored above it
+DISCOVERY_FLUSH_INTERVAL = 1
+DISCOVERY_ADD_HOSTS = False
+DISCOVERY_MAX_PEERS = 1000
+# Agent keeps keys, db pool and connections to hosts open, `message-send`
+# hands messages off to it over Unix socket: path to the socket, None -
+# `${XDG_RUNTIME_DIR}/encsend/agent.sock`; max seconds CLI waits for
+# agent's response
+AGENT_SOCKET = None
+AGENT_TIMEOUT = 30
+# Subscriptions to received messages: max messages read from db at once,
+# seconds between checks of db for messages written by other processes,
+# e.g. other server workers
+SUBSCRIBE_BATCH_SIZE = 500
+SUBSCRIBE_POLL_INTERVAL = 1
+# Server pushes received messages as json lines after they are written
+# to db: `-` - to stdout, path - to consumers connected to Unix socket,
+# None - disabled
+STREAM = None
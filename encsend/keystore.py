@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+
+import ctypes
+import ctypes.util
+import logging
+import mmap
+import os
+import threading
+
+from nacl.encoding import HexEncoder
+from nacl.signing import SigningKey
+
+from .utils import get_signing_key, get_signing_key_path
+
+try:
+    from . import conf
+except ImportError:
+    from . import conf_default as conf
+finally:
+    KEY_MLOCK = conf.KEY_MLOCK
+
+logger = logging.getLogger(__name__)
+
+
+def lock_memory(data):
+    """ Lock pages of bytes object's buffer in memory, so they aren't
+    written to swap
+
+    :param data: bytes object, it's buffer isn't copied
+    :type data: bytes
+    :return: True if pages were locked
+    :rtype: bool
+    """
+    name = ctypes.util.find_library('c')
+    if name is None:
+        return False
+    libc = ctypes.CDLL(name, use_errno=True)
+    address = ctypes.cast(ctypes.c_char_p(data), ctypes.c_void_p).value
+    start = address - address % mmap.PAGESIZE
+    length = address + len(data) - start
+    if libc.mlock(ctypes.c_void_p(start), ctypes.c_size_t(length)) != 0:
+        logger.warning('failed to lock key in memory: %s',
+                       os.strerror(ctypes.get_errno()))
+        return False
+    return True
+
+
+class Keys:
+    """ Host's signing key and keys derived from it, keys are derived
+    once and shared by all clients and servers of the process
+
+    Keys are pickled as signing key's seed, so they are passed to
+    worker processes without reading the key file again
+    """
+    def __init__(self, signing_key):
+        """
+        :param signing_key: host's signing key
+        :type signing_key: nacl.signing.SigningKey
+        """
+        self.signing_key = signing_key
+        self.verify_key = signing_key.verify_key
+        self.verify_key_bytes = self.verify_key.encode()
+        self.verify_key_hex = self.verify_key.encode(encoder=HexEncoder)
+        self.private_key = signing_key.to_curve25519_private_key()
+        self.locked = False
+
+    def __reduce__(self):
+        return keys_from_seed, (bytes(self.signing_key),)
+
+    def lock(self):
+        """ Lock secret keys in memory, Python may keep copies of them
+        elsewhere, so it only reduces chances of the keys being swapped
+
+        :return: True if all secret keys were locked
+        :rtype: bool
+        """
+        secrets = (bytes(self.signing_key), bytes(self.private_key),
+                   # Seed with public key, used for signing
+                   getattr(self.signing_key, '_signing_key', b''))
+        self.locked = all([lock_memory(secret) for secret in secrets
+                           if secret])
+        return self.locked
+
+
+def keys_from_seed(seed):
+    return Keys(SigningKey(seed))
+
+
+class KeyStore:
+    """ Keys loaded from key files, every file is read once, `load`
+    reads it again, e.g. after key rotation
+    """
+    def __init__(self, mlock=KEY_MLOCK):
+        """
+        :param mlock: lock secret keys in memory
+        :type mlock: bool
+        """
+        self.mlock = mlock
+        # path to key file -> Keys
+        self.keys = {}
+        self.lock = threading.Lock()
+
+    def get(self, path=None):
+        """ Get keys, the key file is read on first call only
+
+        :param path: path to signing key file, if path is `None`
+            default path is used
+        :type path: str or None
+        :rtype: Keys
+        """
+        path = self.normalize(path)
+        with self.lock:
+            keys = self.keys.get(path)
+        if keys is None:
+            keys = self.load(path)
+        return keys
+
+    def load(self, path=None):
+        """ Read key file and replace cached keys
+
+        :param path: path to signing key file, if path is `None`
+            default path is used
+        :type path: str or None
+        :rtype: Keys
+        """
+        path = self.normalize(path)
+        keys = Keys(get_signing_key(path))
+        self.put(path, keys)
+        return keys
+
+    def put(self, path, keys):
+        """ Cache keys loaded elsewhere, e.g. passed by parent process
+
+        :param path: path to signing key file, if path is `None`
+            default path is used
+        :type path: str or None
+        :param keys: keys
+        :type keys: Keys
+        """
+        if self.mlock and not keys.locked:
+            keys.lock()
+        with self.lock:
+            self.keys[self.normalize(path)] = keys
+
+    def normalize(self, path):
+        if path is None:
+            path = get_signing_key_path()
+        return os.path.abspath(path)
+
+
+store = KeyStore()
+
+
+def get_keys(path=None):
+    """ Get keys from the process' key store, see `KeyStore.get` """
+    return store.get(path)
+
+
+def reload_keys(path=None):
+    """ Read key file again, e.g. on SIGHUP, see `KeyStore.load`
+
+    :return: new keys, None if the file can't be read and current keys
+        are kept
+    :rtype: Keys or None
+    """
+    try:
+        return store.load(path)
+    except (OSError, ValueError) as e:
+        logger.error('failed to reload signing key: %s', e)
@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+
+import time
+
+from .sql import ALTER, CREATE, INSERT, SELECT
+
+# Schema versions in order, every migration is a tuple with version,
+# description and statements. Applied migrations are never changed, the
+# schema is changed by adding a new migration
+MIGRATIONS = (
+    (1, 'messages, hosts and files tables', (
+        CREATE['messages'],
+        CREATE['hosts'],
+        CREATE['files']
+    )),
+    (2, 'messages host and datetime indexes', (
+        CREATE['messages-host-index'],
+        CREATE['messages-datetime-index']
+    )),
+    (3, 'outbox table', (
+        CREATE['outbox'],
+        CREATE['outbox-host-index']
+    )),
+    (4, 'outbox message ids', (
+        ALTER['outbox-uid'],
+    )),
+    (5, 'consumer cursors', (
+        CREATE['consumers'],
+    ))
+)
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def get_version(conn):
+    """ Get current schema version
+
+    :param conn: pyodbc connection
+    :return: version of the last applied migration, 0 for empty db
+    :rtype: int
+    """
+    cur = conn.cursor()
+    cur.execute(CREATE['schema-version'])
+    conn.commit()
+    cur.execute(SELECT['schema-version'])
+    row = cur.fetchone()
+    cur.close()
+    if row is None or row[0] is None:
+        return 0
+    return row[0]
+
+
+def begin(conn):
+    """ Start a transaction explicitly, sqlite3 module doesn't start one
+    before DDL statements, so they would be committed one by one. pyodbc
+    connections are in a transaction already unless autocommit is on
+
+    :param conn: pyodbc or sqlite3 connection
+    """
+    if getattr(conn, 'in_transaction', True):
+        return
+    conn.execute('BEGIN')
+
+
+def migrate(conn, target=LATEST_VERSION):
+    """ Apply migrations newer than current schema version, every
+    migration is applied in it's own transaction, so a failed one
+    leaves the schema and it's version as they were. Databases without
+    transactional DDL, e.g. MySQL, commit every statement anyway
+
+    Databases created before migrations were introduced are upgraded
+    too, statements of the first versions don't fail on existing tables
+
+    :param conn: pyodbc connection
+    :param target: apply migrations up to this version
+    :type target: int
+    :return: applied versions
+    :rtype: list of int
+    """
+    current = get_version(conn)
+    applied = []
+    for version, _, statements in MIGRATIONS:
+        if version <= current or version > target:
+            continue
+        begin(conn)
+        cur = conn.cursor()
+        try:
+            for statement in statements:
+                cur.execute(statement)
+            cur.execute(INSERT['schema-version'], (version, int(time.time())))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            cur.close()
+        applied.append(version)
+    return applied
@@ -0,0 +1,248 @@
+# -*- coding: utf-8 -*-
+
+import logging
+import os
+import random
+import signal
+import threading
+import time
+
+from .client import MAX_QUERY_PARAMS, EncSendClient, get_receivers
+from .protocol import (ACK_ACCEPTED, ACK_STATUSES, MESSAGE_ID_SIZE,
+                       NACK_ERROR, NACK_REPLAY, NACK_STALE)
+from .sql import DELETE, INSERT, SELECT, in_params
+
+try:
+    from . import conf
+except ImportError:
+    from . import conf_default as conf
+finally:
+    DSN = conf.DSN
+    BATCH_SIZE, POLL_INTERVAL = conf.OUTBOX_BATCH_SIZE, \
+        conf.OUTBOX_POLL_INTERVAL
+    BACKOFF_MIN, BACKOFF_MAX = conf.OUTBOX_BACKOFF_MIN, \
+        conf.OUTBOX_BACKOFF_MAX
+
+logger = logging.getLogger(__name__)
+
+
+class Outbox(EncSendClient):
+    """ Persistent queue of outgoing messages
+
+    Queueing is a local insert, so callers don't wait for receivers and
+    messages aren't lost when a receiver is down. `run` sends queued
+    messages: messages to the same host are pipelined in batches over
+    one connection, a message is deleted from the outbox after the
+    receiver acked it. Messages rejected by the receiver are deleted
+    too, they won't be accepted on retry. Every message keeps it's id
+    between retries, so the receiver drops messages it has already
+    saved. Unreachable hosts and hosts
+    failing to save messages are retried with exponential backoff,
+    other hosts aren't delayed by them.
+    """
+    def __init__(self, dsn, signature_path=None, batch_size=BATCH_SIZE,
+                 poll_interval=POLL_INTERVAL, backoff_min=BACKOFF_MIN,
+                 backoff_max=BACKOFF_MAX, **kwargs):
+        """
+        :param dsn: Data Source Name, information about database driver,
+            server, database, etc
+        :type dsn: str
+        :param signature_path: custom path to signature key file
+        :type signature_path: str or None
+        :param batch_size: max number of messages sent to a host at once
+        :type batch_size: int
+        :param poll_interval: seconds between checks of empty outbox
+        :type poll_interval: float
+        :param backoff_min: delay in seconds before the first retry of
+            unreachable host, it is doubled after every failure
+        :type backoff_min: float
+        :param backoff_max: max delay in seconds between retries
+        :type backoff_max: float
+        """
+        super().__init__(dsn, signature_path, **kwargs)
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.backoff_min = backoff_min
+        self.backoff_max = backoff_max
+        # host_id -> number of failures in a row
+        self.failures = {}
+        # host_id -> time.monotonic() value after which host is retried
+        self.retry_at = {}
+
+    def queue(self, items):
+        """ Add messages to the outbox
+
+        :param items: tuples with unencrypted message, host's hex encoded
+            verify key and host's internal id, see
+            `EncSendClient.send_batch`
+        :type items: iterable of (str or bytes, str or list or None,
+            int or list or None)
+        :raises LookupError: some of hosts weren't found in db, nothing
+            is queued in this case
+        """
+        # Every receiver gets it's own copy of the message
+        items = [(message, host_key, host_id) for message, keys, ids in items
+                 for host_key, host_id in get_receivers(keys, ids)]
+        host_keys = {host_key for _, host_key, _ in items
+                     if host_key is not None}
+        host_ids = {host_id for _, host_key, host_id in items
+                    if host_key is None}
+        by_key, known_ids = {}, set()
+        for host_id, host_key, _, _ in self.get_hosts(host_keys, host_ids):
+            by_key[host_key] = host_id
+            known_ids.add(host_id)
+
+        now = int(time.time())
+        values = []
+        for message, host_key, host_id in items:
+            if host_key is not None:
+                found = by_key.get(host_key)
+            else:
+                found = host_id if host_id in known_ids else None
+            if found is None:
+                raise LookupError('host %s not found' % (host_key or host_id))
+            if isinstance(message, bytes):
+                message = message.decode()
+            message_uid = os.urandom(MESSAGE_ID_SIZE).hex()
+            values.append((message, found, now, message_uid))
+
+        self.db_cursor.executemany(INSERT['outbox'], values)
+        self.db_connection.commit()
+
+    def run(self):
+        """ Send queued messages until interrupted """
+        while True:
+            if not self.send_pending():
+                time.sleep(self.poll_interval)
+
+    def send_pending(self):
+        """ Send queued messages to hosts which aren't waiting for retry
+
+        :return: number of sent messages
+        :rtype: int
+        """
+        now = time.monotonic()
+        self.db_cursor.execute(SELECT['outbox-hosts'])
+        host_ids = [host_id for host_id, in self.db_cursor.fetchall()
+                    if self.retry_at.get(host_id, 0) <= now]
+        sent = 0
+        for host_id, host_key, host, port in self.get_hosts((), host_ids):
+            sent += self.send_host(host_id, host_key, host, port)
+        return sent
+
+    def send_host(self, host_id, host_key, host, port):
+        """ Send queued messages to the host batch by batch
+
+        :return: number of sent messages
+        :rtype: int
+        """
+        sent = 0
+        while True:
+            self.db_cursor.execute(SELECT['outbox-host'],
+                                   (host_id, self.batch_size))
+            rows = self.db_cursor.fetchall()
+            if not rows:
+                break
+
+            # Messages queued before message ids get a new id every time
+            encrypted = [self.encrypt_message(
+                message.encode(), host_key.encode(),
+                bytes.fromhex(message_uid) if message_uid else None
+            ) for _, message, message_uid in rows]
+            error = None
+            try:
+                statuses = self.send_sealed(host, port, host_key, encrypted)
+            except OSError as e:
+                statuses = getattr(e, 'statuses', None) or []
+                error = e
+
+            done = []
+            for (outbox_id, _, _), status in zip(rows, statuses):
+                # Sender's clock is off, message may be accepted later
+                if status in (None, NACK_ERROR, NACK_STALE):
+                    continue
+                # Message was saved, but it's ack was lost
+                if status not in (ACK_ACCEPTED, NACK_REPLAY):
+                    logger.warning('message %d was rejected by host %d: %s',
+                                   outbox_id, host_id,
+                                   ACK_STATUSES.get(status, status))
+                done.append(outbox_id)
+            self.delete(done)
+            sent += len(done)
+
+            if len(done) < len(rows):
+                self.backoff(host_id)
+                logger.warning('host %d (%s:%s) failed, retry in %.1f '
+                               'seconds: %s', host_id, host, port,
+                               self.retry_at[host_id] - time.monotonic(),
+                               error or 'message was not saved')
+                break
+            self.failures.pop(host_id, None)
+            self.retry_at.pop(host_id, None)
+            if len(rows) < self.batch_size:
+                break
+        return sent
+
+    def backoff(self, host_id):
+        """ Schedule retry of unreachable host, delay is doubled after
+        every failure, random jitter spreads retries of many hosts
+        """
+        failures = self.failures.get(host_id, 0) + 1
+        self.failures[host_id] = failures
+        delay = min(self.backoff_min * 2 ** (failures - 1), self.backoff_max)
+        delay *= random.uniform(0.5, 1)
+        self.retry_at[host_id] = time.monotonic() + delay
+
+    def delete(self, outbox_ids):
+        for i in range(0, len(outbox_ids), MAX_QUERY_PARAMS):
+            ids = outbox_ids[i:i + MAX_QUERY_PARAMS]
+            query = DELETE['outbox-many'].format(ids=in_params(len(ids)))
+            self.db_cursor.execute(query, ids)
+        self.db_connection.commit()
+
+
+def queue_batch(items, dsn=DSN, path=None):
+    """ Add messages to the outbox, see `Outbox.queue`
+
+    :param items: tuples with unencrypted message, host's hex encoded
+        verify key and host's internal id
+    :type items: iterable of (str or bytes, str or None, int or None)
+    :param dsn: Data Source Name, information about database driver,
+        server, database, etc
+    :type dsn: str
+    :param path: path to signature key file, if path is `None`
+        default path is used
+    :type path: str or None
+    """
+    outbox = Outbox(dsn, path)
+    try:
+        outbox.queue(items)
+    finally:
+        outbox.close()
+
+
+def run_outbox(dsn=DSN, path=None):
+    """ Send queued messages until interrupted, signing key file is
+    read again on SIGHUP
+
+    :param dsn: Data Source Name, information about database driver,
+        server, database, etc
+    :type dsn: str
+    :param path: path to signature key file, if path is `None`
+        default path is used
+    :type path: str or None
+    """
+    outbox = Outbox(dsn, path)
+    handler = None
+    # Signal handlers can be set only in the main thread
+    if threading.current_thread() is threading.main_thread():
+        handler = signal.signal(signal.SIGHUP,
+                                lambda signum, frame: outbox.reload_keys())
+    try:
+        outbox.run()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if handler is not None:
+            signal.signal(signal.SIGHUP, handler)
+        outbox.close()
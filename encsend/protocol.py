@@ -0,0 +1,479 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import hashlib
+import os
+import struct
+import time
+from collections import namedtuple
+
+# Every frame starts with a header: magic byte, protocol version,
+# frame type and payload length
+MAGIC = 0xE5
+HEADER = struct.Struct('!BBBI')
+# Version 1 - payload is hex encoded sealed json, version 2 - payload
+# is sealed binary envelope, version 3 - payload is random content key
+# sealed to the receiver followed by binary envelope encrypted with the
+# key, so a message to many receivers is encrypted once
+LEGACY_VERSION = 1
+VERSION = 2
+KEYED_VERSION = 3
+VERSIONS = (LEGACY_VERSION, VERSION, KEYED_VERSION)
+# Sealed content key: ephemeral public key, MAC and 32 bytes key
+CONTENT_KEY_SIZE = 32
+SEALED_KEY_SIZE = 32 + 16 + CONTENT_KEY_SIZE
+
+# Binary envelope: version, flags, sender's raw verify key, signature of
+# version, flags and body, followed by body. Lower bits of flags are
+# body's compression, see `encsend.compression`
+ENVELOPE_VERSION = 1
+ENVELOPE_HEADER = struct.Struct('!BB32s64s')
+ENVELOPE_SIGNED_HEADER = struct.Struct('!BB')
+# Body starts with nonce: send time in milliseconds and random message
+# id, receivers drop messages with ids seen recently, the rest of body
+# may be compressed
+FLAG_NONCE = 0x04
+NONCE = struct.Struct('!Q16s')
+MESSAGE_ID_SIZE = 16
+
+Envelope = namedtuple('Envelope', 'version flags sender signature body')
+
+# Frame types
+FRAME_MESSAGE = 1
+# Sealed envelope with stream's key, secretstream header, file size and
+# name, followed by secretstream encrypted chunks, the last one is
+# tagged as final
+FRAME_STREAM_START = 2
+FRAME_STREAM_CHUNK = 3
+STREAM_START = struct.Struct('!32s24sQ')
+# Message with sequence number, the receiver answers with ack frame
+# after the message is saved or rejected. Sender may send many messages
+# without waiting for acks, acks are matched by sequence number
+FRAME_MESSAGE_ACK = 4
+SEQ = struct.Struct('!Q')
+# Ack: sequence number, status, sha256 of the sealed message and
+# receiver's signature of `ACK_CONTEXT`, sequence number, status and
+# digest. The context keeps ack signatures apart from envelope ones
+FRAME_ACK = 5
+ACK = struct.Struct('!QB32s64s')
+ACK_SIGNED = struct.Struct('!QB32s')
+ACK_CONTEXT = b'encsend ack\x00'
+# Stream start with ack request, payload is packed like message with ack
+# request. The receiver answers with ack frame after the file is saved or
+# rejected, digest is of the sealed stream start
+FRAME_STREAM_START_ACK = 6
+
+Ack = namedtuple('Ack', 'seq status digest signature')
+
+# Discovery announcement, sent over udp broadcast: magic byte, version,
+# timestamp in milliseconds, ttl in seconds, sender's raw verify key and
+# port of sender's server, followed by host (empty - receiver uses
+# datagram's source address) and sender's signature of
+# `ANNOUNCE_CONTEXT` and everything before the signature
+ANNOUNCE_VERSION = 1
+ANNOUNCE = struct.Struct('!BBQH32sH')
+ANNOUNCE_CONTEXT = b'encsend announce\x00'
+SIGNATURE_SIZE = 64
+
+Announce = namedtuple('Announce', 'timestamp ttl sender port host signature')
+
+# Ack statuses, NACK_ERROR is temporary, the message may be sent again
+ACK_ACCEPTED = 0
+NACK_CRYPTO = 1
+NACK_MALFORMED = 2
+NACK_UNKNOWN_HOST = 3
+NACK_BAD_SIGNATURE = 4
+NACK_ERROR = 5
+NACK_UNSUPPORTED = 6
+NACK_TOO_LARGE = 7
+NACK_STALE = 8
+NACK_REPLAY = 9
+ACK_STATUSES = {
+    ACK_ACCEPTED: 'accepted',
+    NACK_CRYPTO: 'crypto',
+    NACK_MALFORMED: 'malformed',
+    NACK_UNKNOWN_HOST: 'unknown_host',
+    NACK_BAD_SIGNATURE: 'bad_signature',
+    NACK_ERROR: 'error',
+    NACK_UNSUPPORTED: 'unsupported',
+    NACK_TOO_LARGE: 'too_large',
+    NACK_STALE: 'stale',
+    NACK_REPLAY: 'replay'
+}
+
+
+class ProtocolError(Exception):
+    """ Incoming data doesn't follow EncSend wire protocol """
+
+
+class FrameTooLarge(ProtocolError):
+    """ Frame's payload is larger than allowed """
+
+
+def pack_frame(payload, frame_type=FRAME_MESSAGE, version=VERSION):
+    """ Prepend frame header to payload
+
+    :param payload: frame payload
+    :type payload: bytes
+    :param frame_type: frame type
+    :type frame_type: int
+    :param version: protocol version
+    :type version: int
+    :return: frame ready to be sent
+    :rtype: bytes
+    """
+    return HEADER.pack(MAGIC, version, frame_type, len(payload)) + payload
+
+
+def unpack_header(header, max_size):
+    """ Parse and check frame header
+
+    :param header: raw frame header
+    :type header: bytes
+    :param max_size: max allowed payload length
+    :type max_size: int
+    :return: tuple with protocol version, frame type and payload length
+    :rtype: (int, int, int)
+    :raises ProtocolError: magic byte or version is unknown
+    :raises FrameTooLarge: payload is too large
+    """
+    magic, version, frame_type, length = HEADER.unpack(header)
+    if magic != MAGIC:
+        raise ProtocolError('invalid magic byte')
+    if version not in VERSIONS:
+        raise ProtocolError('unsupported protocol version %d' % version)
+    if length > max_size:
+        raise FrameTooLarge('payload is too large: %d bytes' % length)
+    return version, frame_type, length
+
+
+async def read_frame(reader, max_size):
+    """ Read a single frame from the stream
+
+    :param reader: stream reader
+    :type reader: asyncio.StreamReader
+    :param max_size: max allowed payload length
+    :type max_size: int
+    :return: tuple with protocol version, frame type and payload or None
+        if the stream was closed between frames
+    :rtype: (int, int, bytes) or None
+    :raises ProtocolError: invalid header or truncated frame
+    """
+    try:
+        header = await reader.readexactly(HEADER.size)
+    except asyncio.IncompleteReadError as e:
+        if not e.partial:
+            return
+        raise ProtocolError('truncated frame header')
+
+    version, frame_type, length = unpack_header(header, max_size)
+    try:
+        payload = await reader.readexactly(length)
+    except asyncio.IncompleteReadError:
+        raise ProtocolError('truncated frame payload')
+    return version, frame_type, payload
+
+
+def read_frame_file(file, max_size):
+    """ Read a single frame from blocking file-like object, see
+    `read_frame`
+
+    :param file: binary file, for example `socket.makefile('rb')`
+    """
+    header = file.read(HEADER.size)
+    if not header:
+        return
+    if len(header) < HEADER.size:
+        raise ProtocolError('truncated frame header')
+
+    version, frame_type, length = unpack_header(header, max_size)
+    payload = file.read(length)
+    if len(payload) < length:
+        raise ProtocolError('truncated frame payload')
+    return version, frame_type, payload
+
+
+def pack_envelope(signing_key, verify_key, body, flags=0):
+    """ Sign message and pack it into binary envelope
+
+    :param signing_key: sender's signing key
+    :type signing_key: nacl.signing.SigningKey
+    :param verify_key: sender's raw verify key
+    :type verify_key: bytes
+    :param body: message
+    :type body: bytes
+    :param flags: envelope flags
+    :type flags: int
+    :return: envelope ready to be sealed
+    :rtype: bytes
+    """
+    signed_header = ENVELOPE_SIGNED_HEADER.pack(ENVELOPE_VERSION, flags)
+    signature = signing_key.sign(signed_header + body).signature
+    return ENVELOPE_HEADER.pack(ENVELOPE_VERSION, flags, verify_key,
+                                signature) + body
+
+
+def unpack_envelope(data):
+    """ Parse binary envelope, signature isn't checked
+
+    :param data: unsealed envelope
+    :type data: bytes
+    :return: parsed envelope
+    :rtype: Envelope
+    :raises ProtocolError: envelope is too short or has unknown version
+    """
+    if len(data) < ENVELOPE_HEADER.size:
+        raise ProtocolError('envelope is too short')
+    version, flags, sender, signature = ENVELOPE_HEADER.unpack_from(data)
+    if version != ENVELOPE_VERSION:
+        raise ProtocolError('unsupported envelope version %d' % version)
+    return Envelope(version, flags, sender, signature,
+                    data[ENVELOPE_HEADER.size:])
+
+
+def envelope_signed_data(envelope):
+    """ Get part of the envelope covered by signature
+
+    :param envelope: parsed envelope
+    :type envelope: Envelope
+    :rtype: bytes
+    """
+    return ENVELOPE_SIGNED_HEADER.pack(envelope.version,
+                                       envelope.flags) + envelope.body
+
+
+def pack_nonce(message_id=None, timestamp=None):
+    """ Pack nonce prepended to body of envelope with `FLAG_NONCE`
+
+    :param message_id: message id, the same id is used when the message
+        is sent again, if None - random id
+    :type message_id: bytes or None
+    :param timestamp: send time in milliseconds, if None - current time
+    :type timestamp: int or None
+    :rtype: bytes
+    """
+    if message_id is None:
+        message_id = os.urandom(MESSAGE_ID_SIZE)
+    if timestamp is None:
+        timestamp = int(time.time() * 1000)
+    return NONCE.pack(timestamp, message_id)
+
+
+def unpack_nonce(envelope):
+    """ Split envelope's body into nonce and the rest of body
+
+    :param envelope: parsed envelope
+    :type envelope: Envelope
+    :return: tuple with send time in milliseconds, message id and the
+        rest of body, time and id are None if the envelope has no nonce
+    :rtype: (int or None, bytes or None, bytes)
+    :raises ProtocolError: body is too short
+    """
+    if not envelope.flags & FLAG_NONCE:
+        return None, None, envelope.body
+    if len(envelope.body) < NONCE.size:
+        raise ProtocolError('nonce is too short')
+    timestamp, message_id = NONCE.unpack_from(envelope.body)
+    return timestamp, message_id, envelope.body[NONCE.size:]
+
+
+def pack_keyed(sealed_key, encrypted):
+    """ Pack payload of version 3 frame
+
+    :param sealed_key: content key sealed to the receiver
+    :type sealed_key: bytes
+    :param encrypted: envelope encrypted with the content key, the same
+        for all receivers
+    :type encrypted: bytes
+    :rtype: bytes
+    """
+    return sealed_key + encrypted
+
+
+def unpack_keyed(payload):
+    """ Parse payload of version 3 frame
+
+    :return: tuple with sealed content key and encrypted envelope
+    :rtype: (bytes, bytes)
+    :raises ProtocolError: payload is too short
+    """
+    if len(payload) < SEALED_KEY_SIZE:
+        raise ProtocolError('keyed payload is too short')
+    return payload[:SEALED_KEY_SIZE], payload[SEALED_KEY_SIZE:]
+
+
+def pack_stream_start(key, header, size, name):
+    """ Pack body of stream start envelope
+
+    :param key: stream's secretstream key
+    :type key: bytes
+    :param header: secretstream header
+    :type header: bytes
+    :param size: file size
+    :type size: int
+    :param name: file name
+    :type name: str
+    :rtype: bytes
+    """
+    return STREAM_START.pack(key, header, size) + name.encode()
+
+
+def unpack_stream_start(body):
+    """ Parse body of stream start envelope
+
+    :param body: envelope's body
+    :type body: bytes
+    :return: tuple with stream's key, secretstream header, file size and
+        file name
+    :rtype: (bytes, bytes, int, str)
+    :raises ProtocolError: body is too short or name isn't valid utf-8
+    """
+    if len(body) < STREAM_START.size:
+        raise ProtocolError('stream start is too short')
+    key, header, size = STREAM_START.unpack_from(body)
+    try:
+        name = body[STREAM_START.size:].decode()
+    except UnicodeDecodeError:
+        raise ProtocolError('invalid file name')
+    return key, header, size, name
+
+
+def pack_message_ack(seq, sealed):
+    """ Pack payload of message frame with ack request
+
+    :param seq: sequence number
+    :type seq: int
+    :param sealed: sealed envelope
+    :type sealed: bytes
+    :rtype: bytes
+    """
+    return SEQ.pack(seq) + sealed
+
+
+def unpack_message_ack(payload):
+    """ Parse payload of message frame with ack request
+
+    :return: tuple with sequence number and sealed envelope
+    :rtype: (int, bytes)
+    :raises ProtocolError: payload is too short
+    """
+    if len(payload) < SEQ.size:
+        raise ProtocolError('message ack frame is too short')
+    return SEQ.unpack_from(payload)[0], payload[SEQ.size:]
+
+
+def message_digest(sealed):
+    """ Get digest of sealed message which ack refers to
+
+    :param sealed: sealed envelope
+    :type sealed: bytes
+    :rtype: bytes
+    """
+    return hashlib.sha256(sealed).digest()
+
+
+def pack_ack(signing_key, seq, status, digest):
+    """ Sign and pack ack
+
+    :param signing_key: receiver's signing key
+    :type signing_key: nacl.signing.SigningKey
+    :param seq: message's sequence number
+    :type seq: int
+    :param status: one of ack statuses
+    :type status: int
+    :param digest: `message_digest` of the message
+    :type digest: bytes
+    :return: ack frame's payload
+    :rtype: bytes
+    """
+    signed = ACK_SIGNED.pack(seq, status, digest)
+    signature = signing_key.sign(ACK_CONTEXT + signed).signature
+    return signed + signature
+
+
+def unpack_ack(payload):
+    """ Parse ack, signature isn't checked
+
+    :param payload: ack frame's payload
+    :type payload: bytes
+    :rtype: Ack
+    :raises ProtocolError: ack has invalid length
+    """
+    if len(payload) != ACK.size:
+        raise ProtocolError('invalid ack length')
+    return Ack(*ACK.unpack(payload))
+
+
+def ack_signed_data(ack):
+    """ Get data covered by ack's signature
+
+    :param ack: parsed ack
+    :type ack: Ack
+    :rtype: bytes
+    """
+    return ACK_CONTEXT + ACK_SIGNED.pack(ack.seq, ack.status, ack.digest)
+
+
+def pack_announce(signing_key, verify_key, host, port, ttl,
+                  timestamp=None):
+    """ Sign and pack discovery announcement
+
+    :param signing_key: sender's signing key
+    :type signing_key: nacl.signing.SigningKey
+    :param verify_key: sender's raw verify key
+    :type verify_key: bytes
+    :param host: host of sender's server, empty string - receivers use
+        datagram's source address
+    :type host: str
+    :param port: port of sender's server
+    :type port: int
+    :param ttl: seconds receivers keep the sender in their peer tables
+    :type ttl: int
+    :param timestamp: time in milliseconds, if None - current time
+    :type timestamp: int or None
+    :return: datagram ready to be sent
+    :rtype: bytes
+    """
+    if timestamp is None:
+        timestamp = int(time.time() * 1000)
+    announce = Announce(timestamp, ttl, verify_key, port, host, None)
+    signed = announce_signed_data(announce)
+    return signed[len(ANNOUNCE_CONTEXT):] + \
+        signing_key.sign(signed).signature
+
+
+def unpack_announce(data):
+    """ Parse discovery announcement, signature isn't checked
+
+    :param data: received datagram
+    :type data: bytes
+    :rtype: Announce
+    :raises ProtocolError: datagram isn't a valid announcement
+    """
+    if len(data) < ANNOUNCE.size + SIGNATURE_SIZE:
+        raise ProtocolError('announcement is too short')
+    magic, version, timestamp, ttl, sender, port = \
+        ANNOUNCE.unpack_from(data)
+    if magic != MAGIC:
+        raise ProtocolError('invalid magic byte')
+    if version != ANNOUNCE_VERSION:
+        raise ProtocolError('unsupported announcement version %d' % version)
+    try:
+        host = data[ANNOUNCE.size:-SIGNATURE_SIZE].decode()
+    except UnicodeDecodeError:
+        raise ProtocolError('invalid host')
+    return Announce(timestamp, ttl, sender, port, host,
+                    data[-SIGNATURE_SIZE:])
+
+
+def announce_signed_data(announce):
+    """ Get data covered by announcement's signature
+
+    :param announce: parsed announcement
+    :type announce: Announce
+    :rtype: bytes
+    """
+    return ANNOUNCE_CONTEXT + ANNOUNCE.pack(
+        MAGIC, ANNOUNCE_VERSION, announce.timestamp, announce.ttl,
+        announce.sender, announce.port
+    ) + announce.host.encode()
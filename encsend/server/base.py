@@ -1,8 +1,7 @@
 # -*- coding: utf-8 -*-
 
-import aioodbc
-
-from ..utils import get_signing_key
+from ..storage import create_pool
+from ..keystore import get_keys, reload_keys
 
 
 class ServerBase:
@@ -28,8 +27,20 @@ class ServerBase:
         self.init_keys()
 
     async def init_db(self):
-        self.db_pool = await aioodbc.create_pool(dsn=self.dsn, loop=self.loop)
+        self.db_pool = await create_pool(self.dsn)
 
     def init_keys(self):
-        self.signing_key = get_signing_key(self.signature_path)
-        self.private_key = self.signing_key.to_curve25519_private_key()
+        """ Take keys from the process' key store, call it again after
+        `encsend.keystore.reload_keys` to use rotated keys
+        """
+        keys = get_keys(self.signature_path)
+        self.signing_key = keys.signing_key
+        self.verify_key_bytes = keys.verify_key_bytes
+        self.private_key = keys.private_key
+
+    def reload_keys(self):
+        """ Read signing key file again, e.g. on SIGHUP, current keys
+        are kept if the file can't be read
+        """
+        if reload_keys(self.signature_path) is not None:
+            self.init_keys()
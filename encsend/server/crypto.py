@@ -0,0 +1,224 @@
+# -*- coding: utf-8 -*-
+
+import json
+from binascii import hexlify
+
+from nacl.encoding import HexEncoder
+from nacl.exceptions import CryptoError
+from nacl.public import SealedBox
+from nacl.secret import SecretBox
+
+from ..compression import (COMPRESSION_MASK, CompressionError,
+                           DecompressedTooLarge, UnsupportedCompression,
+                           decompress)
+from ..protocol import (FLAG_NONCE, ProtocolError, envelope_signed_data,
+                        unpack_envelope, unpack_keyed, unpack_nonce,
+                        unpack_stream_start)
+
+# Functions don't touch db and event loop, so they may be run in thread
+# or process pool
+
+# Reasons of rejecting incoming data
+REJECT_CRYPTO = 'crypto'
+REJECT_MALFORMED = 'malformed'
+REJECT_UNKNOWN_HOST = 'unknown_host'
+REJECT_BAD_SIGNATURE = 'bad_signature'
+REJECT_UNSUPPORTED = 'unsupported'
+REJECT_TOO_LARGE = 'too_large'
+REJECT_STALE = 'stale'
+REJECT_REPLAY = 'replay'
+REJECT_BUSY = 'busy'
+
+
+class Rejected(Exception):
+    """ Incoming data was rejected, the first argument is a reason """
+    @property
+    def reason(self):
+        return self.args[0]
+
+
+def unseal_message(private_key, data):
+    """ Decrypt incoming message and parse it
+
+    :param private_key: this host's curve25519 private key
+    :type private_key: nacl.public.PrivateKey
+    :param data: incoming data
+    :type data: bytes
+    :return: tuple with sender's hex encoded verify key and hex encoded
+        signed message
+    :rtype: (str, str)
+    :raises Rejected: message can't be decrypted or has invalid structure
+    """
+    unsealed_box = SealedBox(private_key)
+    try:
+        json_data = unsealed_box.decrypt(data, encoder=HexEncoder)
+    except (CryptoError, ValueError):
+        raise Rejected(REJECT_CRYPTO)
+    try:
+        dct = json.loads(json_data.decode())
+    except ValueError:
+        raise Rejected(REJECT_MALFORMED)
+
+    # a dictionary has invalid structure
+    if not isinstance(dct, dict) or dct.keys() != {'host', 'message'}:
+        raise Rejected(REJECT_MALFORMED)
+    if not isinstance(dct['host'], str) or \
+            not isinstance(dct['message'], str):
+        raise Rejected(REJECT_MALFORMED)
+
+    return dct['host'], dct['message']
+
+
+def verify_message(verify_key, signed):
+    """ Check message's signature
+
+    :param verify_key: sender's verify key
+    :type verify_key: nacl.signing.VerifyKey
+    :param signed: hex encoded signed message
+    :type signed: str
+    :return: message
+    :rtype: str
+    :raises Rejected: signature is invalid or message can't be decoded
+    """
+    try:
+        message = verify_key.verify(signed.encode(), encoder=HexEncoder)
+    # BadSignatureError is a subclass of CryptoError, ValueError is raised
+    # for invalid hex
+    except (CryptoError, ValueError):
+        raise Rejected(REJECT_BAD_SIGNATURE)
+    try:
+        return message.decode()
+    except UnicodeDecodeError:
+        raise Rejected(REJECT_MALFORMED)
+
+
+def unseal_envelope(private_key, data):
+    """ Decrypt incoming binary envelope and parse it
+
+    :param private_key: this host's curve25519 private key
+    :type private_key: nacl.public.PrivateKey
+    :param data: incoming data
+    :type data: bytes
+    :return: tuple with sender's hex encoded verify key and parsed
+        envelope
+    :rtype: (str, encsend.protocol.Envelope)
+    :raises Rejected: envelope can't be decrypted or has invalid structure
+    """
+    unsealed_box = SealedBox(private_key)
+    try:
+        return parse_envelope(unsealed_box.decrypt(data))
+    except CryptoError:
+        raise Rejected(REJECT_CRYPTO)
+
+
+def unseal_keyed_envelope(private_key, data):
+    """ Decrypt content key sealed to this host, decrypt incoming
+    binary envelope with it and parse the envelope
+
+    :param private_key: this host's curve25519 private key
+    :type private_key: nacl.public.PrivateKey
+    :param data: incoming data
+    :type data: bytes
+    :return: tuple with sender's hex encoded verify key and parsed
+        envelope
+    :rtype: (str, encsend.protocol.Envelope)
+    :raises Rejected: envelope can't be decrypted or has invalid structure
+    """
+    try:
+        sealed_key, encrypted = unpack_keyed(data)
+    except ProtocolError:
+        raise Rejected(REJECT_MALFORMED)
+    unsealed_box = SealedBox(private_key)
+    try:
+        key = unsealed_box.decrypt(sealed_key)
+        envelope = SecretBox(key).decrypt(encrypted)
+    # Content key or ciphertext of invalid size is a CryptoError too
+    except CryptoError:
+        raise Rejected(REJECT_CRYPTO)
+    return parse_envelope(envelope)
+
+
+def parse_envelope(data):
+    """ Parse decrypted binary envelope
+
+    :param data: decrypted envelope
+    :type data: bytes
+    :return: tuple with sender's hex encoded verify key and parsed
+        envelope
+    :rtype: (str, encsend.protocol.Envelope)
+    :raises Rejected: envelope has invalid structure
+    """
+    try:
+        envelope = unpack_envelope(data)
+    except ProtocolError:
+        raise Rejected(REJECT_MALFORMED)
+
+    # Only compression and nonce flags are defined
+    if envelope.flags & ~(COMPRESSION_MASK | FLAG_NONCE):
+        raise Rejected(REJECT_MALFORMED)
+
+    return hexlify(envelope.sender).decode(), envelope
+
+
+def verify_envelope(verify_key, envelope, max_size):
+    """ Check envelope's signature, decompress the body
+
+    Signature covers compressed body, so only bodies from known senders
+    are decompressed
+
+    :param verify_key: sender's verify key
+    :type verify_key: nacl.signing.VerifyKey
+    :param envelope: parsed envelope
+    :type envelope: encsend.protocol.Envelope
+    :param max_size: max allowed size of decompressed body
+    :type max_size: int
+    :return: message
+    :rtype: str
+    :raises Rejected: signature is invalid or message can't be
+        decompressed or decoded
+    """
+    try:
+        verify_key.verify(envelope_signed_data(envelope), envelope.signature)
+    except CryptoError:
+        raise Rejected(REJECT_BAD_SIGNATURE)
+    try:
+        _, _, body = unpack_nonce(envelope)
+        body = decompress(envelope.flags, body, max_size)
+    except ProtocolError:
+        raise Rejected(REJECT_MALFORMED)
+    except UnsupportedCompression:
+        raise Rejected(REJECT_UNSUPPORTED)
+    except DecompressedTooLarge:
+        raise Rejected(REJECT_TOO_LARGE)
+    except CompressionError:
+        raise Rejected(REJECT_MALFORMED)
+    try:
+        return body.decode()
+    except UnicodeDecodeError:
+        raise Rejected(REJECT_MALFORMED)
+
+
+def verify_stream_start(verify_key, envelope):
+    """ Check stream start envelope's signature and parse it
+
+    :param verify_key: sender's verify key
+    :type verify_key: nacl.signing.VerifyKey
+    :param envelope: parsed envelope
+    :type envelope: encsend.protocol.Envelope
+    :return: tuple with stream's key, secretstream header, file size and
+        file name
+    :rtype: (bytes, bytes, int, str)
+    :raises Rejected: signature is invalid or envelope's body is malformed
+    """
+    try:
+        verify_key.verify(envelope_signed_data(envelope), envelope.signature)
+    except CryptoError:
+        raise Rejected(REJECT_BAD_SIGNATURE)
+    # Stream start isn't compressed, it may carry nonce only
+    if envelope.flags & ~FLAG_NONCE:
+        raise Rejected(REJECT_MALFORMED)
+    try:
+        _, _, body = unpack_nonce(envelope)
+        return unpack_stream_start(body)
+    except ProtocolError:
+        raise Rejected(REJECT_MALFORMED)
@@ -1,28 +1,126 @@
 # -*- coding: utf-8 -*-
 
 import asyncio
+import logging
+import math
+import random
+import signal
 import socket
-from datetime import datetime
+import time
+from collections import namedtuple
+
+from nacl.exceptions import CryptoError
+from nacl.signing import VerifyKey
 
 from .base import ServerBase
+from ..protocol import (ProtocolError, announce_signed_data, pack_announce,
+                        unpack_announce)
+from ..sql import INSERT, UPDATE
 
 try:
     from .. import conf
 except ImportError:
     from .. import conf_default as conf
 finally:
-    DISCOVERY_ADDR, DSN = conf.DISCOVERY_ADDR, conf.DSN
+    DISCOVERY_ADDR, DSN, PORT = conf.DISCOVERY_ADDR, conf.DSN, conf.PORT
     DISCOVERY_HOST, DISCOVERY_PORT = conf.DISCOVERY_HOST, conf.DISCOVERY_PORT
+    ANNOUNCE_HOST = conf.DISCOVERY_ANNOUNCE_HOST
+    INTERVAL_MIN, INTERVAL_MAX = conf.DISCOVERY_INTERVAL_MIN, \
+        conf.DISCOVERY_INTERVAL_MAX
+    RATE, FLUSH_INTERVAL = conf.DISCOVERY_RATE, conf.DISCOVERY_FLUSH_INTERVAL
+    ADD_HOSTS, MAX_PEERS = conf.DISCOVERY_ADD_HOSTS, conf.DISCOVERY_MAX_PEERS
+
+logger = logging.getLogger(__name__)
+
+# Number of announcements a peer may miss before it's forgotten
+MISSED_ANNOUNCEMENTS = 3
+# Announcement intervals are randomized by up to this fraction, so peers
+# started together don't announce together
+JITTER = 0.5
+MAX_TTL = 0xFFFF
+
+Peer = namedtuple('Peer', 'host port timestamp expires')
+
+
+class PeerTable:
+    """ Peers heard recently, every peer expires after ttl from it's last
+    announcement, new peers are ignored while the table is full
+    """
+    def __init__(self, max_size=MAX_PEERS):
+        """
+        :param max_size: max number of peers
+        :type max_size: int
+        """
+        self.max_size = max_size
+        # hex encoded verify key -> Peer
+        self.peers = {}
+
+    def __len__(self):
+        return len(self.peers)
+
+    def __iter__(self):
+        return iter(self.peers.items())
+
+    def update(self, key, host, port, timestamp, expires):
+        """ Add or refresh a peer
+
+        :param key: peer's hex encoded verify key
+        :type key: str
+        :param timestamp: announcement's timestamp in milliseconds
+        :type timestamp: int
+        :param expires: time after which the peer is forgotten
+        :type expires: float
+        :return: True if the peer is new or it's address has changed,
+            False if it's refreshed, None if announcement is older than
+            the last one from the peer, e.g. it's replayed, or the peer is
+            new and the table is full
+        :rtype: bool or None
+        """
+        peer = self.peers.get(key)
+        if peer is None and len(self.peers) >= self.max_size:
+            return
+        if peer is not None and timestamp <= peer.timestamp:
+            return
+        self.peers[key] = Peer(host, port, timestamp, expires)
+        return peer is None or (peer.host, peer.port) != (host, port)
+
+    def expire(self, now):
+        """ Forget peers which haven't announced themselves in time
+
+        :return: number of forgotten peers
+        :rtype: int
+        """
+        expired = [key for key, peer in self.peers.items()
+                   if peer.expires <= now]
+        for key in expired:
+            del self.peers[key]
+        return len(expired)
 
 
 class DiscoveryServer(ServerBase):
-    """ EncSend Discovery server """
-    def __init__(self, loop, host, port, dsn, signature_path, broadcast_addr):
+    """ EncSend Discovery server
+
+    Server periodically broadcasts signed announcement with it's verify
+    key and address of EncSend server. Announcements from other peers are
+    checked and kept in the peer table, new and moved peers are written
+    to hosts_t in batches, so they can send messages to each other
+    without `host-add`. Source address of an announcement isn't signed,
+    so it's used only for hosts which aren't in hosts_t yet, addresses of
+    known hosts are changed only by announcements with a signed host.
+
+    Announcement interval grows with number of known peers, so broadcast
+    traffic of the whole LAN stays about `rate` announcements per second.
+    """
+    def __init__(self, loop, host, port, dsn, signature_path, broadcast_addr,
+                 announce_host=ANNOUNCE_HOST, announce_port=PORT,
+                 interval_min=INTERVAL_MIN, interval_max=INTERVAL_MAX,
+                 rate=RATE, flush_interval=FLUSH_INTERVAL,
+                 add_hosts=ADD_HOSTS, max_peers=MAX_PEERS):
         """
         :param loop: asyncio event loop
-        :param host: tcp server host
+        :param host: udp server host
         :type host: str
-        :param port: tcp server port
+        :param port: udp server port, announcements are sent to this port
         :type port: int
         :param dsn: Data Source Name, information about database driver,
             server, database, etc
@@ -32,34 +130,174 @@ class DiscoveryServer(ServerBase):
         :param broadcast_addr: address where broadcast message
             should be sent
         :type broadcast_addr: str
+        :param announce_host: host of EncSend server announced to peers,
+            if None - peers use source address of announcements
+        :type announce_host: str or None
+        :param announce_port: port of EncSend server announced to peers
+        :type announce_port: int
+        :param interval_min: min seconds between announcements
+        :type interval_min: float
+        :param interval_max: max seconds between announcements
+        :type interval_max: float
+        :param rate: target number of announcements per second sent by
+            all peers together
+        :type rate: float
+        :param flush_interval: seconds between writes of new and moved
+            peers to db
+        :type flush_interval: float
+        :param add_hosts: add new peers to db, if False - only addresses
+            of known hosts are updated
+        :type add_hosts: bool
+        :param max_peers: max number of peers kept in memory
+        :type max_peers: int
         """
         super().__init__(loop, host, port, dsn, signature_path)
         self.broadcast_addr = broadcast_addr
+        self.announce_host = announce_host or ''
+        self.announce_port = announce_port
+        self.interval_min = interval_min
+        self.interval_max = interval_max
+        self.rate = rate
+        self.flush_interval = flush_interval
+        self.add_hosts = add_hosts
+        self.peers = PeerTable(max_peers)
+        # hex encoded verify key -> (host, port, True if host is signed),
+        # peers waiting to be written to db
+        self.pending = {}
+        self.transport = None
+        self.announce_handle = None
+        self.flush_task = None
 
     def connection_made(self, transport):
         self.transport = transport
         sock = self.transport.get_extra_info('socket')
         sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
-        self.broadcast()
+        self.flush_task = self.loop.create_task(self.run_flush())
+        self.announce()
 
     def datagram_received(self, data, addr):
-        message = data.decode()
-        print('Received %r from %s' % (message, addr))
-#        print('Send %r to %s' % (message, addr))
-#        self.transport.sendto(data, addr)
+        try:
+            announce = unpack_announce(data)
+        except ProtocolError:
+            return
+        # Own announcement
+        if announce.sender == self.verify_key_bytes:
+            return
+        # Announcement is outdated or it's clock is too far ahead
+        now = time.time()
+        if abs(now - announce.timestamp / 1000) > announce.ttl:
+            return
+        try:
+            VerifyKey(announce.sender).verify(announce_signed_data(announce),
+                                              announce.signature)
+        except (CryptoError, ValueError):
+            return
+
+        key = announce.sender.hex()
+        host = announce.host or addr[0]
+        changed = self.peers.update(key, host, announce.port,
+                                    announce.timestamp, now + announce.ttl)
+        if changed:
+            self.pending[key] = (host, announce.port, bool(announce.host))
+
+    def error_received(self, exc):
+        logger.warning('discovery socket error: %s', exc)
 
     def connection_lost(self, exc):
-        pass
+        if self.announce_handle is not None:
+            self.announce_handle.cancel()
+        if self.flush_task is not None:
+            self.flush_task.cancel()
+
+    def get_interval(self):
+        """ Get seconds between announcements for current number of
+        peers, this peer included
+        """
+        interval = (len(self.peers) + 1) / self.rate
+        return min(max(interval, self.interval_min), self.interval_max)
+
+    def announce(self):
+        """ Broadcast signed announcement and schedule the next one """
+        self.peers.expire(time.time())
+        interval = self.get_interval()
+        # Peers may pick a longer interval before the next announcement
+        # as more peers appear, ttl covers the longest jittered one
+        ttl = math.ceil(interval * (1 + JITTER) * MISSED_ANNOUNCEMENTS)
+        data = pack_announce(self.signing_key, self.verify_key_bytes,
+                             self.announce_host, self.announce_port,
+                             min(ttl, MAX_TTL))
+        self.transport.sendto(data, (self.broadcast_addr, self.port))
+        delay = interval * random.uniform(1 - JITTER, 1 + JITTER)
+        self.announce_handle = self.loop.call_later(delay, self.announce)
+
+    async def run_flush(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    async def flush(self):
+        """ Write new and moved peers to db in one transaction
+
+        :return: number of written peers
+        :rtype: int
+        """
+        if not self.pending:
+            return 0
+        pending, self.pending = self.pending, {}
+        queries = []
+        signed = [(key, host, port)
+                  for key, (host, port, is_signed) in pending.items()
+                  if is_signed]
+        if self.add_hosts:
+            # Unsigned source address may come from a replayed
+            # announcement, so it's never written over a known one
+            queries.append((INSERT['hosts-new'], [
+                (key, host, port)
+                for key, (host, port, is_signed) in pending.items()
+                if not is_signed
+            ]))
+            queries.append((INSERT['hosts-upsert'], signed))
+        else:
+            queries.append((UPDATE['hosts-address'],
+                            [(host, port, key) for key, host, port in signed]))
+        queries = [(query, values) for query, values in queries if values]
+        count = sum(len(values) for _, values in queries)
+        if not queries:
+            return 0
+
+        try:
+            async with self.db_pool.acquire() as conn:
+                async with conn.cursor() as cur:
+                    for query, values in queries:
+                        await cur.executemany(query, values)
+                await conn.commit()
+        except Exception:
+            logger.exception('failed to write %d peers', count)
+            # Keep failed peers for the next flush unless they've moved
+            # since then
+            for key, address in pending.items():
+                self.pending.setdefault(key, address)
+            return 0
+        return count
 
-    def broadcast(self):
-        self.transport.sendto(str(datetime.now()).encode(),
-                              (self.broadcast_addr, self.port))
-        self.loop.call_later(5, self.broadcast)
+    async def close(self):
+        if self.transport is not None:
+            self.transport.close()
+        if self.flush_task is not None:
+            self.flush_task.cancel()
+            try:
+                await self.flush_task
+            except asyncio.CancelledError:
+                pass
+        await self.flush()
+        self.db_pool.close()
+        await self.db_pool.wait_closed()
 
 
 def start_discovery_server(host=DISCOVERY_HOST, port=DISCOVERY_PORT,
-                           addr=DISCOVERY_ADDR, dsn=DSN, path=None):
+                           addr=DISCOVERY_ADDR, dsn=DSN, path=None,
+                           announce_host=ANNOUNCE_HOST, announce_port=PORT):
     """ Start encsend discovery server
 
     :param host: discovery server host
@@ -74,18 +312,28 @@ def start_discovery_server(host=DISCOVERY_HOST, port=DISCOVERY_PORT,
     :param path: path to signature key file, if path is `None`
         default path is used
     :type path: str or None
+    :param announce_host: host of EncSend server announced to peers, if
+        None - peers use source address of announcements
+    :type announce_host: str or None
+    :param announce_port: port of EncSend server announced to peers
+    :type announce_port: int
     """
-    loop = asyncio.get_event_loop()
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    server = DiscoveryServer(loop, host, port, dsn, path, addr,
+                             announce_host, announce_port)
+    loop.run_until_complete(server.init_db())
     coro = loop.create_datagram_endpoint(
-        lambda: DiscoveryServer(loop, host, port, dsn, path, addr),
+        lambda: server,
         local_addr=(host, port)
     )
-    transport, protocol = loop.run_until_complete(coro)
+    loop.run_until_complete(coro)
+    loop.add_signal_handler(signal.SIGHUP, server.reload_keys)
 
     try:
         loop.run_forever()
     except KeyboardInterrupt:
         pass
     finally:
-        transport.close()
+        loop.run_until_complete(server.close())
         loop.close()
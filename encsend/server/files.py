@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+
+import os
+import tempfile
+from binascii import hexlify
+
+from nacl.bindings import (
+    crypto_secretstream_xchacha20poly1305_TAG_FINAL as TAG_FINAL,
+    crypto_secretstream_xchacha20poly1305_init_pull as init_pull,
+    crypto_secretstream_xchacha20poly1305_pull as pull,
+    crypto_secretstream_xchacha20poly1305_state as State
+)
+from nacl.exceptions import CryptoError
+
+
+class FileStream:
+    """ Incoming file, chunks are decrypted and written to a temporary
+    file which is renamed by `commit` after the file is saved to db, so
+    there are no files without rows in db
+    """
+    def __init__(self, files_dir, key, header, size, name, host_id,
+                 max_size):
+        """
+        :param files_dir: directory for received files
+        :type files_dir: str
+        :param key: stream's secretstream key
+        :type key: bytes
+        :param header: secretstream header
+        :type header: bytes
+        :param size: file size declared by sender
+        :type size: int
+        :param name: file name declared by sender
+        :type name: str
+        :param host_id: sender's internal id
+        :type host_id: int
+        :param max_size: max allowed file size
+        :type max_size: int
+        :raises ValueError: declared size is larger than `max_size`
+        :raises CryptoError: invalid key or header
+        """
+        if size > max_size:
+            raise ValueError('file is too large: %d bytes' % size)
+        self.files_dir = files_dir
+        self.size = size
+        self.name = name
+        self.host_id = host_id
+        self.received = 0
+        self.finished = False
+        self.state = State()
+        init_pull(self.state, header, key)
+
+        fd, self.tmp_path = tempfile.mkstemp(dir=files_dir, suffix='.part')
+        self.file = os.fdopen(fd, 'wb')
+        self.path = None
+
+    def write_chunk(self, chunk):
+        """ Decrypt and write a chunk, blocking, should be run
+        in executor
+
+        :param chunk: encrypted chunk
+        :type chunk: bytes
+        :return: True if chunk was valid, otherwise - False
+        :rtype: bool
+        """
+        try:
+            data, tag = pull(self.state, chunk)
+        except CryptoError:
+            return False
+
+        self.received += len(data)
+        if self.received > self.size:
+            return False
+        self.file.write(data)
+
+        if tag == TAG_FINAL:
+            if self.received != self.size:
+                return False
+            self.finish()
+        return True
+
+    def finish(self):
+        """ Close the file and pick it's final path, file name on disk
+        is random, the name declared by sender is kept in db
+        """
+        self.file.close()
+        self.path = os.path.join(self.files_dir,
+                                 hexlify(os.urandom(16)).decode())
+        self.finished = True
+
+    def commit(self):
+        """ Move received file to the final path """
+        os.rename(self.tmp_path, self.path)
+        self.tmp_path = None
+
+    def abort(self):
+        """ Drop partially received file or file which wasn't saved to
+        db
+        """
+        if self.tmp_path is None:
+            return
+        self.file.close()
+        os.unlink(self.tmp_path)
+        self.tmp_path = None
@@ -1,17 +1,45 @@
 # -*- coding: utf-8 -*-
 
 import asyncio
-import json
+import signal
+import sys
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from datetime import datetime
+from functools import partial
 from time import mktime
 
-from nacl.encoding import HexEncoder
-from nacl.exceptions import BadSignatureError, CryptoError
-from nacl.public import SealedBox
-from nacl.signing import VerifyKey
+from nacl.exceptions import CryptoError
 
 from .base import ServerBase
+from .crypto import (REJECT_BAD_SIGNATURE, REJECT_BUSY, REJECT_CRYPTO,
+                     REJECT_MALFORMED, REJECT_REPLAY, REJECT_STALE,
+                     REJECT_TOO_LARGE, REJECT_UNKNOWN_HOST,
+                     REJECT_UNSUPPORTED, Rejected, unseal_envelope,
+                     unseal_keyed_envelope, unseal_message, verify_envelope,
+                     verify_message, verify_stream_start)
+from .files import FileStream
+from .metrics import ServerMetrics, start_metrics_server
+from .registry import HostRegistry
+from .replay import ReplayCache
+from .subscriptions import OutputStream, StreamServer, Subscription
+from .writer import MessageWriter
+from .supervisor import Supervisor
+from ..protocol import (ACK_ACCEPTED, ACK_STATUSES, FRAME_ACK, FRAME_MESSAGE,
+                        FRAME_MESSAGE_ACK, FRAME_STREAM_CHUNK,
+                        FRAME_STREAM_START, FRAME_STREAM_START_ACK,
+                        KEYED_VERSION, LEGACY_VERSION,
+                        NACK_BAD_SIGNATURE, NACK_CRYPTO, NACK_ERROR,
+                        NACK_MALFORMED, NACK_REPLAY, NACK_STALE,
+                        NACK_TOO_LARGE, NACK_UNKNOWN_HOST, NACK_UNSUPPORTED,
+                        VERSION,
+                        FrameTooLarge, ProtocolError, message_digest,
+                        pack_ack, pack_frame, read_frame, unpack_message_ack,
+                        unpack_nonce)
+from ..keystore import get_keys, reload_keys
 from ..sql import INSERT, SELECT
+from ..utils import get_files_dir
 
 try:
     from .. import conf
@@ -19,81 +47,702 @@ except ImportError:
     from .. import conf_default as conf
 finally:
     HOST, PORT, DSN = conf.HOST, conf.PORT, conf.DSN
+    MAX_MESSAGE_SIZE = conf.MAX_MESSAGE_SIZE
+    MAX_DECOMPRESSED_SIZE = conf.MAX_DECOMPRESSED_SIZE
+    REPLAY_WINDOW, REPLAY_CACHE_SIZE = conf.REPLAY_WINDOW, \
+        conf.REPLAY_CACHE_SIZE
+    REPLAY_CACHE_HOST_SIZE = conf.REPLAY_CACHE_HOST_SIZE
+    REQUIRE_NONCE = conf.REQUIRE_NONCE
+    CRYPTO_WORKERS, CRYPTO_BACKEND = conf.CRYPTO_WORKERS, conf.CRYPTO_BACKEND
+    HOSTS_CACHE_SIZE, HOSTS_CACHE_TTL = conf.HOSTS_CACHE_SIZE, \
+        conf.HOSTS_CACHE_TTL
+    WRITE_BATCH_SIZE, WRITE_FLUSH_INTERVAL = conf.WRITE_BATCH_SIZE, \
+        conf.WRITE_FLUSH_INTERVAL
+    WRITE_QUEUE_SIZE = conf.WRITE_QUEUE_SIZE
+    FILES_DIR, MAX_FILE_SIZE = conf.FILES_DIR, conf.MAX_FILE_SIZE
+    READ_TIMEOUT, MAX_CONNECTIONS = conf.READ_TIMEOUT, conf.MAX_CONNECTIONS
+    MAX_CONNECTIONS_PER_IP = conf.MAX_CONNECTIONS_PER_IP
+    METRICS_HOST, METRICS_PORT = conf.METRICS_HOST, conf.METRICS_PORT
+    STREAM = conf.STREAM
+
+CRYPTO_BACKENDS = {
+    'thread': ThreadPoolExecutor,
+    'process': ProcessPoolExecutor
+}
+
+
+def init_crypto_worker():
+    """ Reset signal handling inherited by crypto worker processes from
+    the server, so signals sent to the whole process group don't reach
+    server's event loop through it's wakeup fd once again. SIGTERM stops
+    a worker, SIGINT and SIGHUP are handled by the server only
+    """
+    signal.set_wakeup_fd(-1)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGHUP, signal.SIG_IGN)
+
+
+# Protocol version -> functions decrypting and verifying a message
+MESSAGE_FORMATS = {
+    LEGACY_VERSION: (unseal_message, verify_message),
+    VERSION: (unseal_envelope, verify_envelope),
+    KEYED_VERSION: (unseal_keyed_envelope, verify_envelope)
+}
+
+# Reject reason -> ack status
+NACK_STATUSES = {
+    REJECT_CRYPTO: NACK_CRYPTO,
+    REJECT_MALFORMED: NACK_MALFORMED,
+    REJECT_UNKNOWN_HOST: NACK_UNKNOWN_HOST,
+    REJECT_BAD_SIGNATURE: NACK_BAD_SIGNATURE,
+    REJECT_UNSUPPORTED: NACK_UNSUPPORTED,
+    REJECT_TOO_LARGE: NACK_TOO_LARGE,
+    REJECT_STALE: NACK_STALE,
+    REJECT_REPLAY: NACK_REPLAY,
+    # Message may be accepted later, when the replay cache has room
+    REJECT_BUSY: NACK_ERROR
+}
 
 
 class EncSendServer(ServerBase):
     """ EncSend server side implementation """
+    writer_class = MessageWriter
+
+    def __init__(self, loop, host, port, dsn, signature_path=None,
+                 max_message_size=MAX_MESSAGE_SIZE,
+                 max_decompressed_size=MAX_DECOMPRESSED_SIZE,
+                 crypto_workers=CRYPTO_WORKERS, crypto_backend=CRYPTO_BACKEND,
+                 reuse_port=False, hosts_cache_size=HOSTS_CACHE_SIZE,
+                 hosts_cache_ttl=HOSTS_CACHE_TTL,
+                 write_batch_size=WRITE_BATCH_SIZE,
+                 write_flush_interval=WRITE_FLUSH_INTERVAL,
+                 write_queue_size=WRITE_QUEUE_SIZE, files_dir=FILES_DIR,
+                 max_file_size=MAX_FILE_SIZE, read_timeout=READ_TIMEOUT,
+                 max_connections=MAX_CONNECTIONS,
+                 max_connections_per_ip=MAX_CONNECTIONS_PER_IP,
+                 metrics_host=METRICS_HOST, metrics_port=METRICS_PORT,
+                 replay_window=REPLAY_WINDOW,
+                 replay_cache_size=REPLAY_CACHE_SIZE,
+                 replay_cache_host_size=REPLAY_CACHE_HOST_SIZE,
+                 require_nonce=REQUIRE_NONCE, stream=STREAM,
+                 stream_consumer=None):
+        """
+        :param loop: asyncio event loop
+        :param host: tcp server host
+        :type host: str
+        :param port: tcp server port
+        :type port: int
+        :param dsn: Data Source Name, information about database driver,
+            server, database, etc
+        :type dsn: str
+        :param signature_path: custom path to signature key file
+        :type signature_path: str or None
+        :param max_message_size: max allowed frame payload length, bigger
+            frames are rejected right after reading the header
+        :type max_message_size: int
+        :param max_decompressed_size: max allowed size of decompressed
+            message, decompression stops as soon as it's exceeded
+        :type max_decompressed_size: int
+        :param crypto_workers: number of workers decrypting and verifying
+            messages, if 0 - it is done in the event loop's thread
+        :type crypto_workers: int
+        :param crypto_backend: kind of workers, `thread` or `process`
+        :type crypto_backend: str
+        :param reuse_port: set SO_REUSEPORT, so a number of processes can
+            listen the same port
+        :type reuse_port: bool
+        :param hosts_cache_size: max number of known hosts kept in memory
+        :type hosts_cache_size: int
+        :param hosts_cache_ttl: seconds after which cached host is
+            selected from db again
+        :type hosts_cache_ttl: float
+        :param write_batch_size: max number of messages inserted in one
+            transaction
+        :type write_batch_size: int
+        :param write_flush_interval: max delay in seconds before
+            received message is written to db
+        :type write_flush_interval: float
+        :param write_queue_size: max number of messages waiting to be
+            written, connections stop reading when the queue is full
+        :type write_queue_size: int
+        :param files_dir: directory for received files, if None - default
+            path is used
+        :type files_dir: str or None
+        :param max_file_size: max allowed size of received file
+        :type max_file_size: int
+        :param read_timeout: max seconds for reading a frame, including
+            waiting for it, slower connections are closed, None - no limit
+        :type read_timeout: float or None
+        :param max_connections: max number of open connections, new
+            connections above the limit are closed right away
+        :type max_connections: int
+        :param max_connections_per_ip: max number of open connections
+            from a single ip address
+        :type max_connections_per_ip: int
+        :param metrics_host: metrics http server host
+        :type metrics_host: str
+        :param metrics_port: metrics http server port, None - don't start
+            metrics server
+        :type metrics_port: int or None
+        :param replay_window: max difference in seconds between message's
+            send time and server's time, ids of accepted messages are
+            remembered for this time
+        :type replay_window: float
+        :param replay_cache_size: max number of remembered message ids
+        :type replay_cache_size: int
+        :param replay_cache_host_size: max number of remembered message
+            ids of one sender
+        :type replay_cache_host_size: int
+        :param require_nonce: reject messages without send time and id,
+            e.g. legacy ones
+        :type require_nonce: bool
+        :param stream: push received messages as json lines after they
+            are written to db, `-` - to stdout, path - to consumers
+            connected to Unix socket, None - don't push messages
+        :type stream: str or None
+        :param stream_consumer: consumer's name for stdout stream, it's
+            cursor is saved in db, None - only messages received after
+            the start are written
+        :type stream_consumer: str or None
+        """
+        super().__init__(loop, host, port, dsn, signature_path)
+        self.max_message_size = max_message_size
+        self.max_decompressed_size = max_decompressed_size
+        self.crypto_workers = crypto_workers
+        self.crypto_backend = crypto_backend
+        self.reuse_port = reuse_port
+        self.executor = None
+        self.registry = HostRegistry(hosts_cache_size, hosts_cache_ttl)
+        self.replay_cache = ReplayCache(replay_window, replay_cache_size,
+                                        replay_cache_host_size)
+        self.require_nonce = require_nonce
+        self.write_batch_size = write_batch_size
+        self.write_flush_interval = write_flush_interval
+        self.write_queue_size = write_queue_size
+        self.files_dir = files_dir
+        self.max_file_size = max_file_size
+        self.read_timeout = read_timeout
+        self.max_connections = max_connections
+        self.max_connections_per_ip = max_connections_per_ip
+        self.connections = 0
+        # ip address -> number of open connections
+        self.ip_connections = Counter()
+        # reason -> number of connections closed by limits
+        self.shed = Counter()
+        self.metrics_host = metrics_host
+        self.metrics_port = metrics_port
+        self.metrics_server = None
+        self.stream = stream
+        self.stream_consumer = stream_consumer
+        self.streamer = None
+        self.init_metrics()
+
+    def init_metrics(self):
+        self.metrics = ServerMetrics()
+        self.metrics.callback(
+            'encsend_shed_total', 'Connections closed by limits by reason',
+            lambda: {(('reason', reason),): value
+                     for reason, value in self.shed.items()},
+            type_='counter'
+        )
+        self.metrics.callback('encsend_connections', 'Open connections',
+                              lambda: self.connections)
+        self.metrics.callback('encsend_write_queue_size',
+                              'Messages waiting to be written to db',
+                              lambda: self.writer.queue.qsize())
+        self.metrics.callback(
+            'encsend_hosts_cache_total', 'Hosts registry lookups by result',
+            lambda: {(('result', 'hit'),): self.registry.hits,
+                     (('result', 'miss'),): self.registry.misses},
+            type_='counter'
+        )
+        self.metrics.callback('encsend_hosts_cache_size',
+                              'Hosts in the registry',
+                              lambda: len(self.registry.hosts))
+
     async def tcp_server(self, reader, writer):
-        data = await reader.read()
-        writer.close()
+        """ Accept a connection if it is within limits """
+        peername = writer.get_extra_info('peername')
+        ip = peername[0] if peername else None
+        if self.connections >= self.max_connections:
+            self.shed['connections'] += 1
+            writer.close()
+            return
+        if self.ip_connections[ip] >= self.max_connections_per_ip:
+            self.shed['connections_per_ip'] += 1
+            writer.close()
+            return
+
+        self.connections += 1
+        self.ip_connections[ip] += 1
+        try:
+            await self.handle_connection(reader, writer)
+        finally:
+            self.connections -= 1
+            self.ip_connections[ip] -= 1
+            if not self.ip_connections[ip]:
+                del self.ip_connections[ip]
+
+    async def handle_connection(self, reader, writer):
+        """ Handle a connection, one connection may carry many frames,
+        messages and files are sent one after another. Messages with ack
+        request are acked in background, so the client may send next
+        messages without waiting, files with ack request are acked after
+        the final chunk is saved
+        """
+        stream = None
+        # (sequence number, digest) of stream start with ack request
+        stream_ack = None
+        acks = set()
+        try:
+            while True:
+                # Stop reading if the client doesn't read acks
+                await writer.drain()
+                try:
+                    frame = await asyncio.wait_for(
+                        read_frame(reader, self.max_message_size),
+                        self.read_timeout
+                    )
+                except asyncio.TimeoutError:
+                    self.shed['timeout'] += 1
+                    break
+                except FrameTooLarge:
+                    self.shed['too_large'] += 1
+                    break
+                except ProtocolError:
+                    self.shed['protocol'] += 1
+                    break
+                # Connection was closed by the client
+                if frame is None:
+                    break
+                version, frame_type, payload = frame
+                self.metrics.received_bytes.inc(len(payload))
+                if frame_type == FRAME_MESSAGE and stream is None:
+                    await self.handle_message(payload, version)
+                elif frame_type == FRAME_MESSAGE_ACK and stream is None:
+                    try:
+                        seq, sealed = unpack_message_ack(payload)
+                    except ProtocolError:
+                        self.shed['protocol'] += 1
+                        break
+                    waiter = self.loop.create_future()
+                    task = self.loop.create_task(self.send_ack(
+                        writer, seq, message_digest(sealed), waiter
+                    ))
+                    acks.add(task)
+                    task.add_done_callback(acks.discard)
+                    await self.handle_message(sealed, version, waiter)
+                elif frame_type in (FRAME_STREAM_START,
+                                    FRAME_STREAM_START_ACK) and \
+                        stream is None:
+                    if frame_type == FRAME_STREAM_START_ACK:
+                        try:
+                            seq, payload = unpack_message_ack(payload)
+                        except ProtocolError:
+                            self.shed['protocol'] += 1
+                            break
+                        stream_ack = (seq, message_digest(payload))
+                    try:
+                        stream = await self.open_stream(payload)
+                    except Rejected as e:
+                        self.write_stream_ack(writer, stream_ack,
+                                              NACK_STATUSES[e.reason])
+                        break
+                elif frame_type == FRAME_STREAM_CHUNK and stream is not None:
+                    try:
+                        valid = await self.handle_chunk(stream, payload)
+                    except Exception:
+                        self.write_stream_ack(writer, stream_ack, NACK_ERROR)
+                        raise
+                    if not valid:
+                        self.write_stream_ack(writer, stream_ack,
+                                              NACK_MALFORMED)
+                        break
+                    if stream.finished:
+                        self.write_stream_ack(writer, stream_ack,
+                                              ACK_ACCEPTED)
+                        stream = stream_ack = None
+                else:
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            if stream is not None:
+                stream.abort()
+            if acks:
+                await asyncio.wait(acks)
+            writer.close()
+
+    async def handle_message(self, data, version=VERSION, waiter=None):
+        """ Read incoming message and save it to db if it is valid
+
+        :param data: frame payload
+        :type data: bytes
+        :param version: frame's protocol version
+        :type version: int
+        :param waiter: future resolved after the message is written to
+            db, it gets `Rejected` exception if the message is invalid
+        :type waiter: asyncio.Future or None
+        """
         datetime_now = datetime.now()
-        message, host_id = await self.read_message(data)
+        try:
+            message, host_id, replay_key = await self.open_message(data,
+                                                                   version)
+        # Invalid message, the connection stays open for the next frames
+        except Rejected as e:
+            if waiter is not None:
+                waiter.set_exception(e)
+            return
+
+        # Message which wasn't saved may be sent again
+        if replay_key is not None:
+            if waiter is None:
+                waiter = self.loop.create_future()
+            waiter.add_done_callback(partial(self.forget_unsaved, replay_key))
+        self.metrics.messages.inc()
+        # unix timestamp
+        now = mktime(datetime_now.utctimetuple())
+        values = (message, host_id, now)
+        await self.writer.put(values, waiter)
+
+    def forget_unsaved(self, replay_key, waiter):
+        """ Forget id of message which wasn't written to db """
+        if waiter.cancelled() or waiter.exception() is not None:
+            self.replay_cache.discard(replay_key)
 
-        if message is not None:
-            # unix timestamp
-            now = mktime(datetime_now.utctimetuple())
-            values = (message, host_id, now)
+    async def send_ack(self, writer, seq, digest, waiter):
+        """ Wait until the message is saved or rejected and send signed
+        ack with it's status
 
-            async with self.db_pool.acquire() as conn:
-                async with conn.cursor() as cur:
-                    await cur.execute(INSERT['messages'], values)
+        :param writer: connection's stream writer
+        :type writer: asyncio.StreamWriter
+        :param seq: message's sequence number
+        :type seq: int
+        :param digest: digest of the sealed message
+        :type digest: bytes
+        :param waiter: future passed to `handle_message`
+        :type waiter: asyncio.Future
+        """
+        try:
+            await waiter
+            status = ACK_ACCEPTED
+        except Rejected as e:
+            status = NACK_STATUSES[e.reason]
+        except Exception:
+            status = NACK_ERROR
+        self.write_ack(writer, seq, digest, status)
+
+    def write_ack(self, writer, seq, digest, status):
+        """ Send signed ack with the status unless the connection is
+        closing
+        """
+        self.metrics.acks.inc(status=ACK_STATUSES[status])
+        if writer.is_closing():
+            return
+        payload = pack_ack(self.signing_key, seq, status, digest)
+        writer.write(pack_frame(payload, FRAME_ACK))
 
-    async def read_message(self, data):
+    def write_stream_ack(self, writer, stream_ack, status):
+        """ Ack incoming file if the sender requested it
+
+        :param stream_ack: sequence number and digest of stream start,
+            None - ack wasn't requested
+        :type stream_ack: (int, bytes) or None
+        """
+        if stream_ack is not None:
+            self.write_ack(writer, *stream_ack, status)
+
+    async def read_message(self, data, version=VERSION):
         """ Read and decrypt incoming message, check it's signature
 
         :param data: incoming data
         :type data: bytes
+        :param version: frame's protocol version, defines message format
+        :type version: int
         :return: tuple with message and host_id if message was decrypted
             and signature verified, otherwise - None
         :rtype: (str, int) or None
         """
-        # TODO: check magic byte
-        unsealed_box = SealedBox(self.private_key)
         try:
-            json_data = unsealed_box.decrypt(data, encoder=HexEncoder)
-        except CryptoError:
+            message, host_id, _ = await self.open_message(data, version)
+        except Rejected:
             return
-        dct = json.loads(json_data.decode())
+        return message, host_id
 
-        # a dictionary has invalid structure
-        if dct.keys() != {'host', 'message'}:
-            return
+    async def open_message(self, data, version=VERSION):
+        """ Same as `read_message`, but raises `Rejected` for invalid
+        messages
+
+        :return: tuple with message, host_id and key of message's id in
+            the replay cache, None if message has no id
+        :rtype: (str, int, tuple or None)
+        """
+        unseal, verify = MESSAGE_FORMATS[version]
+        if version == LEGACY_VERSION:
+            # Legacy messages can't carry send time and id
+            if self.require_nonce:
+                self.metrics.rejected.inc(reason=REJECT_UNSUPPORTED)
+                raise Rejected(REJECT_UNSUPPORTED)
+            return await self.open_sealed(data, unseal, verify)
+        return await self.open_sealed(data, unseal, verify,
+                                      self.max_decompressed_size,
+                                      replay=True)
+
+    async def open_sealed(self, data, unseal, verify, *args, replay=False):
+        """ Decrypt incoming data, check it's sender and signature
+
+        With `replay` stale and already seen messages are rejected before
+        checking signature, message's id is remembered after that
+
+        :param data: incoming data
+        :type data: bytes
+        :param unseal: function decrypting and parsing data
+        :param verify: function checking signature
+        :param args: extra arguments passed to `verify`
+        :param replay: check send time and id of envelope
+        :type replay: bool
+        :return: tuple with result of `verify`, host_id and key of
+            message's id in the replay cache or None
+        :rtype: tuple
+        :raises Rejected: data is invalid, rejection is counted
+        """
+        stages = self.metrics.stages
+        try:
+            with stages.time(stage='unseal'):
+                host_key, signed = await self.run_crypto(
+                    unseal, self.private_key, data
+                )
+
+            with stages.time(stage='lookup'):
+                host = await self.get_host(host_key)
+            # Host wasn't found in DB
+            if host is None:
+                raise Rejected(REJECT_UNKNOWN_HOST)
+            host_id, verify_key = host
+
+            replay_key = None
+            if replay:
+                replay_key, timestamp = self.check_replay(host_id, signed)
+
+            with stages.time(stage='verify'):
+                message = await self.run_crypto(verify, verify_key, signed,
+                                                *args)
+            # The same message might be accepted while it was verified
+            if replay_key is not None:
+                self.replay_cache.add(replay_key, timestamp)
+        except Rejected as e:
+            self.metrics.rejected.inc(reason=e.reason)
+            raise
+
+        return message, host_id, replay_key
+
+    def check_replay(self, host_id, envelope):
+        """ Check envelope's send time and id, signature isn't checked
+        yet, so id isn't remembered
+
+        :param host_id: sender's id
+        :type host_id: int
+        :param envelope: unsealed envelope
+        :type envelope: encsend.protocol.Envelope
+        :return: tuple with key of message's id in the replay cache and
+            send time, both are None if envelope has no nonce
+        :rtype: ((int, bytes), int) or (None, None)
+        :raises Rejected: envelope is stale or it's a replay, envelope
+            without nonce when nonce is required
+        """
+        try:
+            timestamp, message_id, _ = unpack_nonce(envelope)
+        except ProtocolError:
+            raise Rejected(REJECT_MALFORMED)
+        if message_id is None:
+            if self.require_nonce:
+                raise Rejected(REJECT_UNSUPPORTED)
+            return None, None
+        key = (host_id, message_id)
+        self.replay_cache.check(key, timestamp)
+        return key, timestamp
+
+    async def open_stream(self, data):
+        """ Start receiving a file
+
+        :param data: stream start frame's payload
+        :type data: bytes
+        :return: incoming file
+        :rtype: FileStream
+        :raises Rejected: stream start is invalid or the file is too large
+        """
+        # Replayed stream start would store the same file again
+        (key, header, size, name), host_id, _ = await self.open_sealed(
+            data, unseal_envelope, verify_stream_start, replay=True
+        )
+        try:
+            return FileStream(self.files_dir, key, header, size, name,
+                              host_id, self.max_file_size)
+        except ValueError:
+            raise Rejected(REJECT_TOO_LARGE)
+        except CryptoError:
+            raise Rejected(REJECT_CRYPTO)
+
+    async def handle_chunk(self, stream, data):
+        """ Decrypt and write a chunk of incoming file, save file's
+        details to db after the final chunk, then move the file to it's
+        final path
+
+        :param stream: incoming file
+        :type stream: FileStream
+        :param data: encrypted chunk
+        :type data: bytes
+        :return: True if chunk was valid, otherwise - False
+        :rtype: bool
+        """
+        # Blocking file io and secretstream state can't be moved to
+        # a process, so default thread pool is used
+        with self.metrics.stages.time(stage='file_chunk'):
+            valid = await self.loop.run_in_executor(None, stream.write_chunk,
+                                                    data)
+        if not valid:
+            return False
+        if not stream.finished:
+            return True
 
+        now = mktime(datetime.now().utctimetuple())
+        values = (stream.name, stream.path, stream.size, stream.host_id, now)
+        start = time.perf_counter()
         async with self.db_pool.acquire() as conn:
+            self.metrics.pool_wait.observe(time.perf_counter() - start)
             async with conn.cursor() as cur:
-                await cur.execute(SELECT['hosts'], (dct['host'],))
-                host_id = await cur.fetchall()
+                await cur.execute(INSERT['files'], values)
+            await conn.commit()
+        stream.commit()
+        return True
 
-        # Host wasn't found in DB
-        if not host_id:
-            return
+    async def run_crypto(self, func, *args):
+        """ Run crypto function in the executor if it is used, otherwise
+        in the event loop's thread
+        """
+        if self.executor is None:
+            return func(*args)
+        return await self.loop.run_in_executor(self.executor, func, *args)
+
+    def subscribe(self, consumer=None, after_id=None):
+        """ Subscribe to received messages, the subscription is an
+        async iterator returning messages as soon as they are written to
+        db, processed messages are acked with `Subscription.ack`
+
+        :param consumer: consumer's name, it's cursor is saved in db,
+            None - anonymous subscription
+        :type consumer: str or None
+        :param after_id: return messages with bigger ids, if None - after
+            the consumer's cursor or after the last received message
+        :type after_id: int or None
+        :rtype: encsend.server.subscriptions.Subscription
+        """
+        return Subscription(self.db_pool, self.writer, consumer, after_id)
+
+    def reload_keys(self):
+        """ Read signing key file again and forget cached hosts, e.g. on
+        SIGHUP, so hosts removed from db or with changed keys aren't
+        trusted until cached entries expire
+        """
+        super().reload_keys()
+        self.registry.invalidate()
+
+    async def get_host(self, host_key):
+        """ Get host's id and verify key from the registry or db
+
+        :param host_key: hex encoded host's verify key
+        :type host_key: str
+        :return: tuple with host's id and verify key or None if host
+            wasn't found
+        :rtype: (int, nacl.signing.VerifyKey) or None
+        """
+        host = self.registry.get(host_key)
+        if host is not None:
+            return host
 
-        # Check signature
-        verify_key = VerifyKey(dct['host'].encode(), encoder=HexEncoder)
+        start = time.perf_counter()
+        async with self.db_pool.acquire() as conn:
+            self.metrics.pool_wait.observe(time.perf_counter() - start)
+            async with conn.cursor() as cur:
+                await cur.execute(SELECT['hosts'], (host_key,))
+                rows = await cur.fetchall()
+        if not rows:
+            return
         try:
-            message = verify_key.verify(dct['message'].encode(),
-                                        encoder=HexEncoder)
-        except BadSignatureError:
+            return self.registry.add(host_key, rows[0][0])
+        except ValueError:
             return
 
-        return message.decode(), host_id[0][0]
+    async def load_hosts(self):
+        """ Fill the registry with hosts from db """
+        async with self.db_pool.acquire() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(SELECT['hosts-keys'])
+                rows = await cur.fetchmany(self.registry.size)
+        self.registry.load(rows)
 
     def start(self):
+        if self.files_dir is None:
+            self.files_dir = get_files_dir(make_dir=True)
+        if self.crypto_workers > 0:
+            executor_class = CRYPTO_BACKENDS[self.crypto_backend]
+            kwargs = {}
+            if executor_class is ProcessPoolExecutor:
+                kwargs['initializer'] = init_crypto_worker
+            self.executor = executor_class(max_workers=self.crypto_workers,
+                                           **kwargs)
         self.loop.run_until_complete(self.init_db())
+        self.loop.run_until_complete(self.load_hosts())
         self.coro = asyncio.start_server(self.tcp_server, self.host, self.port,
-                                         loop=self.loop)
+                                         reuse_port=self.reuse_port)
         self.server = self.loop.run_until_complete(self.coro)
+        # Writer's task isn't left pending if the port can't be bound,
+        # connections are handled only after `start` returns
+        self.writer = self.writer_class(self.loop, self.db_pool,
+                                        self.write_batch_size,
+                                        self.write_flush_interval,
+                                        self.write_queue_size, self.metrics)
+        self.writer.start()
+        if self.stream == '-':
+            self.streamer = OutputStream(self.loop,
+                                         self.subscribe(self.stream_consumer),
+                                         sys.stdout)
+        elif self.stream is not None:
+            self.streamer = StreamServer(self.loop, self.subscribe,
+                                         self.stream)
+        if self.streamer is not None:
+            self.loop.run_until_complete(self.streamer.start())
+        if self.metrics_port is not None:
+            self.metrics_server = self.loop.run_until_complete(
+                start_metrics_server(self.metrics, self.metrics_host,
+                                     self.metrics_port)
+            )
 
     async def wait(self):
         await self.server.wait_closed()
+        if self.metrics_server is not None:
+            await self.metrics_server.wait_closed()
+        # Write queued messages before closing db connections
+        await self.writer.close()
+        if self.streamer is not None:
+            await self.streamer.close()
+        self.db_pool.close()
         await self.db_pool.wait_closed()
 
     def stop(self):
         self.server.close()
-        self.db_pool.close()
+        if self.metrics_server is not None:
+            self.metrics_server.close()
+        if self.executor is not None:
+            self.executor.shutdown(wait=False)
 
 
-def start_encsend_server(host=HOST, port=PORT, dsn=DSN, path=None):
+def start_encsend_server(host=HOST, port=PORT, dsn=DSN, path=None,
+                         crypto_workers=CRYPTO_WORKERS,
+                         crypto_backend=CRYPTO_BACKEND, workers=1,
+                         metrics_port=METRICS_PORT, stream=STREAM,
+                         stream_consumer=None):
     """ Start encsend server
 
     :param host: tcp server host
@@ -106,16 +755,78 @@ def start_encsend_server(host=HOST, port=PORT, dsn=DSN, path=None):
     :param path: path to signature key file, if path is `None`
         default path is used
     :type path: str or None
+    :param crypto_workers: number of workers decrypting and verifying
+        messages, if 0 - it is done in the event loop's thread
+    :type crypto_workers: int
+    :param crypto_backend: kind of workers, `thread` or `process`
+    :type crypto_backend: str
+    :param workers: number of server processes, if more than 1, every
+        process listens the port with SO_REUSEPORT, crashed processes
+        are restarted
+    :type workers: int
+    :param metrics_port: metrics http server port, worker processes use
+        `metrics_port + worker's number`, None - don't start metrics
+        server
+    :type metrics_port: int or None
+    :param stream: push received messages after they are written to db,
+        `-` - to stdout, path - to Unix socket, None - don't push them,
+        with many workers messages are pushed by the first one
+    :type stream: str or None
+    :param stream_consumer: consumer's name for stdout stream
+    :type stream_consumer: str or None
+    """
+    kwargs = {
+        'host': host,
+        'port': port,
+        'dsn': dsn,
+        'path': path,
+        'crypto_workers': crypto_workers,
+        'crypto_backend': crypto_backend,
+        'metrics_port': metrics_port,
+        'stream': stream,
+        'stream_consumer': stream_consumer
+    }
+    if workers > 1:
+        kwargs['reuse_port'] = True
+        # Workers are forked with keys already loaded, restarted workers
+        # get keys reloaded by the supervisor
+        get_keys(path)
+        Supervisor(workers, run_encsend_server, kwargs,
+                   reload=partial(reload_keys, path)).run()
+    else:
+        run_encsend_server(**kwargs)
+
+
+def run_encsend_server(host, port, dsn, path, crypto_workers, crypto_backend,
+                       metrics_port, stream=None, stream_consumer=None,
+                       reuse_port=False, worker=0):
+    """ Run encsend server in current process until SIGTERM or SIGINT,
+    see `start_encsend_server` for arguments
     """
-    loop = asyncio.get_event_loop()
-    encsend_server = EncSendServer(loop=loop, host=HOST, port=PORT, dsn=DSN,
-                                   signature_path=path)
+    if metrics_port is not None:
+        metrics_port += worker
+    # Messages committed by other workers are read from db by the first
+    # one, so every message is pushed once
+    if worker:
+        stream = None
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    encsend_server = EncSendServer(loop=loop, host=host, port=port, dsn=dsn,
+                                   signature_path=path,
+                                   crypto_workers=crypto_workers,
+                                   crypto_backend=crypto_backend,
+                                   reuse_port=reuse_port,
+                                   metrics_port=metrics_port, stream=stream,
+                                   stream_consumer=stream_consumer)
     encsend_server.start()
+    # Repeated signals during shutdown only set the event again
+    stopping = asyncio.Event()
+    loop.add_signal_handler(signal.SIGTERM, stopping.set)
+    loop.add_signal_handler(signal.SIGINT, stopping.set)
+    loop.add_signal_handler(signal.SIGHUP, encsend_server.reload_keys)
 
     try:
-        loop.run_forever()
-    except KeyboardInterrupt:
-        pass
+        loop.run_until_complete(stopping.wait())
     finally:
         encsend_server.stop()
         loop.run_until_complete(encsend_server.wait())
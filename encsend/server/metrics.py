@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import time
+from bisect import bisect_left
+from collections import OrderedDict, defaultdict
+
+# Upper bounds of latency histograms' buckets in seconds
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+                   0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+
+
+def format_labels(labels):
+    """ Format labels for Prometheus text format
+
+    :param labels: tuples with label's name and value
+    :type labels: tuple
+    :rtype: str
+    """
+    if not labels:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (name, value)
+                             for name, value in labels)
+
+
+class Counter:
+    """ Monotonically growing values, one per labels set """
+    type = 'counter'
+
+    def __init__(self):
+        self.values = defaultdict(float)
+
+    def inc(self, amount=1, **labels):
+        self.values[tuple(sorted(labels.items()))] += amount
+
+    def samples(self, name):
+        for labels, value in self.values.items():
+            yield name, labels, value
+
+
+class Histogram:
+    """ Distribution of observed values, one per labels set """
+    type = 'histogram'
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        # labels -> [bucket counts, sum]
+        self.values = {}
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        entry = self.values.get(key)
+        if entry is None:
+            entry = self.values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+        entry[0][bisect_left(self.buckets, value)] += 1
+        entry[1] += value
+
+    def time(self, **labels):
+        """ Context manager observing duration of the block in seconds """
+        return Timer(self, labels)
+
+    def samples(self, name):
+        for labels, (counts, total) in self.values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                yield (name + '_bucket', labels + (('le', bound),),
+                       cumulative)
+            yield name + '_sum', labels, total
+            yield name + '_count', labels, cumulative
+
+
+class Timer:
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.histogram.observe(time.perf_counter() - self.start,
+                               **self.labels)
+
+
+class Callback:
+    """ Values collected on rendering, `func` returns a dictionary
+    labels dictionary items tuple -> value or a single number
+    """
+    def __init__(self, type_, func):
+        self.type = type_
+        self.func = func
+
+    def samples(self, name):
+        values = self.func()
+        if not isinstance(values, dict):
+            values = {(): values}
+        for labels, value in values.items():
+            yield name, labels, value
+
+
+class Metrics:
+    """ Registry of named metrics rendered in Prometheus text format """
+    def __init__(self):
+        # name -> (help, metric)
+        self.metrics = OrderedDict()
+
+    def add(self, name, help_, metric):
+        self.metrics[name] = (help_, metric)
+        return metric
+
+    def counter(self, name, help_):
+        return self.add(name, help_, Counter())
+
+    def histogram(self, name, help_, buckets=LATENCY_BUCKETS):
+        return self.add(name, help_, Histogram(buckets))
+
+    def callback(self, name, help_, func, type_='gauge'):
+        return self.add(name, help_, Callback(type_, func))
+
+    def render(self):
+        """ Render all metrics
+
+        :return: metrics in Prometheus text exposition format
+        :rtype: str
+        """
+        lines = []
+        for name, (help_, metric) in self.metrics.items():
+            lines.append('# HELP %s %s' % (name, help_))
+            lines.append('# TYPE %s %s' % (name, metric.type))
+            for sample, labels, value in metric.samples(name):
+                lines.append('%s%s %s' % (sample, format_labels(labels),
+                                          repr(float(value))))
+        return '\n'.join(lines) + '\n'
+
+
+class ServerMetrics(Metrics):
+    """ Metrics of EncSend server """
+    def __init__(self):
+        super().__init__()
+        self.stages = self.histogram(
+            'encsend_stage_seconds',
+            'Latency of message processing stages: unseal (decrypting and '
+            'parsing), lookup, verify, insert (per batch), file_chunk'
+        )
+        self.pool_wait = self.histogram('encsend_db_pool_wait_seconds',
+                                        'Time waiting for db connection')
+        self.messages = self.counter('encsend_messages_total',
+                                     'Accepted messages')
+        self.received_bytes = self.counter('encsend_received_bytes_total',
+                                           'Received frames payload bytes')
+        self.rejected = self.counter('encsend_rejected_total',
+                                     'Rejected messages by reason')
+        self.acks = self.counter('encsend_acks_total',
+                                 'Sent acks by status')
+
+
+async def start_metrics_server(metrics, host, port):
+    """ Start minimal HTTP server returning metrics on any request
+
+    :param metrics: metrics registry
+    :type metrics: Metrics
+    :param host: metrics server host
+    :type host: str
+    :param port: metrics server port
+    :type port: int
+    :return: started server
+    :rtype: asyncio.AbstractServer
+    """
+    async def handle(reader, writer):
+        try:
+            # Skip request line and headers
+            while True:
+                line = await asyncio.wait_for(reader.readline(), 10)
+                if not line.strip():
+                    break
+            body = metrics.render().encode()
+            writer.write(b'HTTP/1.0 200 OK\r\n'
+                         b'Content-Type: text/plain; version=0.0.4\r\n'
+                         b'Content-Length: %d\r\n\r\n' % len(body) + body)
+            await writer.drain()
+        except (asyncio.TimeoutError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    return await asyncio.start_server(handle, host, port)
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+
+import time
+from collections import OrderedDict
+
+from nacl.encoding import HexEncoder
+from nacl.signing import VerifyKey
+
+
+class HostRegistry:
+    """ LRU cache of known hosts: verify key -> host's id and parsed
+    verify key
+
+    Only found hosts are cached, so hosts added to db are visible right
+    away, entries expire after `ttl` seconds to catch changed hosts
+    """
+    def __init__(self, size, ttl):
+        """
+        :param size: max number of cached hosts
+        :type size: int
+        :param ttl: seconds after which cached host is selected from db
+            again
+        :type ttl: float
+        """
+        self.size = size
+        self.ttl = ttl
+        # host_key -> (host_id, verify_key, expiration time)
+        self.hosts = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, host_key):
+        """ Get cached host
+
+        :param host_key: hex encoded host's verify key
+        :type host_key: str
+        :return: tuple with host's id and verify key or None if host
+            isn't cached or it's entry expired
+        :rtype: (int, nacl.signing.VerifyKey) or None
+        """
+        entry = self.hosts.get(host_key)
+        if entry is None or entry[2] < time.monotonic():
+            self.misses += 1
+            return
+        self.hosts.move_to_end(host_key)
+        self.hits += 1
+        return entry[0], entry[1]
+
+    def add(self, host_key, host_id):
+        """ Cache host
+
+        :param host_key: hex encoded host's verify key
+        :type host_key: str
+        :param host_id: host's internal id
+        :type host_id: int
+        :return: tuple with host's id and verify key
+        :rtype: (int, nacl.signing.VerifyKey)
+        """
+        verify_key = VerifyKey(host_key.encode(), encoder=HexEncoder)
+        self.hosts[host_key] = (host_id, verify_key,
+                                time.monotonic() + self.ttl)
+        self.hosts.move_to_end(host_key)
+        while len(self.hosts) > self.size:
+            self.hosts.popitem(last=False)
+        return host_id, verify_key
+
+    def load(self, rows):
+        """ Cache hosts selected from db
+
+        :param rows: tuples with host's id and hex encoded verify key
+        :type rows: iterable of (int, str)
+        """
+        for host_id, host_key in rows:
+            try:
+                self.add(host_key, host_id)
+            # Invalid key was added to db, such host can't send messages
+            except ValueError:
+                continue
+
+    def invalidate(self, host_key=None):
+        """ Drop cached host, drop all hosts if `host_key` is None
+
+        :param host_key: hex encoded host's verify key
+        :type host_key: str or None
+        """
+        if host_key is None:
+            self.hosts.clear()
+        else:
+            self.hosts.pop(host_key, None)
+
+    def stats(self):
+        """ Get cache counters
+
+        :return: dictionary with number of cached hosts, hits and misses
+        :rtype: dict
+        """
+        return {'size': len(self.hosts), 'hits': self.hits,
+                'misses': self.misses}
@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+
+import time
+
+from .crypto import REJECT_BUSY, REJECT_REPLAY, REJECT_STALE, Rejected
+
+# Number of time buckets the replay window is split into
+BUCKETS = 8
+
+
+class ReplayCache:
+    """ Ids of recently accepted messages, grouped in time buckets
+
+    Messages are accepted only if their send time is within `window`
+    seconds from server's time, so an id has to be remembered only until
+    it's message becomes stale, whole buckets of such ids are dropped at
+    once. Duplicates refresh the id, so a sender retrying the same
+    message keeps getting it rejected.
+
+    If the cache is full, new messages are rejected as busy until their
+    ids fit, the window is never shortened, so a burst of messages doesn't
+    make messages of other senders stale. Each sender may have at most
+    `host_size` ids, so a busy sender doesn't take the whole cache.
+    """
+    def __init__(self, window, size, host_size=None):
+        """
+        :param window: max difference in seconds between message's send
+            time and server's time
+        :type window: float
+        :param size: max number of remembered ids
+        :type size: int
+        :param host_size: max number of remembered ids of one sender,
+            None - `size`
+        :type host_size: int or None
+        """
+        self.window = window
+        self.size = size
+        self.host_size = size if host_size is None else host_size
+        self.span = max(window / BUCKETS, 1)
+        # bucket number -> set of keys expiring within the bucket's span
+        self.buckets = {}
+        # key -> bucket number
+        self.keys = {}
+        # sender's id -> number of it's keys
+        self.senders = {}
+
+    def __len__(self):
+        return len(self.keys)
+
+    def check(self, key, timestamp):
+        """ Check message without remembering it's id
+
+        :param key: sender's id and message id
+        :type key: (int, bytes)
+        :param timestamp: send time in milliseconds
+        :type timestamp: int
+        :raises Rejected: message is stale, it's id was seen or there is
+            no room for it
+        """
+        now = time.time()
+        self.expire(now)
+        sent = timestamp / 1000
+        if abs(now - sent) > self.window:
+            raise Rejected(REJECT_STALE)
+        bucket = self.keys.get(key)
+        if bucket is not None:
+            self.move(key, bucket, self.get_bucket(now, sent))
+            raise Rejected(REJECT_REPLAY)
+        if len(self.keys) >= self.size or \
+                self.senders.get(key[0], 0) >= self.host_size:
+            raise Rejected(REJECT_BUSY)
+
+    def add(self, key, timestamp):
+        """ Check message and remember it's id, see `check` """
+        self.check(key, timestamp)
+        bucket = self.get_bucket(time.time(), timestamp / 1000)
+        self.buckets.setdefault(bucket, set()).add(key)
+        self.keys[key] = bucket
+        self.senders[key[0]] = self.senders.get(key[0], 0) + 1
+
+    def discard(self, key):
+        """ Forget message id, e.g. the message wasn't saved and may be
+        sent again
+        """
+        bucket = self.keys.pop(key, None)
+        if bucket is not None:
+            self.buckets[bucket].discard(key)
+            self.release(key)
+
+    def get_bucket(self, now, sent):
+        # Id is remembered until a message with the same send time
+        # becomes stale, counting from the latest time it was seen
+        return int((max(now, sent) + self.window) // self.span)
+
+    def move(self, key, old, new):
+        if new <= old:
+            return
+        self.buckets[old].discard(key)
+        self.buckets.setdefault(new, set()).add(key)
+        self.keys[key] = new
+
+    def expire(self, now):
+        current = int(now // self.span)
+        for bucket in [b for b in self.buckets if b < current]:
+            for key in self.buckets.pop(bucket):
+                del self.keys[key]
+                self.release(key)
+
+    def release(self, key):
+        count = self.senders.pop(key[0]) - 1
+        if count:
+            self.senders[key[0]] = count
@@ -0,0 +1,331 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import json
+import logging
+import os
+from collections import deque, namedtuple
+from datetime import datetime
+from time import mktime
+
+from ..sql import INSERT, SELECT
+from ..utils import remove_stale_socket
+
+try:
+    from .. import conf
+except ImportError:
+    from .. import conf_default as conf
+finally:
+    SUBSCRIBE_BATCH_SIZE = conf.SUBSCRIBE_BATCH_SIZE
+    SUBSCRIBE_POLL_INTERVAL = conf.SUBSCRIBE_POLL_INTERVAL
+
+logger = logging.getLogger(__name__)
+
+# Max length of a consumer's request or ack line
+MAX_LINE_SIZE = 64 * 1024
+
+Message = namedtuple('Message', 'message_id message host_id datetime')
+
+
+def message_to_dict(message):
+    """ Get json serializable message, keys are the same as in
+    `message-ls --json` output
+    """
+    return dict(zip(('id', 'message', 'host_id', 'datetime'), message))
+
+
+class Subscription:
+    """ Received messages in order of their ids, as they are written to db
+
+    Messages after the subscription's cursor are read in batches. When
+    there are no new messages, the subscription waits until the server's
+    writer commits a batch or `poll_interval` passes, so messages
+    written by other processes, e.g. other server workers, are read too.
+
+    Cursor of a named consumer is kept in db. Messages are read after
+    the last acked id, so a restarted consumer resumes where it stopped
+    and gets messages it didn't ack again. Acks are saved before the
+    next batch is read and on close.
+    """
+    def __init__(self, db_pool, writer=None, consumer=None, after_id=None,
+                 batch_size=SUBSCRIBE_BATCH_SIZE,
+                 poll_interval=SUBSCRIBE_POLL_INTERVAL):
+        """
+        :param db_pool: aioodbc connections pool
+        :param writer: server's message writer notifying about commits,
+            if None - db is polled only
+        :type writer: encsend.server.writer.MessageWriter or None
+        :param consumer: consumer's name, None - anonymous subscription,
+            it's cursor isn't saved
+        :type consumer: str or None
+        :param after_id: read messages with bigger ids, if None - after
+            consumer's saved cursor, new and anonymous consumers get
+            messages received after subscribing
+        :type after_id: int or None
+        :param batch_size: max number of messages read from db at once
+        :type batch_size: int
+        :param poll_interval: max seconds between reads of db
+        :type poll_interval: float
+        """
+        self.db_pool = db_pool
+        self.writer = writer
+        self.consumer = consumer
+        self.after_id = after_id
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.buffer = deque()
+        self.event = asyncio.Event()
+        # The last acked id and the last id saved to db
+        self.acked = self.saved = None
+        self.started = False
+        self.closed = False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if not self.started:
+            await self.start()
+        while not self.buffer:
+            if self.closed:
+                raise StopAsyncIteration
+            # Commits made while reading are noticed by the next wait
+            self.event.clear()
+            await self.fetch()
+            if self.closed:
+                raise StopAsyncIteration
+            if self.buffer:
+                break
+            try:
+                await asyncio.wait_for(self.event.wait(), self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+        message = self.buffer.popleft()
+        self.after_id = message.message_id
+        return message
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    async def start(self):
+        """ Start listening commits, find the first message to read """
+        if self.started:
+            return
+        self.started = True
+        if self.writer is not None:
+            self.writer.listeners.add(self.event)
+        if self.after_id is None and self.consumer is not None:
+            self.after_id = await self.fetch_value(SELECT['consumers'],
+                                                   (self.consumer,))
+        if self.after_id is None:
+            last_id = await self.fetch_value(SELECT['messages-last-id'])
+            self.after_id = last_id or 0
+
+    async def fetch(self):
+        """ Save consumer's cursor and read the next batch of messages """
+        await self.save_cursor()
+        async with self.db_pool.acquire() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(SELECT['messages-after'],
+                                  (self.after_id, self.batch_size))
+                rows = await cur.fetchall()
+        self.buffer.extend(Message(*row) for row in rows)
+
+    async def fetch_value(self, query, params=()):
+        async with self.db_pool.acquire() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(query, params)
+                row = await cur.fetchone()
+        return row[0] if row is not None else None
+
+    def ack(self, message_id):
+        """ Mark message and all messages before it as processed, the
+        cursor is saved later
+
+        :param message_id: id of processed message
+        :type message_id: int
+        """
+        if self.acked is None or message_id > self.acked:
+            self.acked = message_id
+
+    async def save_cursor(self):
+        """ Save named consumer's last acked id """
+        if self.consumer is None or self.acked is None or \
+                self.acked == self.saved:
+            return
+        acked = self.acked
+        # unix timestamp
+        now = mktime(datetime.now().utctimetuple())
+        async with self.db_pool.acquire() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(INSERT['consumers-upsert'],
+                                  (self.consumer, acked, now))
+            await conn.commit()
+        self.saved = acked
+
+    def stop(self):
+        """ Stop iteration, messages already read from db aren't
+        returned, the cursor isn't saved
+        """
+        self.closed = True
+        self.buffer.clear()
+        self.event.set()
+        if self.writer is not None:
+            self.writer.listeners.discard(self.event)
+
+    async def close(self):
+        """ Stop iteration and save consumer's cursor """
+        self.stop()
+        if self.started:
+            await self.save_cursor()
+
+
+class OutputStream:
+    """ Write messages of a subscription to a file as json lines, every
+    message is acked after it's line is flushed
+    """
+    def __init__(self, loop, subscription, file):
+        """
+        :param loop: asyncio event loop
+        :param subscription: messages to write
+        :type subscription: Subscription
+        :param file: text file, e.g. `sys.stdout`
+        """
+        self.loop = loop
+        self.subscription = subscription
+        self.file = file
+        self.task = None
+
+    async def start(self):
+        self.task = self.loop.create_task(self.run())
+
+    async def run(self):
+        try:
+            async for message in self.subscription:
+                line = json.dumps(message_to_dict(message)) + '\n'
+                # A slow reader of the file blocks this task only
+                await self.loop.run_in_executor(None, self.write, line)
+                self.subscription.ack(message.message_id)
+        except OSError as e:
+            logger.error('stopped writing messages: %s', e)
+
+    def write(self, line):
+        self.file.write(line)
+        self.file.flush()
+
+    async def close(self):
+        # The last written message is acked before the cursor is saved
+        self.subscription.stop()
+        if self.task is not None:
+            await self.task
+        await self.subscription.close()
+
+
+class StreamServer:
+    """ Unix socket pushing received messages to connected consumers
+
+    A consumer sends a json line with optional `consumer` name and
+    `after_id`, see `Subscription`, and gets a json line for every
+    message. It sends `{"ack": message_id}` lines back, acks of named
+    consumers are saved as their cursors. The socket is accessible by
+    it's owner only.
+    """
+    def __init__(self, loop, subscribe, path):
+        """
+        :param loop: asyncio event loop
+        :param subscribe: function getting consumer's name and `after_id`
+            and returning a subscription
+        :param path: path to the socket
+        :type path: str
+        """
+        self.loop = loop
+        self.subscribe = subscribe
+        self.path = path
+        self.server = None
+        # Subscriptions of connected consumers -> connection's writer
+        self.subscriptions = {}
+        self.tasks = set()
+
+    async def start(self):
+        remove_stale_socket(self.path)
+        # Socket file is created with permissions allowed by umask
+        umask = os.umask(0o177)
+        try:
+            self.server = await asyncio.start_unix_server(
+                self.handle_connection, self.path, limit=MAX_LINE_SIZE
+            )
+        finally:
+            os.umask(umask)
+
+    def handle_connection(self, reader, writer):
+        task = self.loop.create_task(self.serve(reader, writer))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def serve(self, reader, writer):
+        """ Push messages to a consumer until it disconnects """
+        try:
+            request = json.loads(await reader.readline())
+            consumer = request.get('consumer')
+            after_id = request.get('after_id')
+            if not isinstance(consumer, (str, type(None))) or \
+                    not isinstance(after_id, (int, type(None))):
+                raise ValueError
+        except (ConnectionError, ValueError, AttributeError):
+            # ValueError - invalid json or the line is too long,
+            # AttributeError - request isn't an object
+            writer.close()
+            return
+
+        subscription = self.subscribe(consumer, after_id)
+        self.subscriptions[subscription] = writer
+        acks = self.loop.create_task(self.read_acks(reader, subscription))
+        try:
+            async for message in subscription:
+                line = json.dumps(message_to_dict(message)) + '\n'
+                writer.write(line.encode())
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            acks.cancel()
+            await subscription.close()
+            del self.subscriptions[subscription]
+            writer.close()
+
+    async def read_acks(self, reader, subscription):
+        """ Read consumer's acks until it disconnects """
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    message_id = json.loads(line)['ack']
+                except (ValueError, KeyError, TypeError):
+                    continue
+                if isinstance(message_id, int):
+                    subscription.ack(message_id)
+        except (ConnectionError, ValueError):
+            pass
+        # Stop pushing messages to disconnected consumer
+        subscription.stop()
+
+    async def close(self):
+        """ Disconnect consumers and save their cursors """
+        self.server.close()
+        # Closed writer stops waiting for a slow consumer
+        for subscription, writer in self.subscriptions.items():
+            subscription.stop()
+            writer.close()
+        if self.tasks:
+            await asyncio.wait(list(self.tasks))
+        await self.server.wait_closed()
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
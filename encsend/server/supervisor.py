@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+
+import multiprocessing
+import os
+import signal
+import time
+
+# Seconds between checks of workers' state
+POLL_INTERVAL = 0.5
+# Worker which died sooner than this number of seconds after start is
+# considered crashing on startup, it is restarted after a delay
+MIN_UPTIME = 1
+RESTART_DELAY = 5
+# Seconds to wait for workers after SIGTERM before killing them
+STOP_TIMEOUT = 10
+
+
+class Supervisor:
+    """ Run a number of worker processes, restart crashed workers
+
+    Worker's slot number is passed to `target` as `worker` keyword
+    argument. SIGHUP is forwarded to workers.
+    """
+    def __init__(self, workers, target, kwargs, reload=None):
+        """
+        :param workers: number of worker processes
+        :type workers: int
+        :param target: worker's function
+        :type target: callable
+        :param kwargs: keyword arguments for `target`
+        :type kwargs: dict
+        :param reload: called on SIGHUP before the signal is forwarded,
+            so workers started later get the same state
+        :type reload: callable or None
+        """
+        self.workers = workers
+        self.target = target
+        self.kwargs = kwargs
+        self.reload = reload
+        # Worker's slot -> (process, start time)
+        self.processes = {}
+        # Worker's slot -> time when it should be restarted
+        self.restart_at = {}
+        self.stopping = False
+        self.pid = None
+
+    def start_worker(self, slot):
+        process = multiprocessing.Process(target=self.target,
+                                          kwargs=dict(self.kwargs,
+                                                      worker=slot),
+                                          name='encsend-worker-%d' % slot)
+        process.start()
+        self.processes[slot] = (process, time.monotonic())
+
+    def check_workers(self):
+        """ Start workers which died and should be restarted """
+        now = time.monotonic()
+        for slot in range(self.workers):
+            if slot in self.restart_at:
+                if now >= self.restart_at[slot]:
+                    del self.restart_at[slot]
+                    self.start_worker(slot)
+                continue
+
+            process, started = self.processes[slot]
+            if process.is_alive():
+                continue
+            process.join()
+            if now - started < MIN_UPTIME:
+                self.restart_at[slot] = now + RESTART_DELAY
+            else:
+                self.start_worker(slot)
+
+    def handle_signal(self, signum, frame):
+        self.stopping = True
+
+    def handle_reload(self, signum, frame):
+        # Workers inherit the handler until they set their own
+        if os.getpid() != self.pid:
+            return
+        if self.reload is not None:
+            self.reload()
+        for process, _ in self.processes.values():
+            if process.is_alive():
+                os.kill(process.pid, signal.SIGHUP)
+
+    def run(self):
+        """ Start workers and watch them until SIGTERM or SIGINT """
+        self.pid = os.getpid()
+        signal.signal(signal.SIGTERM, self.handle_signal)
+        signal.signal(signal.SIGINT, self.handle_signal)
+        signal.signal(signal.SIGHUP, self.handle_reload)
+        for slot in range(self.workers):
+            self.start_worker(slot)
+
+        while not self.stopping:
+            time.sleep(POLL_INTERVAL)
+            if not self.stopping:
+                self.check_workers()
+        self.stop()
+
+    def stop(self):
+        """ Ask workers to shut down gracefully, kill them on timeout """
+        processes = [process for process, _ in self.processes.values()]
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+
+        deadline = time.monotonic() + STOP_TIMEOUT
+        for process in processes:
+            process.join(max(deadline - time.monotonic(), 0))
+            if process.is_alive():
+                process.kill()
+                process.join()
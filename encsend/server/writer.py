@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import logging
+import time
+
+from ..sql import INSERT
+
+logger = logging.getLogger(__name__)
+
+
+class MessageWriter:
+    """ Write-behind queue of incoming messages
+
+    Messages are inserted in batches with `executemany` in a single
+    transaction. A batch is written when `batch_size` messages are
+    queued or `flush_interval` seconds passed since the first message
+    of the batch was queued. When the queue is full, `put` waits, so
+    connections stop reading new messages until db catches up. Waiters
+    passed to `put` are resolved and listeners' events are set after the
+    batch is committed.
+    """
+    def __init__(self, loop, db_pool, batch_size, flush_interval, queue_size,
+                 metrics=None):
+        """
+        :param loop: asyncio event loop
+        :param db_pool: aioodbc connections pool
+        :param batch_size: max number of messages in one transaction
+        :type batch_size: int
+        :param flush_interval: max delay of queued message in seconds
+        :type flush_interval: float
+        :param queue_size: max number of queued messages
+        :type queue_size: int
+        :param metrics: server's metrics for recording insert latency
+        :type metrics: encsend.server.metrics.ServerMetrics or None
+        """
+        self.loop = loop
+        self.db_pool = db_pool
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.metrics = metrics
+        self.wakeup = asyncio.Event()
+        # Events set after every commit, e.g. by subscriptions
+        self.listeners = set()
+        self.task = None
+
+    def start(self):
+        self.task = self.loop.create_task(self.run())
+
+    async def put(self, values, waiter=None):
+        """ Queue message for writing, wait if the queue is full
+
+        :param values: values for `INSERT['messages']`
+        :type values: tuple
+        :param waiter: future, it's result is set to None after the
+            message is written, it gets the exception if writing failed
+        :type waiter: asyncio.Future or None
+        """
+        await self.queue.put((values, waiter))
+        if self.queue.qsize() >= self.batch_size:
+            self.wakeup.set()
+
+    async def run(self):
+        while True:
+            batch = await self.collect()
+            error = None
+            try:
+                await self.write([values for values, _ in batch])
+            except Exception as e:
+                logger.exception('failed to write %d messages', len(batch))
+                error = e
+            else:
+                for event in self.listeners:
+                    event.set()
+            finally:
+                for _, waiter in batch:
+                    if waiter is not None and not waiter.done():
+                        if error is None:
+                            waiter.set_result(None)
+                        else:
+                            waiter.set_exception(error)
+                    self.queue.task_done()
+
+    async def collect(self):
+        """ Wait for a batch of messages
+
+        :return: list of tuples with values for `INSERT['messages']` and
+            waiter
+        :rtype: list
+        """
+        batch = [await self.queue.get()]
+        deadline = self.loop.time() + self.flush_interval
+        while True:
+            while len(batch) < self.batch_size and not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+            timeout = deadline - self.loop.time()
+            if len(batch) >= self.batch_size or timeout <= 0:
+                return batch
+
+            self.wakeup.clear()
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def write(self, batch):
+        """ Insert messages in a single transaction
+
+        :param batch: list of values for `INSERT['messages']`
+        :type batch: list
+        """
+        start = time.perf_counter()
+        async with self.db_pool.acquire() as conn:
+            acquired = time.perf_counter()
+            try:
+                async with conn.cursor() as cur:
+                    await cur.executemany(INSERT['messages'], batch)
+                await conn.commit()
+            except Exception:
+                await conn.rollback()
+                raise
+        if self.metrics is not None:
+            self.metrics.pool_wait.observe(acquired - start)
+            self.metrics.stages.observe(time.perf_counter() - acquired,
+                                        stage='insert')
+
+    async def close(self):
+        """ Write queued messages and stop """
+        if self.task is None:
+            return
+        await self.queue.join()
+        self.task.cancel()
+        try:
+            await self.task
+        except asyncio.CancelledError:
+            pass
+        self.task = None
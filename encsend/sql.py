@@ -1,6 +1,13 @@
 # -*- coding: utf-8 -*-
 
 CREATE = {
+    'schema-version': """
+CREATE TABLE IF NOT EXISTS schema_version_t (
+    version INTEGER PRIMARY KEY,
+    applied INTEGER
+)
+""",
+
     'messages': """
 CREATE TABLE IF NOT EXISTS messages_t (
     message_id INTEGER PRIMARY KEY,
@@ -17,22 +24,102 @@ CREATE TABLE IF NOT EXISTS hosts_t (
     host TEXT,
     port INTEGER
 )
+""",
+
+    'files': """
+CREATE TABLE IF NOT EXISTS files_t (
+    file_id INTEGER PRIMARY KEY,
+    name TEXT,
+    path TEXT,
+    size INTEGER,
+    host_id INTEGER,
+    datetime INTEGER
+)
+""",
+
+    'messages-host-index': """
+CREATE INDEX IF NOT EXISTS messages_host_idx ON messages_t (host_id)
+""",
+
+    'messages-datetime-index': """
+CREATE INDEX IF NOT EXISTS messages_datetime_idx ON messages_t (datetime)
+""",
+
+    'outbox': """
+CREATE TABLE IF NOT EXISTS outbox_t (
+    outbox_id INTEGER PRIMARY KEY,
+    message TEXT,
+    host_id INTEGER,
+    datetime INTEGER
+)
+""",
+
+    'outbox-host-index': """
+CREATE INDEX IF NOT EXISTS outbox_host_idx ON outbox_t (host_id, outbox_id)
+""",
+
+    'consumers': """
+CREATE TABLE IF NOT EXISTS consumers_t (
+    consumer TEXT PRIMARY KEY,
+    message_id INTEGER,
+    datetime INTEGER
+)
 """
 }
 
 INSERT = {
+    'schema-version': """
+INSERT INTO schema_version_t (version, applied) VALUES(?, ?)
+""",
+
     'messages': """
 INSERT INTO messages_t (message, host_id, datetime) VALUES(?, ?, ?)
 """,
 
     'hosts': """
 INSERT INTO hosts_t (host_key, host, port) VALUES(?, ?, ?)
+""",
+
+    'hosts-upsert': """
+INSERT INTO hosts_t (host_key, host, port) VALUES(?, ?, ?)
+ON CONFLICT (host_key) DO UPDATE SET host = excluded.host,
+    port = excluded.port
+""",
+
+    'hosts-new': """
+INSERT INTO hosts_t (host_key, host, port) VALUES(?, ?, ?)
+ON CONFLICT (host_key) DO NOTHING
+""",
+
+    'files': """
+INSERT INTO files_t (name, path, size, host_id, datetime) VALUES(?, ?, ?, ?, ?)
+""",
+
+    'outbox': """
+INSERT INTO outbox_t (message, host_id, datetime, message_uid)
+VALUES(?, ?, ?, ?)
+""",
+
+    # Cursor never moves back, e.g. when an older ack is saved late
+    'consumers-upsert': """
+INSERT INTO consumers_t (consumer, message_id, datetime) VALUES(?, ?, ?)
+ON CONFLICT (consumer) DO UPDATE SET message_id = excluded.message_id,
+    datetime = excluded.datetime
+WHERE excluded.message_id > consumers_t.message_id
 """
 }
 
 SELECT = {
+    'schema-version': """
+SELECT MAX(version) FROM schema_version_t
+""",
+
     'hosts': """
 SELECT host_id FROM hosts_t WHERE host_key = ?
+""",
+
+    'hosts-keys': """
+SELECT host_id, host_key FROM hosts_t
 """,
 
     'hosts-ls': """
@@ -45,10 +132,70 @@ SELECT host_key, host, port FROM hosts_t WHERE host_id = ?
 
     'hosts-key': """
 SELECT host, port FROM hosts_t WHERE host_key = ?
+""",
+
+    # Template, placeholders lists for `keys` and `ids` should be
+    # formatted in before executing, see `in_params`
+    'hosts-many': """
+SELECT host_id, host_key, host, port FROM hosts_t
+WHERE host_key IN ({keys}) OR host_id IN ({ids})
 """,
 
     'messages': """
 SELECT message_id, message, host_id, datetime FROM messages_t
+""",
+
+    # Template, `where` should be formatted in before executing, see
+    # `messages_filter`
+    'messages-filter': """
+SELECT message_id, message, host_id, datetime FROM messages_t {where}
+ORDER BY message_id
+""",
+
+    'messages-after': """
+SELECT message_id, message, host_id, datetime FROM messages_t
+WHERE message_id > ? ORDER BY message_id LIMIT ?
+""",
+
+    'messages-last-id': """
+SELECT MAX(message_id) FROM messages_t
+""",
+
+    'files': """
+SELECT file_id, name, path, size, host_id, datetime FROM files_t
+""",
+
+    'outbox-hosts': """
+SELECT DISTINCT host_id FROM outbox_t
+""",
+
+    'outbox-host': """
+SELECT outbox_id, message, message_uid FROM outbox_t WHERE host_id = ?
+ORDER BY outbox_id LIMIT ?
+""",
+
+    'outbox-count': """
+SELECT host_id, COUNT(*) FROM outbox_t GROUP BY host_id
+""",
+
+    'consumers': """
+SELECT message_id FROM consumers_t WHERE consumer = ?
+""",
+
+    'consumers-ls': """
+SELECT consumer, message_id, datetime FROM consumers_t ORDER BY consumer
+"""
+}
+
+ALTER = {
+    'outbox-uid': """
+ALTER TABLE outbox_t ADD COLUMN message_uid TEXT
+"""
+}
+
+UPDATE = {
+    'hosts-address': """
+UPDATE hosts_t SET host = ?, port = ? WHERE host_key = ?
 """
 }
 
@@ -58,5 +205,61 @@ DELETE FROM messages_t WHERE message_id = ?
 """,
     'messages-all': """
 DELETE FROM messages_t
+""",
+    # Template, see `messages_filter`
+    'messages-filter': """
+DELETE FROM messages_t {where}
+""",
+    # Template, see `in_params`
+    'outbox-many': """
+DELETE FROM outbox_t WHERE outbox_id IN ({ids})
+""",
+
+    'consumers': """
+DELETE FROM consumers_t WHERE consumer = ?
 """
 }
+
+
+def in_params(count):
+    """ Get placeholders list for `IN (...)` clause
+
+    :param count: number of values
+    :type count: int
+    :return: comma separated placeholders, `NULL` if there are no values
+    :rtype: str
+    """
+    if not count:
+        return 'NULL'
+    return ', '.join('?' * count)
+
+
+def messages_filter(since=None, until=None, host_id=None, after_id=None):
+    """ Get `WHERE` clause and it's parameters for filtering messages,
+    None values are not used for filtering
+
+    :param since: min message's unix timestamp, inclusive
+    :type since: int or None
+    :param until: max message's unix timestamp, exclusive
+    :type until: int or None
+    :param host_id: sender's id
+    :type host_id: int or None
+    :param after_id: return messages with bigger id, for keyset
+        pagination
+    :type after_id: int or None
+    :return: `WHERE` clause, empty if there are no filters, and tuple
+        of parameters
+    :rtype: (str, tuple)
+    """
+    conditions = []
+    params = []
+    for condition, value in (('datetime >= ?', since),
+                             ('datetime < ?', until),
+                             ('host_id = ?', host_id),
+                             ('message_id > ?', after_id)):
+        if value is not None:
+            conditions.append(condition)
+            params.append(value)
+    if not conditions:
+        return '', ()
+    return 'WHERE ' + ' AND '.join(conditions), tuple(params)
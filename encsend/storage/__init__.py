@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+
+import os
+from importlib import import_module
+
+# DSN scheme -> backend's module, DSN without a known scheme is passed
+# to ODBC driver manager. Modules are imported on first use, so pyodbc
+# isn't loaded when it isn't needed
+BACKENDS = {
+    'sqlite': 'sqlite',
+    'memory': 'sqlite'
+}
+DEFAULT_BACKEND = 'odbc'
+
+
+def get_backend(dsn):
+    """ Get storage backend's module for DSN
+
+    Every backend has `connect(dsn)` returning a connection with pyodbc
+    interface and coroutine `create_pool(dsn, **kwargs)` returning a pool
+    with aioodbc interface, queries from `encsend.sql` work with all
+    of them
+
+    :param dsn: Data Source Name, `sqlite:path/to/db` - sqlite3 from
+        the standard library, `memory:name` - in-memory sqlite3 db shared
+        within the process, otherwise - ODBC connection string
+    :type dsn: str
+    :return: backend's module
+    """
+    scheme = dsn.partition(':')[0].lower() if ':' in dsn else None
+    name = BACKENDS.get(scheme, DEFAULT_BACKEND)
+    return import_module('.' + name, __name__)
+
+
+def normalize_dsn(dsn):
+    """ Get DSN referring to the same db from any working directory, so
+    DSNs of different processes can be compared. Relative paths of
+    `sqlite:` DSNs are made absolute, other DSNs are returned as is.
+    Backends aren't imported
+
+    :param dsn: Data Source Name
+    :type dsn: str
+    :rtype: str
+    """
+    scheme, sep, path = dsn.partition(':')
+    if not sep or scheme.lower() != 'sqlite':
+        return dsn
+    if path.startswith('//'):
+        path = path[2:]
+    return 'sqlite:' + os.path.abspath(path)
+
+
+def connect(dsn):
+    """ Open synchronous connection, see `get_backend` for DSN format """
+    return get_backend(dsn).connect(dsn)
+
+
+async def create_pool(dsn, **kwargs):
+    """ Create connections pool, see `get_backend` for DSN format """
+    return await get_backend(dsn).create_pool(dsn, **kwargs)
@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+
+import re
+
+import pyodbc
+
+try:
+    from .. import conf
+except ImportError:
+    from .. import conf_default as conf
+finally:
+    SQLITE_PRAGMAS = conf.SQLITE_PRAGMAS
+
+SQLITE_DRIVER = re.compile(r'(^|;)\s*driver\s*=\s*\{?[^;]*sqlite', re.I)
+
+
+def is_sqlite(dsn):
+    """ Check if DSN uses SQLite ODBC driver
+
+    :param dsn: Data Source Name
+    :type dsn: str
+    :rtype: bool
+    """
+    return dsn is not None and SQLITE_DRIVER.search(dsn) is not None
+
+
+def apply_profile(conn, dsn, pragmas=SQLITE_PRAGMAS):
+    """ Apply performance profile to a new connection, only SQLite
+    connections are tuned
+
+    :param conn: pyodbc connection
+    :param dsn: Data Source Name the connection was opened with
+    :type dsn: str
+    :param pragmas: tuples with pragma's name and value
+    :type pragmas: tuple
+    """
+    if not pragmas or not is_sqlite(dsn):
+        return
+    # journal_mode can't be changed inside a transaction
+    autocommit = conn.autocommit
+    conn.autocommit = True
+    try:
+        cur = conn.cursor()
+        for name, value in pragmas:
+            cur.execute('PRAGMA %s = %s' % (name, value))
+        cur.close()
+    finally:
+        conn.autocommit = autocommit
+
+
+def connect(dsn, **kwargs):
+    """ Open pyodbc connection with performance profile applied
+
+    :param dsn: Data Source Name
+    :type dsn: str
+    :return: pyodbc connection
+    """
+    conn = pyodbc.connect(dsn, **kwargs)
+    try:
+        apply_profile(conn, dsn)
+    except pyodbc.Error:
+        conn.close()
+        raise
+    return conn
+
+
+async def create_pool(dsn, **kwargs):
+    """ Create aioodbc connections pool, performance profile is
+    applied to every new connection
+
+    :param dsn: Data Source Name
+    :type dsn: str
+    :return: aioodbc connections pool
+    """
+    # aioodbc loads asyncio, commands using `connect` only don't need it
+    import aioodbc
+
+    async def after_created(conn):
+        apply_profile(conn, dsn)
+
+    return await aioodbc.create_pool(dsn=dsn, after_created=after_created,
+                                     **kwargs)
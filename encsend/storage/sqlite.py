@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+
+import sqlite3
+
+try:
+    from .. import conf
+except ImportError:
+    from .. import conf_default as conf
+finally:
+    SQLITE_PRAGMAS = conf.SQLITE_PRAGMAS
+
+# Seconds to wait for a locked db, same as `busy_timeout` pragma
+TIMEOUT = 5
+# In-memory databases are shared by all connections of the process and
+# live until the process exits. name -> connection keeping db open
+_memory_databases = {}
+
+
+def parse_dsn(dsn):
+    """ Get database for `sqlite3.connect` from DSN
+
+    `sqlite:path/to/db`, `sqlite:///abs/path/to/db` - file database,
+    `memory:` or `memory:name` - in-memory database
+
+    :param dsn: Data Source Name
+    :type dsn: str
+    :return: tuple with database and uri flag
+    :rtype: (str, bool)
+    """
+    scheme, _, path = dsn.partition(':')
+    if path.startswith('//'):
+        path = path[2:]
+    if scheme == 'memory':
+        name = path or 'default'
+        return 'file:encsend-%s?mode=memory&cache=shared' % name, True
+    return path, False
+
+
+def open_connection(dsn, pragmas=SQLITE_PRAGMAS):
+    """ Open sqlite3 connection with performance profile applied
+
+    :param dsn: Data Source Name
+    :type dsn: str
+    :param pragmas: tuples with pragma's name and value
+    :type pragmas: tuple
+    :rtype: sqlite3.Connection
+    """
+    database, uri = parse_dsn(dsn)
+    if uri and database not in _memory_databases:
+        _memory_databases[database] = sqlite3.connect(
+            database, uri=True, check_same_thread=False
+        )
+    conn = sqlite3.connect(database, timeout=TIMEOUT, uri=uri,
+                           check_same_thread=False)
+    try:
+        for name, value in pragmas:
+            conn.execute('PRAGMA %s = %s' % (name, value)).close()
+    except sqlite3.Error:
+        conn.close()
+        raise
+    return conn
+
+
+def connect(dsn):
+    """ Open sqlite3 connection, it has the same interface as pyodbc's one
+
+    :param dsn: Data Source Name
+    :type dsn: str
+    :rtype: sqlite3.Connection
+    """
+    return open_connection(dsn)
+
+
+async def create_pool(dsn, maxsize=10, **kwargs):
+    """ Create pool of sqlite3 connections, the pool lives in a separate
+    module, so commands using `connect` only don't load asyncio
+
+    :param dsn: Data Source Name
+    :type dsn: str
+    :param maxsize: max number of open connections
+    :type maxsize: int
+    :rtype: encsend.storage.sqlite_pool.Pool
+    """
+    from .sqlite_pool import Pool
+    return Pool(dsn, maxsize)
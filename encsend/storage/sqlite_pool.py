@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from .sqlite import open_connection
+
+
+class Cursor:
+    """ aioodbc compatible cursor running queries in connection's thread """
+    def __init__(self, connection, cursor):
+        self.connection = connection
+        self.cursor = cursor
+
+    @property
+    def rowcount(self):
+        return self.cursor.rowcount
+
+    async def execute(self, query, params=()):
+        await self.connection.run(self.cursor.execute, query, params)
+        return self
+
+    async def executemany(self, query, params):
+        await self.connection.run(self.cursor.executemany, query, params)
+
+    async def fetchone(self):
+        return await self.connection.run(self.cursor.fetchone)
+
+    async def fetchmany(self, size):
+        return await self.connection.run(self.cursor.fetchmany, size)
+
+    async def fetchall(self):
+        return await self.connection.run(self.cursor.fetchall)
+
+    async def close(self):
+        await self.connection.run(self.cursor.close)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+
+class CursorContext:
+    """ Result of `Connection.cursor`, may be awaited or used as async
+    context manager
+    """
+    def __init__(self, connection):
+        self.connection = connection
+        self.cursor = None
+
+    def __await__(self):
+        return self.connection.open_cursor().__await__()
+
+    async def __aenter__(self):
+        self.cursor = await self.connection.open_cursor()
+        return self.cursor
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.cursor.close()
+
+
+class Connection:
+    """ aioodbc compatible connection, sqlite3 calls are run in
+    connection's own thread, so the event loop isn't blocked
+    """
+    def __init__(self, dsn):
+        self.dsn = dsn
+        self.conn = None
+        self.executor = ThreadPoolExecutor(max_workers=1)
+
+    async def run(self, func, *args):
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(self.executor, partial(func, *args))
+
+    async def connect(self):
+        self.conn = await self.run(open_connection, self.dsn)
+
+    async def open_cursor(self):
+        return Cursor(self, await self.run(self.conn.cursor))
+
+    def cursor(self):
+        return CursorContext(self)
+
+    async def execute(self, query, params=()):
+        cursor = await self.open_cursor()
+        return await cursor.execute(query, params)
+
+    async def commit(self):
+        await self.run(self.conn.commit)
+
+    async def rollback(self):
+        await self.run(self.conn.rollback)
+
+    async def close(self):
+        await self.run(self.conn.close)
+        self.executor.shutdown(wait=False)
+
+
+class AcquireContext:
+    def __init__(self, pool):
+        self.pool = pool
+        self.conn = None
+
+    def __await__(self):
+        return self.pool.get().__await__()
+
+    async def __aenter__(self):
+        self.conn = await self.pool.get()
+        return self.conn
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.pool.release(self.conn)
+
+
+class Pool:
+    """ aioodbc compatible pool of sqlite3 connections """
+    def __init__(self, dsn, maxsize):
+        """
+        :param dsn: Data Source Name
+        :type dsn: str
+        :param maxsize: max number of open connections
+        :type maxsize: int
+        """
+        self.dsn = dsn
+        self.maxsize = maxsize
+        self.free = deque()
+        self.size = 0
+        self.released = asyncio.Condition()
+        self.closed = False
+
+    def acquire(self):
+        return AcquireContext(self)
+
+    async def get(self):
+        async with self.released:
+            while not self.free and self.size >= self.maxsize:
+                await self.released.wait()
+            if self.free:
+                return self.free.popleft()
+            self.size += 1
+
+        conn = Connection(self.dsn)
+        try:
+            await conn.connect()
+        except Exception:
+            async with self.released:
+                self.size -= 1
+                self.released.notify()
+            raise
+        return conn
+
+    async def release(self, conn):
+        # Don't return a connection with unfinished transaction
+        if conn.conn.in_transaction:
+            await conn.rollback()
+        if self.closed:
+            await conn.close()
+            self.size -= 1
+            return
+        async with self.released:
+            self.free.append(conn)
+            self.released.notify()
+
+    def close(self):
+        self.closed = True
+
+    async def wait_closed(self):
+        while self.free:
+            await self.free.popleft().close()
+            self.size -= 1
@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+
+import json
+import socket
+
+
+class StreamClient:
+    """ Consumer of messages pushed by server's stream socket, see
+    `encsend.server.subscriptions.StreamServer`
+
+    Iterating the client returns messages as dictionaries with `id`,
+    `message`, `host_id` and `datetime` until the server closes the
+    connection. A named consumer acks processed messages, so after
+    reconnecting it gets messages after the last acked one.
+    """
+    def __init__(self, socket_path, consumer=None, after_id=None):
+        """
+        :param socket_path: path to server's stream socket
+        :type socket_path: str
+        :param consumer: consumer's name, None - anonymous consumer
+        :type consumer: str or None
+        :param after_id: get messages with bigger ids, if None - after
+            consumer's cursor or after the last received message
+        :type after_id: int or None
+        :raises FileNotFoundError, ConnectionRefusedError: server doesn't
+            listen the socket
+        """
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            self.sock.connect(socket_path)
+            self.send({'consumer': consumer, 'after_id': after_id})
+        except OSError:
+            self.sock.close()
+            raise
+        self.file = self.sock.makefile('rb')
+
+    def __iter__(self):
+        for line in self.file:
+            yield json.loads(line)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def send(self, dct):
+        self.sock.sendall(json.dumps(dct).encode() + b'\n')
+
+    def ack(self, message_id):
+        """ Mark message and all messages before it as processed
+
+        :param message_id: message's id
+        :type message_id: int
+        """
+        self.send({'ack': message_id})
+
+    def close(self):
+        self.file.close()
+        self.sock.close()
@@ -1,6 +1,7 @@
 # -*- coding: utf-8 -*-
 
 import os
+import socket
 
 from nacl.encoding import HexEncoder
 from nacl.signing import SigningKey
@@ -29,6 +30,47 @@ def get_config_dir(make_dir=False):
     return path
 
 
+def get_files_dir(make_dir=False):
+    """ Get path to directory with received files.
+    If `$XDG_DATA_HOME` is set, use `${XDG_DATA_HOME}/encsend/files`,
+    otherwise - `~/.local/share/encsend/files`.
+
+    :param make_dir: make the directory if it doesn't exist
+    :type make_dir: bool
+    :return: path to directory with received files
+    :rtype: str
+    """
+    _evar = 'XDG_DATA_HOME'
+    if _evar in os.environ and os.environ[_evar]:
+        path = os.path.join(os.environ[_evar], 'encsend', 'files')
+    else:
+        path = os.path.join(os.path.expanduser('~'), '.local', 'share',
+                            'encsend', 'files')
+
+    if make_dir:
+        os.makedirs(path, exist_ok=True)
+
+    return path
+
+
+def remove_stale_socket(path):
+    """ Remove Unix socket left by crashed process
+
+    :param path: path to the socket
+    :type path: str
+    :raises RuntimeError: another process listens the socket
+    """
+    if not os.path.exists(path):
+        return
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        try:
+            sock.connect(path)
+        except ConnectionRefusedError:
+            os.unlink(path)
+            return
+    raise RuntimeError('socket is already in use: %s' % path)
+
+
 def get_signing_key_path(make_dir=False):
     """ Get default path to signing key
 
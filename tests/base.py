@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import os
+import shutil
+import socket
+import tempfile
+import time
+import unittest
+
+from nacl.signing import SigningKey
+
+from encsend.migrations import migrate
+from encsend.server.main import EncSendServer
+from encsend.sql import INSERT
+from encsend.storage import connect
+
+
+def get_free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+class ServerTestCase(unittest.TestCase):
+    """ Server on a free port with sqlite db, the server's host is it's
+    own only known host, so it sends messages to itself
+    """
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.key_path = os.path.join(self.dir, 'host_signature')
+        signing_key = SigningKey.generate()
+        with open(self.key_path, 'wb') as f:
+            f.write(bytes(signing_key))
+        self.host_key = signing_key.verify_key.encode().hex()
+        self.port = get_free_port()
+        self.dsn = 'sqlite:' + os.path.join(self.dir, 'encsend.db')
+        with connect(self.dsn) as conn:
+            migrate(conn)
+            conn.execute(INSERT['hosts'], (self.host_key, '127.0.0.1',
+                                           self.port))
+            conn.commit()
+
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.server = EncSendServer(self.loop, '127.0.0.1', self.port,
+                                    self.dsn, self.key_path,
+                                    files_dir=self.dir, metrics_port=None)
+        self.server.start()
+
+    def tearDown(self):
+        self.server.stop()
+        self.loop.run_until_complete(self.server.wait())
+        self.loop.close()
+        asyncio.set_event_loop(None)
+        shutil.rmtree(self.dir)
+
+    def run_in_thread(self, func, *args):
+        """ Run blocking client code while the server is running """
+        return self.loop.run_until_complete(
+            self.loop.run_in_executor(None, func, *args)
+        )
+
+    def get_rows(self, query, count, timeout=5):
+        """ Wait until the query returns `count` rows """
+        deadline = time.monotonic() + timeout
+        while True:
+            self.loop.run_until_complete(asyncio.sleep(0.05))
+            with connect(self.dsn) as conn:
+                rows = conn.execute(query).fetchall()
+            if len(rows) >= count or time.monotonic() > deadline:
+                return rows
+
+    def get_rejected(self, reason):
+        return self.server.metrics.rejected.values.get(
+            (('reason', reason),), 0
+        )
@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+
+from encsend.client import EncSendClient
+from encsend.protocol import KEYED_VERSION, VERSION
+
+from .base import ServerTestCase
+
+
+class BatchTest(ServerTestCase):
+    """ Messages sent in a batch are all received """
+    def send_batch(self, items, protocol_version):
+        client = EncSendClient(self.dsn, self.key_path,
+                               protocol_version=protocol_version)
+        try:
+            client.send_batch(items)
+        finally:
+            client.close()
+
+    def check_duplicates(self, protocol_version):
+        items = [('dup', self.host_key, None), ('dup', self.host_key, None),
+                 ('x', self.host_key, None), ('dup', [self.host_key], None)]
+        self.run_in_thread(self.send_batch, items, protocol_version)
+        rows = self.get_rows('SELECT message FROM messages_t', len(items))
+        self.assertEqual(sorted(message for message, in rows),
+                         ['dup', 'dup', 'dup', 'x'])
+        self.assertEqual(self.get_rejected('replay'), 0)
+
+    def test_duplicates(self):
+        self.check_duplicates(VERSION)
+
+    def test_duplicates_keyed(self):
+        self.check_duplicates(KEYED_VERSION)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+""" Micro benchmarks, results are printed as a table, run them with more
+messages and captured output shown:
+
+    ENCSEND_BENCH_ITERATIONS=10000 python -m pytest -s tests/test_bench.py
+"""
+
+import os
+import time
+import unittest
+
+from nacl.signing import SigningKey
+
+from encsend.bench import format_results, summarize
+from encsend.client import ClientBase
+from encsend.protocol import KEYED_VERSION
+from encsend.server.replay import ReplayCache
+
+from .base import ServerTestCase
+
+# Number of messages of every size
+ITERATIONS = int(os.environ.get('ENCSEND_BENCH_ITERATIONS', 100))
+SIZES = (64, 1024, 16 * 1024, 256 * 1024)
+# Number of receivers of every message in multi-recipient benchmark
+RECIPIENTS = 10
+
+
+def measure(func, args):
+    """ Call the function with every item of args, return summary """
+    durations = []
+    for item in args:
+        start = time.perf_counter()
+        func(*item)
+        durations.append(time.perf_counter() - start)
+    return summarize(durations)
+
+
+class BenchTest(ServerTestCase):
+    """ The server's host sends messages to itself """
+    results = {}
+
+    @classmethod
+    def tearDownClass(cls):
+        print('\n' + format_results(cls.results))
+
+    def test_encrypt_message(self):
+        """ `ClientBase.encrypt_message` """
+        client = ClientBase(self.key_path)
+        self.results['encrypt_message'] = {
+            size: measure(client.encrypt_message,
+                          [(os.urandom(size), client.verify_key_hex)] *
+                          ITERATIONS)
+            for size in SIZES
+        }
+
+    def test_encrypt_multi(self):
+        """ `ClientBase.encrypt_multi` with protocol version 3 """
+        client = ClientBase(self.key_path, protocol_version=KEYED_VERSION)
+        host_keys = [SigningKey.generate().verify_key.encode().hex().encode()
+                     for _ in range(RECIPIENTS)]
+        self.results['encrypt_multi'] = {
+            size: measure(client.encrypt_multi,
+                          [(os.urandom(size), host_keys)] * ITERATIONS)
+            for size in SIZES
+        }
+
+    def test_read_message(self):
+        """ `EncSendServer.read_message`, sender is in the hosts registry,
+        so db isn't used
+        """
+        client = ClientBase(self.key_path)
+        self.loop.run_until_complete(self.server.get_host(self.host_key))
+
+        def read(data):
+            result = self.loop.run_until_complete(
+                self.server.read_message(data)
+            )
+            self.assertIsNotNone(result)
+
+        self.results['read_message'] = {}
+        for size in SIZES:
+            # Every message has it's own id, so copies aren't replays
+            self.server.replay_cache = ReplayCache(
+                self.server.replay_cache.window, ITERATIONS
+            )
+            messages = [(client.encrypt_message(b'x' * size,
+                                                client.verify_key_hex),)
+                        for _ in range(ITERATIONS)]
+            self.results['read_message'][size] = measure(read, messages)
+
+
+if __name__ == '__main__':
+    unittest.main()
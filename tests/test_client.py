@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import time
+import unittest
+
+from nacl.signing import SigningKey
+
+from encsend.client import DeliveryError, EncSendClient, is_closed
+from encsend.migrations import migrate
+from encsend.sql import INSERT
+
+
+class ConnectionTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        key_path = os.path.join(self.dir, 'host_signature')
+        with open(key_path, 'wb') as f:
+            f.write(bytes(SigningKey.generate()))
+        self.client = EncSendClient('sqlite:' + os.path.join(self.dir, 'db'),
+                                    key_path)
+        self.listener = socket.socket()
+        self.listener.bind(('127.0.0.1', 0))
+        self.listener.listen()
+        self.address = self.listener.getsockname()
+
+    def tearDown(self):
+        self.client.close()
+        self.listener.close()
+        shutil.rmtree(self.dir)
+
+    def test_reconnect_closed(self):
+        """ Connection closed by the server while idle isn't reused, data
+        sent to it would be lost
+        """
+        sock = self.client.get_connection(*self.address)
+        conn, _ = self.listener.accept()
+        self.assertFalse(is_closed(sock))
+        self.assertIs(self.client.get_connection(*self.address), sock)
+
+        conn.close()
+        time.sleep(0.05)
+        self.assertTrue(is_closed(sock))
+        new_sock = self.client.get_connection(*self.address)
+        self.assertIsNot(new_sock, sock)
+
+        self.client.send_frame(*self.address, b'frame')
+        conn, _ = self.listener.accept()
+        with conn:
+            self.assertEqual(conn.recv(5), b'frame')
+
+    def test_file_connection_dropped(self):
+        """ Chunks aren't sent over a new connection if the stream's
+        connection drops, the file isn't reported as sent
+        """
+        path = os.path.join(self.dir, 'file')
+        with open(path, 'wb') as f:
+            f.write(os.urandom(10000))
+        host_key = SigningKey.generate().verify_key.encode().hex()
+        migrate(self.client.db_connection)
+        self.client.db_connection.execute(INSERT['hosts'],
+                                          (host_key,) + self.address)
+        self.client.db_connection.commit()
+
+        def drop():
+            conn, _ = self.listener.accept()
+            conn.recv(1)
+            conn.close()
+
+        thread = threading.Thread(target=drop)
+        thread.start()
+        try:
+            with self.assertRaises(DeliveryError):
+                self.client.send_file(path, host_key, chunk_size=100,
+                                      timeout=1)
+        finally:
+            thread.join()
+        self.assertNotIn(self.address, self.client.connections)
+
+        self.listener.settimeout(0.1)
+        with self.assertRaises(socket.timeout):
+            self.listener.accept()
+
+
+if __name__ == '__main__':
+    unittest.main()
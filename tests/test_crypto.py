@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from nacl.signing import SigningKey
+
+from encsend.client import ClientBase
+from encsend.protocol import KEYED_VERSION, SEALED_KEY_SIZE, unpack_nonce
+from encsend.server.crypto import unseal_keyed_envelope, verify_envelope
+
+
+class KeyedBatchTest(unittest.TestCase):
+    """ Protocol version 3 items are encrypted once for all receivers """
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        key_path = os.path.join(self.dir, 'host_signature')
+        self.signing_key = SigningKey.generate()
+        with open(key_path, 'wb') as f:
+            f.write(bytes(self.signing_key))
+        self.client = ClientBase(key_path, protocol_version=KEYED_VERSION)
+        self.receivers = [SigningKey.generate() for _ in range(3)]
+        self.host_keys = [receiver.verify_key.encode().hex().encode()
+                          for receiver in self.receivers]
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def open(self, receiver, data):
+        _, envelope = unseal_keyed_envelope(
+            receiver.to_curve25519_private_key(), data
+        )
+        message = verify_envelope(self.signing_key.verify_key, envelope,
+                                  1024)
+        return message, unpack_nonce(envelope)[1]
+
+    def test_shared_content_key(self):
+        """ Receivers of an item get the same ciphertext and message id """
+        copies, = self.client.encrypt_batch([(b'hello', self.host_keys)])
+        self.assertEqual(len(copies), len(self.receivers))
+        self.assertEqual({copy[SEALED_KEY_SIZE:] for copy in copies},
+                         {copies[0][SEALED_KEY_SIZE:]})
+        opened = {self.open(receiver, copy)
+                  for receiver, copy in zip(self.receivers, copies)}
+        self.assertEqual(len(opened), 1)
+        self.assertEqual(opened.pop()[0], 'hello')
+
+    def test_equal_items(self):
+        """ Items with equal messages get their own message ids """
+        items = [(b'hello', self.host_keys[:1])] * 2
+        (first,), (second,) = self.client.encrypt_batch(items)
+        receiver = self.receivers[0]
+        self.assertNotEqual(self.open(receiver, first)[1],
+                            self.open(receiver, second)[1])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+
+import time
+import unittest
+
+from nacl.signing import SigningKey
+
+from encsend.protocol import pack_announce
+from encsend.server.discovery import DiscoveryServer, PeerTable
+from encsend.sql import INSERT
+from encsend.storage import connect
+
+from .base import ServerTestCase
+
+
+class PeerTableTest(unittest.TestCase):
+    def test_max_size(self):
+        peers = PeerTable(2)
+        expires = time.time() + 60
+        self.assertTrue(peers.update('a', '10.0.0.1', 1, 1, expires))
+        self.assertTrue(peers.update('b', '10.0.0.2', 1, 1, expires))
+        self.assertIsNone(peers.update('c', '10.0.0.3', 1, 1, expires))
+        # Known peers are still refreshed
+        self.assertTrue(peers.update('a', '10.0.0.4', 1, 2, expires))
+        self.assertEqual(len(peers), 2)
+
+
+class DiscoveryTest(ServerTestCase):
+    def setUp(self):
+        super().setUp()
+        self.discovery = DiscoveryServer(
+            self.loop, '127.0.0.1', 0, self.dsn, self.key_path,
+            '127.0.0.1', add_hosts=True
+        )
+        self.loop.run_until_complete(self.discovery.init_db())
+        self.timestamp = int(time.time() * 1000)
+
+    def tearDown(self):
+        self.discovery.db_pool.close()
+        self.loop.run_until_complete(self.discovery.db_pool.wait_closed())
+        super().tearDown()
+
+    def receive(self, signing_key, host, addr):
+        # Announcements of a peer are accepted only in order
+        self.timestamp += 1
+        data = pack_announce(signing_key, signing_key.verify_key.encode(),
+                             host, 8888, 60, self.timestamp)
+        self.discovery.datagram_received(data, (addr, 8890))
+        self.loop.run_until_complete(self.discovery.flush())
+
+    def get_address(self, host_key):
+        with connect(self.dsn) as conn:
+            return conn.execute(
+                'SELECT host, port FROM hosts_t WHERE host_key = ?',
+                (host_key,)
+            ).fetchone()
+
+    def test_unsigned_address(self):
+        """ Replayed announcement doesn't move a known host """
+        signing_key = SigningKey.generate()
+        host_key = signing_key.verify_key.encode().hex()
+        with connect(self.dsn) as conn:
+            conn.execute(INSERT['hosts'], (host_key, '10.0.0.1', 8888))
+            conn.commit()
+
+        self.receive(signing_key, '', '10.0.0.66')
+        self.assertEqual(self.get_address(host_key), ('10.0.0.1', 8888))
+
+        # Signed host is trusted
+        self.receive(signing_key, '10.0.0.2', '10.0.0.66')
+        self.assertEqual(self.get_address(host_key), ('10.0.0.2', 8888))
+
+    def test_new_host(self):
+        """ Unknown host is added with the source address """
+        signing_key = SigningKey.generate()
+        host_key = signing_key.verify_key.encode().hex()
+        self.receive(signing_key, '', '10.0.0.3')
+        self.assertEqual(self.get_address(host_key), ('10.0.0.3', 8888))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+
+import os
+import socket
+import unittest
+from functools import partial
+
+from encsend.client import DeliveryError, EncSendClient
+from encsend.protocol import NACK_ERROR, NACK_TOO_LARGE
+from encsend.storage import connect
+
+from .base import ServerTestCase
+
+
+class FileTest(ServerTestCase):
+    def test_replayed_stream(self):
+        """ Captured file transfer sent again isn't stored again """
+        path = os.path.join(self.dir, 'file.txt')
+        with open(path, 'wb') as f:
+            f.write(os.urandom(1000))
+        client = EncSendClient(self.dsn, self.key_path)
+        try:
+            frames = b''.join(client.file_frames(path,
+                                                 self.host_key.encode()))
+        finally:
+            client.close()
+
+        def send():
+            for _ in range(2):
+                with socket.create_connection(('127.0.0.1', self.port)) as s:
+                    s.sendall(frames)
+
+        self.run_in_thread(send)
+        rows = self.get_rows('SELECT name FROM files_t', 2, timeout=1)
+        self.assertEqual(rows, [('file.txt',)])
+        self.assertEqual(self.get_rejected('replay'), 1)
+
+    def test_acked(self):
+        """ File is acked after it's saved, rejected file is an error """
+        path = os.path.join(self.dir, 'file.txt')
+        with open(path, 'wb') as f:
+            f.write(os.urandom(100000))
+        client = EncSendClient(self.dsn, self.key_path)
+        try:
+            self.run_in_thread(partial(client.send_file, path,
+                                       self.host_key, chunk_size=1000))
+            rows = self.get_rows('SELECT size FROM files_t', 1, timeout=0)
+            self.assertEqual(rows, [(100000,)])
+
+            self.server.max_file_size = 1000
+            with self.assertRaises(DeliveryError) as ctx:
+                self.run_in_thread(client.send_file, path, self.host_key)
+            self.assertEqual(ctx.exception.statuses, [NACK_TOO_LARGE])
+        finally:
+            client.close()
+
+    def test_not_saved(self):
+        """ File isn't left on disk if it's row wasn't inserted """
+        path = os.path.join(self.dir, 'file.txt')
+        with open(path, 'wb') as f:
+            f.write(os.urandom(1000))
+        with connect(self.dsn) as conn:
+            conn.execute('DROP TABLE files_t')
+            conn.commit()
+        client = EncSendClient(self.dsn, self.key_path)
+        try:
+            with self.assertRaises(DeliveryError) as ctx:
+                self.run_in_thread(client.send_file, path, self.host_key)
+            self.assertEqual(ctx.exception.statuses, [NACK_ERROR])
+        finally:
+            client.close()
+        files = [name for name in os.listdir(self.dir)
+                 if not name.startswith('encsend.db')]
+        self.assertEqual(sorted(files), ['file.txt', 'host_signature'])
+
+
+if __name__ == '__main__':
+    unittest.main()
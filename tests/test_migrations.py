@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from encsend import migrations
+from encsend.migrations import LATEST_VERSION, get_version, migrate
+from encsend.storage import connect
+
+
+class MigrationsTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.conn = connect('sqlite:' + os.path.join(self.dir, 'db'))
+
+    def tearDown(self):
+        self.conn.close()
+        shutil.rmtree(self.dir)
+
+    def get_tables(self):
+        rows = self.conn.execute('SELECT name FROM sqlite_master '
+                                 'WHERE type = \'table\'').fetchall()
+        return {name for name, in rows}
+
+    def test_migrate(self):
+        applied = migrate(self.conn)
+        self.assertEqual(applied, list(range(1, LATEST_VERSION + 1)))
+        self.assertEqual(get_version(self.conn), LATEST_VERSION)
+        self.assertEqual(migrate(self.conn), [])
+
+    def test_failed_migration(self):
+        """ Statements of a failed migration are rolled back """
+        failing = migrations.MIGRATIONS[:1] + (
+            (2, 'broken', ('CREATE TABLE applied_t (id INTEGER)',
+                           'CREATE TABLE broken_t (')),
+        )
+        with mock.patch.object(migrations, 'MIGRATIONS', failing):
+            with self.assertRaises(Exception):
+                migrate(self.conn)
+        self.assertEqual(get_version(self.conn), 1)
+        self.assertNotIn('applied_t', self.get_tables())
+
+
+if __name__ == '__main__':
+    unittest.main()
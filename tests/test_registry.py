@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+
+from encsend.storage import connect
+
+from .base import ServerTestCase
+
+
+class RegistryTest(ServerTestCase):
+    def test_reload_forgets_hosts(self):
+        """ Host removed from db isn't trusted after SIGHUP reload """
+        host = self.loop.run_until_complete(self.server.get_host(
+            self.host_key
+        ))
+        self.assertIsNotNone(host)
+        with connect(self.dsn) as conn:
+            conn.execute('DELETE FROM hosts_t')
+            conn.commit()
+        self.assertIsNotNone(self.server.registry.get(self.host_key))
+
+        self.server.reload_keys()
+        host = self.loop.run_until_complete(self.server.get_host(
+            self.host_key
+        ))
+        self.assertIsNone(host)
+
+
+if __name__ == '__main__':
+    unittest.main()
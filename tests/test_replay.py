@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+
+import os
+import time
+import unittest
+
+from encsend.server.crypto import (REJECT_BUSY, REJECT_REPLAY, REJECT_STALE,
+                                   Rejected)
+from encsend.server.replay import ReplayCache
+
+
+def now_ms():
+    return int(time.time() * 1000)
+
+
+class ReplayCacheTest(unittest.TestCase):
+    def assertRejected(self, reason, cache, key, timestamp):
+        with self.assertRaises(Rejected) as ctx:
+            cache.add(key, timestamp)
+        self.assertEqual(ctx.exception.reason, reason)
+
+    def test_replay(self):
+        cache = ReplayCache(300, 1000)
+        key = (1, os.urandom(16))
+        timestamp = now_ms()
+        cache.add(key, timestamp)
+        self.assertRejected(REJECT_REPLAY, cache, key, timestamp)
+        self.assertRejected(REJECT_STALE, cache, (1, os.urandom(16)),
+                            timestamp - 301 * 1000)
+
+    def test_overflow(self):
+        cache = ReplayCache(300, 1000)
+        burst = [((1, os.urandom(16)), now_ms()) for _ in range(1000)]
+        for key, timestamp in burst:
+            cache.add(key, timestamp)
+        self.assertRejected(REJECT_BUSY, cache, (1, os.urandom(16)),
+                            now_ms())
+        self.assertEqual(len(cache), 1000)
+
+        # Accepted ids are still remembered
+        for key, timestamp in burst:
+            self.assertRejected(REJECT_REPLAY, cache, key, timestamp)
+
+        # Skewed messages of other hosts wait for room, they aren't stale
+        self.assertRejected(REJECT_BUSY, cache, (2, os.urandom(16)),
+                            now_ms() - 2000)
+        cache.discard(burst[0][0])
+        cache.add((2, os.urandom(16)), now_ms() - 2000)
+
+    def test_busy_host(self):
+        cache = ReplayCache(300, 1000, 500)
+        accepted = 0
+        for _ in range(1000):
+            try:
+                cache.add((1, os.urandom(16)), now_ms())
+                accepted += 1
+            except Rejected as e:
+                self.assertEqual(e.reason, REJECT_BUSY)
+        self.assertEqual(accepted, 500)
+
+        # Other hosts within the window aren't affected by the busy one
+        for skew in (2000, 250000, -2000):
+            for _ in range(100):
+                cache.add((2, os.urandom(16)), now_ms() - skew)
+        self.assertEqual(len(cache), 800)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from encsend.storage import normalize_dsn
+
+
+class NormalizeDsnTest(unittest.TestCase):
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.dir)
+
+    def test_sqlite(self):
+        """ The same relative DSN refers to different dbs in different
+        directories, absolute DSNs of the same db are equal
+        """
+        os.chdir(self.dir)
+        dsn = normalize_dsn('sqlite:sqlite.db')
+        self.assertEqual(dsn, 'sqlite:' + os.path.join(os.getcwd(),
+                                                       'sqlite.db'))
+        self.assertEqual(normalize_dsn('sqlite://' + dsn[7:]), dsn)
+        self.assertEqual(normalize_dsn('sqlite:../%s/sqlite.db'
+                                       % os.path.basename(self.dir)), dsn)
+        os.chdir(self.cwd)
+        self.assertNotEqual(normalize_dsn('sqlite:sqlite.db'), dsn)
+
+    def test_other(self):
+        for dsn in ('memory:', 'memory:test', 'Driver=SQLite3;Database=db'):
+            self.assertEqual(normalize_dsn(dsn), dsn)
+
+
+if __name__ == '__main__':
+    unittest.main()